@@ -0,0 +1,135 @@
+
+"""Recall/latency benchmark for Chroma HNSW settings.
+
+Builds a synthetic corpus (or samples vectors from an existing collection),
+indexes it once per (M, ef_construction, ef_search) setting and reports recall@k
+against exact brute-force search plus p50/p99 query latency for every k.
+
+    python benchmark_ann.py --corpus-size 20000 --m 16 32 --ef-search 10 50 100
+    python benchmark_ann.py --sample-from langchain --k 4 8 --json results.json
+
+The chosen ef_search goes in HNSW_EF_SEARCH, which the API also applies to
+existing collections when it opens them (Chroma 1.x; older versions only use it
+for new collections). M and ef_construction only apply to new collections.
+"""
+from chroma_utils import CHROMA_DB_PATH
+import argparse
+import json
+import tempfile
+import time
+import chromadb
+import numpy as np
+
+def synthetic_corpus(size, dim, clusters, rng):
+    # Clustered data is closer to real embeddings than uniform noise and
+    # makes approximate search measurably harder.
+    centers = rng.normal(size=(clusters, dim))
+    assignments = rng.integers(0, clusters, size=size)
+    vectors = centers[assignments] + 0.35 * rng.normal(size=(size, dim))
+    return normalize(vectors.astype(np.float32))
+
+def sampled_corpus(collection_name, size):
+    client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+    collection = client.get_collection(collection_name)
+    batch = collection.get(limit=size, include=["embeddings"])
+    return normalize(np.asarray(batch["embeddings"], dtype=np.float32))
+
+def normalize(vectors):
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def make_queries(corpus, count, rng):
+    picks = corpus[rng.integers(0, len(corpus), size=count)]
+    return normalize(picks + 0.1 * rng.normal(size=picks.shape).astype(np.float32))
+
+def exact_neighbors(corpus, queries, k):
+    scores = queries @ corpus.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return [set(row) for row in top]
+
+def build_collection(client, corpus, m, ef_construction, ef_search, batch_size=5000):
+    name = f"bench-m{m}-efc{ef_construction}-efs{ef_search}"
+    collection = client.create_collection(
+        name,
+        metadata={
+            "hnsw:space": "cosine",
+            "hnsw:M": m,
+            "hnsw:construction_ef": ef_construction,
+            "hnsw:search_ef": ef_search,
+        },
+    )
+    started = time.perf_counter()
+    for start in range(0, len(corpus), batch_size):
+        batch = corpus[start:start + batch_size]
+        collection.add(ids=[str(i) for i in range(start, start + len(batch))], embeddings=batch.tolist())
+    return collection, time.perf_counter() - started
+
+def measure(collection, queries, truth, k):
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, truth):
+        started = time.perf_counter()
+        result = collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])
+        latencies.append(time.perf_counter() - started)
+        hits += len(expected & {int(i) for i in result["ids"][0]})
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "recall": hits / (len(queries) * k),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+    }
+
+def run(args):
+    rng = np.random.default_rng(args.seed)
+    if args.sample_from:
+        corpus = sampled_corpus(args.sample_from, args.corpus_size)
+    else:
+        corpus = synthetic_corpus(args.corpus_size, args.dim, args.clusters, rng)
+    queries = make_queries(corpus, args.queries, rng)
+    truth = {k: exact_neighbors(corpus, queries, k) for k in args.k}
+    print(f"corpus={len(corpus)} dim={corpus.shape[1]} queries={len(queries)}")
+    print(f"{'M':>4} {'ef_c':>5} {'ef_s':>5} {'k':>3} {'build_s':>8} {'recall':>7} {'p50_ms':>7} {'p99_ms':>7}")
+
+    results = []
+    with tempfile.TemporaryDirectory() as path:
+        client = chromadb.PersistentClient(path=path)
+        for m in args.m:
+            for ef_construction in args.ef_construction:
+                for ef_search in args.ef_search:
+                    # ef_search is read when Chroma loads the index, so each value gets its own build.
+                    collection, build_seconds = build_collection(client, corpus, m, ef_construction, ef_search)
+                    for k in args.k:
+                        row = {
+                            "M": m,
+                            "ef_construction": ef_construction,
+                            "ef_search": ef_search,
+                            "k": k,
+                            "build_seconds": build_seconds,
+                            **measure(collection, queries, truth[k], k),
+                        }
+                        results.append(row)
+                        print(
+                            f"{m:>4} {ef_construction:>5} {ef_search:>5} {k:>3} {build_seconds:>8.2f} "
+                            f"{row['recall']:>7.3f} {row['p50_ms']:>7.2f} {row['p99_ms']:>7.2f}"
+                        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus-size", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--sample-from", help="Sample vectors from this collection in chroma_db instead of synthesizing")
+    parser.add_argument("--m", type=int, nargs="+", default=[16])
+    parser.add_argument("--ef-construction", type=int, nargs="+", default=[100])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[10, 50, 100])
+    parser.add_argument("--k", type=int, nargs="+", default=[4])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this file")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    run(parse_args())
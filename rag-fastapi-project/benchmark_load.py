@@ -0,0 +1,367 @@
+
+"""Offline load test for the RAG API with stubbed OpenAI models.
+
+Starts main.py under uvicorn in a scratch directory with deterministic local
+stand-ins for ChatOpenAI and OpenAIEmbeddings (with configurable latency),
+generates a synthetic corpus and drives /upload-doc, /chat and /delete-doc at a
+target concurrency. Reports throughput and p50/p95/p99 latency per phase.
+
+    python benchmark_load.py --docs 50 --chats 500 --concurrency 16 --json run.json
+    python benchmark_load.py --llm-latency 0.5 --compare baseline.json --max-regression 0.2
+
+Results carry the git commit and the run settings, so two runs with the same
+settings can be compared with --compare; the exit status is 1 when throughput
+drops or p95 grows by more than --max-regression.
+"""
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import types
+import httpx
+import numpy as np
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Stub behaviour, set from the command line in the server process.
+STUB_SETTINGS = {
+    "llm_latency": 0.0,
+    "llm_token_latency": 0.0,
+    "answer_tokens": 40,
+    "embed_latency": 0.0,
+    "embed_text_latency": 0.0,
+    "embed_dim": 384,
+}
+
+class StubChatModel(BaseChatModel):
+    """Deterministic ChatOpenAI stand-in that echoes the question after a fixed delay."""
+
+    def __init__(self, **kwargs):
+        super().__init__()
+
+    @property
+    def _llm_type(self):
+        return "stub-chat"
+
+    def _tokens(self, messages):
+        words = messages[-1].content.split() or ["empty"]
+        return [words[i % len(words)] for i in range(STUB_SETTINGS["answer_tokens"])]
+
+    def _usage(self, messages, tokens):
+        input_tokens = sum(len(message.content) for message in messages) // 4 + 1
+        return {"input_tokens": input_tokens, "output_tokens": len(tokens), "total_tokens": input_tokens + len(tokens)}
+
+    def _delay(self, tokens):
+        return STUB_SETTINGS["llm_latency"] + STUB_SETTINGS["llm_token_latency"] * len(tokens)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self._tokens(messages)
+        time.sleep(self._delay(tokens))
+        message = AIMessage(content=" ".join(tokens), usage_metadata=self._usage(messages, tokens))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self._tokens(messages)
+        await asyncio.sleep(self._delay(tokens))
+        message = AIMessage(content=" ".join(tokens), usage_metadata=self._usage(messages, tokens))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self._tokens(messages)
+        time.sleep(STUB_SETTINGS["llm_latency"])
+        for token in tokens:
+            time.sleep(STUB_SETTINGS["llm_token_latency"])
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token + " "))
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(messages, tokens)))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self._tokens(messages)
+        await asyncio.sleep(STUB_SETTINGS["llm_latency"])
+        for token in tokens:
+            await asyncio.sleep(STUB_SETTINGS["llm_token_latency"])
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token + " "))
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(messages, tokens)))
+
+class StubEmbeddings(Embeddings):
+    """Deterministic OpenAIEmbeddings stand-in: hashed bag of words, L2-normalized."""
+
+    def __init__(self, **kwargs):
+        self.model = "stub-embedding"
+        self.dim = STUB_SETTINGS["embed_dim"]
+
+    def _embed(self, text):
+        vector = [0.0] * self.dim
+        for word in text.lower().split():
+            digest = hashlib.md5(word.encode("utf-8")).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.dim] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts):
+        time.sleep(STUB_SETTINGS["embed_latency"] + STUB_SETTINGS["embed_text_latency"] * len(texts))
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+def serve(args):
+    STUB_SETTINGS.update({key: getattr(args, key) for key in STUB_SETTINGS})
+    # A stand-in module rather than a patched one, so startup does not pay for
+    # importing the real OpenAI client.
+    stubs = types.ModuleType("langchain_openai")
+    stubs.ChatOpenAI = StubChatModel
+    stubs.OpenAIEmbeddings = StubEmbeddings
+    sys.modules["langchain_openai"] = stubs
+    import uvicorn
+    import main
+    uvicorn.run(main.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+WORDS = (
+    "supplier invoice delivery warranty clause payment schedule widget module "
+    "firmware sensor calibration tolerance shipment contract renewal audit "
+    "latency throughput replica cluster backup policy incident escalation"
+).split()
+
+def synthetic_corpus(directory, count, paragraphs, rng):
+    documents = []
+    for i in range(count):
+        lines = []
+        for p in range(paragraphs):
+            part = f"PART-{i:04d}-{p:02d}"
+            words = " ".join(rng.choice(WORDS) for _ in range(60))
+            lines.append(f"{part} covers {words}.")
+        path = os.path.join(directory, f"doc_{i:04d}.txt")
+        with open(path, "w") as f:
+            f.write("\n\n".join(lines))
+        documents.append(path)
+    return documents
+
+def make_queries(count, docs, paragraphs, rng):
+    queries = []
+    for _ in range(count):
+        if rng.random() < 0.5:
+            queries.append(f"What is PART-{rng.randrange(docs):04d}-{rng.randrange(paragraphs):02d}?")
+        else:
+            queries.append(f"Tell me about the {rng.choice(WORDS)} {rng.choice(WORDS)} terms")
+    return queries
+
+def summarize(latencies, errors, elapsed):
+    latencies_ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "seconds": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+    }
+
+async def drive(items, concurrency, request):
+    """Call `request(item)` for every item with at most `concurrency` in flight."""
+    latencies = []
+    errors = 0
+    results = [None] * len(items)
+    pending = iter(enumerate(items))
+
+    async def worker():
+        nonlocal errors
+        for i, item in pending:
+            started = time.perf_counter()
+            try:
+                results[i] = await request(item)
+                latencies.append(time.perf_counter() - started)
+            except Exception:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results, summarize(latencies, errors, time.perf_counter() - started)
+
+async def run_phases(client, args, documents, queries):
+    phases = {}
+
+    async def upload(path):
+        with open(path, "rb") as f:
+            response = await client.post("/upload-doc", files={"file": (os.path.basename(path), f, "text/plain")})
+        response.raise_for_status()
+        return response.json()
+
+    jobs, phases["upload"] = await drive(documents, args.concurrency, upload)
+
+    # Time until every accepted upload has been parsed, embedded and indexed.
+    started = time.perf_counter()
+    doc_ids = []
+    for job in jobs:
+        if job is None:
+            continue
+        while True:
+            status = (await client.get(f"/jobs/{job['job_id']}")).json()
+            if status["status"] in ("completed", "failed"):
+                break
+            await asyncio.sleep(0.05)
+        if status["status"] == "completed":
+            doc_ids.append(job["doc_id"])
+    elapsed = time.perf_counter() - started + phases["upload"]["seconds"]
+    phases["ingest"] = {"documents": len(doc_ids), "seconds": elapsed, "throughput": len(doc_ids) / elapsed}
+
+    async def chat(item):
+        i, query = item
+        session_id = f"bench-{i % args.sessions}"
+        response = await client.post("/chat", json={"query": query, "session_id": session_id})
+        response.raise_for_status()
+
+    _, phases["chat"] = await drive(list(enumerate(queries)), args.concurrency, chat)
+
+    async def delete(doc_id):
+        response = await client.post("/delete-doc", json={"doc_id": doc_id})
+        response.raise_for_status()
+
+    _, phases["delete"] = await drive(doc_ids, args.concurrency, delete)
+    return phases
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(args, workdir, port):
+    command = [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port)]
+    for key in STUB_SETTINGS:
+        command += [f"--{key.replace('_', '-')}", str(getattr(args, key))]
+    env = dict(os.environ, PYTHONPATH=PROJECT_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    return subprocess.Popen(command, cwd=workdir, env=env)
+
+async def wait_ready(client, server, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with status {server.returncode}")
+        try:
+            if (await client.get("/ready")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.1)
+    raise TimeoutError("Server did not become ready")
+
+def git_commit():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--", "."], cwd=PROJECT_DIR, capture_output=True, text=True).stdout
+        return commit + ("-dirty" if dirty.strip() else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def settings(args):
+    keys = ("docs", "paragraphs", "chats", "sessions", "concurrency", "seed", *STUB_SETTINGS)
+    return {key: getattr(args, key) for key in keys}
+
+async def benchmark(args):
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as workdir:
+        corpus_dir = os.path.join(workdir, "corpus")
+        os.makedirs(corpus_dir)
+        documents = synthetic_corpus(corpus_dir, args.docs, args.paragraphs, rng)
+        queries = make_queries(args.chats, args.docs, args.paragraphs, rng)
+        port = free_port()
+        server = start_server(args, workdir, port)
+        try:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=args.timeout) as client:
+                await wait_ready(client, server)
+                phases = await run_phases(client, args, documents, queries)
+        finally:
+            server.terminate()
+            server.wait()
+    return {"commit": git_commit(), "created_at": time.time(), "settings": settings(args), "phases": phases}
+
+def print_results(result):
+    print(f"commit={result['commit']} settings={json.dumps(result['settings'])}")
+    print(f"{'phase':>8} {'requests':>8} {'errors':>6} {'req/s':>8} {'p50_ms':>8} {'p95_ms':>8} {'p99_ms':>8}")
+    for name, phase in result["phases"].items():
+        if "p50_ms" in phase:
+            print(
+                f"{name:>8} {phase['requests']:>8} {phase['errors']:>6} {phase['throughput']:>8.2f} "
+                f"{phase['p50_ms']:>8.1f} {phase['p95_ms']:>8.1f} {phase['p99_ms']:>8.1f}"
+            )
+        else:
+            print(f"{name:>8} {phase['documents']:>8} {'':>6} {phase['throughput']:>8.2f}  (documents indexed per second)")
+
+def compare(result, baseline, max_regression):
+    """Print per-phase changes against `baseline` and return the list of regressions."""
+    if baseline["settings"] != result["settings"]:
+        print("warning: baseline was run with different settings, numbers are not directly comparable")
+    print(f"compared with {baseline['commit']}:")
+    regressions = []
+    for name, phase in result["phases"].items():
+        old = baseline["phases"].get(name)
+        if old is None:
+            continue
+        throughput_change = phase["throughput"] / old["throughput"] - 1 if old["throughput"] else 0.0
+        line = f"{name:>8} throughput {throughput_change:+.1%}"
+        if throughput_change < -max_regression:
+            regressions.append(f"{name} throughput")
+        if "p95_ms" in phase and old.get("p95_ms"):
+            p95_change = phase["p95_ms"] / old["p95_ms"] - 1
+            line += f"  p95 {p95_change:+.1%}"
+            if p95_change > max_regression:
+                regressions.append(f"{name} p95")
+        print(line)
+    return regressions
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=20)
+    parser.add_argument("--paragraphs", type=int, default=20, help="Paragraphs per synthetic document")
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Seconds per LLM call")
+    parser.add_argument("--llm-token-latency", type=float, default=0.0, help="Extra seconds per generated token")
+    parser.add_argument("--answer-tokens", type=int, default=40)
+    parser.add_argument("--embed-latency", type=float, default=0.01, help="Seconds per embedding request")
+    parser.add_argument("--embed-text-latency", type=float, default=0.0, help="Extra seconds per embedded text")
+    parser.add_argument("--embed-dim", type=int, default=384)
+    parser.add_argument("--json", help="Also write the results to this file")
+    parser.add_argument("--compare", help="Results file of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=8000, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+def run(args):
+    result = asyncio.run(benchmark(args))
+    print_results(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(result, json.load(f), args.max_regression)
+        if regressions:
+            print("regressions: " + ", ".join(regressions))
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.serve:
+        serve(args)
+    else:
+        sys.exit(run(args))
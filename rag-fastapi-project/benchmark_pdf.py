@@ -0,0 +1,109 @@
+
+"""Pages-per-second benchmark for the PDF extraction engines.
+
+Extracts every page of the given PDFs (or of generated sample PDFs) with each
+engine, once in a single process and once parsed and split in page windows on
+a process pool the way ingestion does, and reports pages per second.
+
+    python benchmark_pdf.py --pages 300 --documents 3 --processes 4
+    python benchmark_pdf.py contracts/*.pdf --engines pypdf pymupdf --json pdf.json
+"""
+from concurrent.futures import ProcessPoolExecutor
+from chroma_utils import PDF_PAGES_PER_TASK, import_pymupdf, iter_split_pdf, load_pdf_pages, pdf_page_count
+from benchmark_load import WORDS
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+def make_sample_pdf(path, pages, rng):
+    pymupdf = import_pymupdf()
+    pdf = pymupdf.open()
+    for number in range(pages):
+        page = pdf.new_page()
+        text = "\n\n".join(
+            f"Section {number}.{paragraph}. " + " ".join(rng.choice(WORDS) for _ in range(70))
+            for paragraph in range(6)
+        )
+        page.insert_textbox(page.rect + (50, 50, -50, -50), text, fontsize=9)
+    pdf.save(path)
+    pdf.close()
+
+def extract_serial(path, engine):
+    pages = pdf_page_count(path, engine)
+    characters = sum(len(page.page_content) for page in load_pdf_pages(path, 0, pages, engine))
+    return pages, characters
+
+def extract_parallel(path, engine, pool, max_pending):
+    chunks = list(iter_split_pdf(path, pool, max_pending, engine))
+    return pdf_page_count(path, engine), len(chunks)
+
+def measure(paths, run_once, runs):
+    """Return (median pages/s, total pages, last result detail) over `runs` passes across `paths`."""
+    rates = []
+    for _ in range(runs):
+        pages = detail = 0
+        started = time.perf_counter()
+        for path in paths:
+            count, extra = run_once(path)
+            pages += count
+            detail += extra
+        rates.append(pages / (time.perf_counter() - started))
+    return statistics.median(rates), pages, detail
+
+def run(args):
+    with tempfile.TemporaryDirectory() as workdir:
+        paths = args.paths
+        if not paths:
+            rng = random.Random(args.seed)
+            paths = []
+            for number in range(args.documents):
+                path = os.path.join(workdir, f"sample-{number}.pdf")
+                make_sample_pdf(path, args.pages, rng)
+                paths.append(path)
+
+        results = {}
+        with ProcessPoolExecutor(max_workers=args.processes) as pool:
+            # Start the workers before timing anything.
+            list(pool.map(abs, range(args.processes)))
+            for engine in args.engines:
+                serial_rate, pages, characters = measure(paths, lambda path: extract_serial(path, engine), args.runs)
+                parallel_rate, _, chunks = measure(
+                    paths, lambda path: extract_parallel(path, engine, pool, 2 * args.processes), args.runs
+                )
+                results[engine] = {
+                    "pages": pages,
+                    "characters": characters,
+                    "chunks": chunks,
+                    "serial_pages_per_second": serial_rate,
+                    "parallel_pages_per_second": parallel_rate,
+                }
+
+    print(f"{len(paths)} PDFs, {args.processes} processes, {PDF_PAGES_PER_TASK} pages per task")
+    print(f"{'engine':>8} {'pages':>7} {'chars':>10} {'chunks':>7} {'serial p/s':>11} {'parallel p/s':>13}")
+    for engine, result in results.items():
+        print(
+            f"{engine:>8} {result['pages']:>7} {result['characters']:>10} {result['chunks']:>7} "
+            f"{result['serial_pages_per_second']:>11.1f} {result['parallel_pages_per_second']:>13.1f}"
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="*", help="PDFs to extract; sample PDFs are generated when omitted")
+    parser.add_argument("--engines", nargs="+", default=["pypdf", "pymupdf"], choices=["pypdf", "pymupdf"])
+    parser.add_argument("--pages", type=int, default=200, help="Pages per generated sample PDF")
+    parser.add_argument("--documents", type=int, default=2, help="Number of generated sample PDFs")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this file")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    run(parse_args())
@@ -0,0 +1,123 @@
+
+"""Cold-start check for the RAG API.
+
+Measures, in fresh interpreters and an empty working directory, how long
+`import main` takes, how long the server takes to answer its first request,
+and how long until /ready reports healthy. The OpenAI models are replaced by
+the stubs from benchmark_load.py, so no credentials are needed.
+
+Most of the import is FastAPI and langchain_core (which pulls in langsmith and
+langchain_text_splitters), and the app cannot avoid them. Measured on the
+development machine, depending on load: `import main` took 1.2-1.5s, of which
+those libraries were 1.05-1.3s; the first response came after 1.7-2.1s and
+/ready after 2.5-3.0s. The budget therefore covers only the project's own share: the median
+import of main minus the median import of DEPENDENCY_MODULES. The command
+exits with status 1 when that share exceeds --import-budget.
+
+    python benchmark_startup.py --runs 5 --import-budget 0.3
+"""
+from benchmark_load import PROJECT_DIR, STUB_SETTINGS, free_port, start_server
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+
+# Third-party modules that `import main` needs at module level.
+DEPENDENCY_MODULES = [
+    "fastapi",
+    "prometheus_client",
+    "langchain_core.runnables.history",
+    "langchain_core.prompts",
+    "langchain_core.retrievers",
+    "langchain_core.embeddings",
+]
+# Seconds the project's own share of `import main` may take.
+IMPORT_BUDGET = 0.3
+
+IMPORT_SNIPPET = "import time; started = time.perf_counter(); import {modules}; print(time.perf_counter() - started)"
+
+def measure_import(workdir, modules=("main",)):
+    env = dict(os.environ, PYTHONPATH=PROJECT_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET.format(modules=", ".join(modules))],
+        cwd=workdir, env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+def measure_own_import(runs):
+    """Return (median import of main, median import of DEPENDENCY_MODULES), each in fresh interpreters."""
+    imports, dependencies = [], []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as workdir:
+            dependencies.append(measure_import(workdir, DEPENDENCY_MODULES))
+            imports.append(measure_import(workdir))
+    return statistics.median(imports), statistics.median(dependencies)
+
+def measure_startup(workdir, timeout=120):
+    """Return (seconds until the first response, seconds until /ready is 200)."""
+    port = free_port()
+    started = time.perf_counter()
+    server = start_server(argparse.Namespace(**STUB_SETTINGS), workdir, port)
+    serving = None
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=5) as client:
+            while time.perf_counter() - started < timeout:
+                if server.poll() is not None:
+                    raise RuntimeError(f"Server exited with status {server.returncode}")
+                try:
+                    status = client.get("/ready").status_code
+                except httpx.TransportError:
+                    time.sleep(0.01)
+                    continue
+                if serving is None:
+                    serving = time.perf_counter() - started
+                if status == 200:
+                    return serving, time.perf_counter() - started
+                time.sleep(0.01)
+    finally:
+        server.terminate()
+        server.wait()
+    raise TimeoutError("Server did not become ready")
+
+def run(args):
+    imports, dependencies = measure_own_import(args.runs)
+    serving, ready = [], []
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory() as workdir:
+            first, healthy = measure_startup(workdir)
+            serving.append(first)
+            ready.append(healthy)
+    result = {
+        "import_seconds": imports,
+        "dependency_import_seconds": dependencies,
+        "own_import_seconds": imports - dependencies,
+        "first_response_seconds": statistics.median(serving),
+        "ready_seconds": statistics.median(ready),
+    }
+    for key, value in result.items():
+        print(f"{key:>26} {value:.3f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    if result["own_import_seconds"] > args.import_budget:
+        print(f"own import time {result['own_import_seconds']:.3f}s exceeds the {args.import_budget:.3f}s budget")
+        return 1
+    return 0
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument(
+        "--import-budget", type=float, default=IMPORT_BUDGET,
+        help="Maximum seconds `import main` may add to the import of DEPENDENCY_MODULES",
+    )
+    parser.add_argument("--json", help="Also write the results to this file")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    sys.exit(run(parse_args()))
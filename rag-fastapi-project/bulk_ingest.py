@@ -0,0 +1,279 @@
+
+"""Bulk ingestion of a directory tree into the vector store.
+
+Files are parsed and split on a process pool, their chunks are pooled into
+large embedding batches and written to Chroma, the lexical index and the
+chunk manifest in bulk, and each finished file gets a row in `documents`.
+
+Progress is recorded per file in the `bulk_ingest_files` table, so an
+interrupted run can simply be started again: finished files are skipped,
+files that changed since their last run are re-indexed by diff under the same
+doc_id, and partially written files only embed their missing chunks.
+Files identical to an indexed document are mapped to its doc_id, and chunks
+that nearly duplicate an indexed chunk reuse its vector.
+
+    python bulk_ingest.py ./library --processes 8 --batch-size 1024
+
+Run it while the API is stopped; Chroma does not support two processes
+writing to the same persist directory.
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from chroma_utils import get_vector_store, load_and_split_document
+from lexical_utils import lexical_index
+from cache_utils import answer_cache
+from ingestion_utils import chunk_hash, chunk_id, file_sha256, index_document, own_entry_vectors
+from dedup_utils import ChunkDeduplicator
+from db_utils import (
+    insert_chunk_manifest, insert_documents, get_document_by_hash, get_bulk_ingest_files, upsert_bulk_ingest_files,
+)
+import argparse
+import logging
+import os
+import time
+import uuid
+
+logger = logging.getLogger("bulk_ingest")
+
+EXTENSIONS = (".pdf", ".docx", ".txt", ".md")
+
+def find_files(root, extensions):
+    for directory, subdirectories, filenames in os.walk(root):
+        subdirectories.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(extensions):
+                yield os.path.join(directory, filename)
+
+def split_file(path):
+    # Runs in a pool process; exceptions travel back through the future.
+    return file_sha256(path), load_and_split_document(path)
+
+class BulkWriter:
+    """Embeds chunks of many files in shared batches and marks files done once all their chunks are written."""
+
+    def __init__(self, batch_size, embed_workers):
+        self.vector_store = get_vector_store()
+        self.batch_size = batch_size
+        self.embed_workers = embed_workers
+        self.embed_pool = ThreadPoolExecutor(max_workers=embed_workers)
+        self.batch = []
+        self.in_flight = deque()
+        self.deduplicator = ChunkDeduplicator()
+        # doc_id -> [file row, chunks not yet written, chunk count, file hash]
+        self.files = {}
+        self.unrecorded = []
+        self.chunks_written = 0
+        self.chunks_deduplicated = 0
+        self.files_done = 0
+
+    def add_file(self, row, chunks, file_hash):
+        path, size, mtime, doc_id = row
+        self.files[doc_id] = [row, len(chunks), len(chunks), file_hash]
+        self.unrecorded.append(doc_id)
+        try:
+            for index, chunk in enumerate(chunks):
+                content_hash = chunk_hash(chunk)
+                chunk.metadata["doc_id"] = doc_id
+                chunk.metadata["chunk_index"] = index
+                self.batch.append((chunk_id(doc_id, index, content_hash), doc_id, index, content_hash, chunk))
+                if len(self.batch) >= self.batch_size:
+                    self.submit()
+        except Exception:
+            self.drop(doc_id)
+            raise
+        if not chunks:
+            self.finish([doc_id])
+
+    def drop(self, doc_id):
+        """Forget a file that failed while being added; none of its chunks still queued or in flight get written."""
+        self.files.pop(doc_id, None)
+        if doc_id in self.unrecorded:
+            self.unrecorded.remove(doc_id)
+        self.batch = [item for item in self.batch if item[1] != doc_id]
+
+    def submit(self):
+        if self.batch:
+            # Batches still in flight are known to the deduplicator, so their chunks count as indexed.
+            duplicates, new = self.deduplicator.assign([(item[0], item[4]) for item in self.batch])
+            texts = [item[4].page_content for item in self.batch if item[0] in new]
+            vectors = self.embed_pool.submit(self.vector_store.embeddings.embed_documents, texts)
+            self.in_flight.append((self.batch, duplicates, new, vectors))
+            self.batch = []
+        # Keep a few batches embedding while the oldest one is written.
+        while len(self.in_flight) > self.embed_workers:
+            self.write(*self.in_flight.popleft())
+
+    def write(self, batch, duplicates, new, vectors_future):
+        chunks_by_id = {item[0]: item[4] for item in batch}
+        vectors = dict(zip([cid for cid in chunks_by_id if cid in new], vectors_future.result()))
+        dropped = {item[0] for item in batch if item[1] not in self.files}
+        if dropped:
+            # A near duplicate of a dropped chunk finds no match in the store and is embedded after all.
+            self.deduplicator.forget({cid: value for cid, value in new.items() if cid in dropped})
+            batch = [item for item in batch if item[0] not in dropped]
+            duplicates = {cid: canonical for cid, canonical in duplicates.items() if cid not in dropped}
+            new = {cid: value for cid, value in new.items() if cid not in dropped}
+            vectors = {cid: vector for cid, vector in vectors.items() if cid not in dropped}
+        # Earlier batches are written by now, so every match is in the store or in this batch.
+        own = own_entry_vectors(self.vector_store, duplicates, chunks_by_id, vectors)
+        vectors.update(own)
+        # Files are marked as running before any of their chunks land, so a
+        # crash leaves them to be diffed on the next run.
+        if self.unrecorded:
+            upsert_bulk_ingest_files([
+                (*self.files[doc_id][0], "running", None, None) for doc_id in self.unrecorded if doc_id in self.files
+            ])
+            self.unrecorded = []
+        ids = list(vectors)
+        chunks = [chunks_by_id[cid] for cid in ids]
+        if ids:
+            self.vector_store._collection.upsert(
+                ids=ids,
+                embeddings=[list(map(float, vector)) for vector in vectors.values()],
+                metadatas=[chunk.metadata for chunk in chunks],
+                documents=[chunk.page_content for chunk in chunks],
+            )
+            lexical_index.add(ids, chunks)
+        insert_chunk_manifest([
+            (cid, doc_id, index, content_hash, None if cid in own else duplicates.get(cid))
+            for cid, doc_id, index, content_hash, _ in batch
+        ])
+        self.deduplicator.commit(new)
+        self.chunks_written += len(ids) - len(own)
+        self.chunks_deduplicated += len(duplicates)
+
+        finished = []
+        for _, doc_id, _, _, _ in batch:
+            self.files[doc_id][1] -= 1
+            if self.files[doc_id][1] == 0:
+                finished.append(doc_id)
+        self.finish(finished)
+
+    def finish(self, doc_ids):
+        if not doc_ids:
+            return
+        entries = [self.files.pop(doc_id) for doc_id in dict.fromkeys(doc_ids)]
+        insert_documents([(row[3], os.path.basename(row[0]), file_hash) for row, _, _, file_hash in entries])
+        upsert_bulk_ingest_files([(*row, "done", count, None) for row, _, count, _ in entries])
+        self.files_done += len(entries)
+
+    def close(self):
+        self.submit()
+        while self.in_flight:
+            self.write(*self.in_flight.popleft())
+        self.embed_pool.shutdown()
+
+def reindex_file(row, chunks, file_hash):
+    # A file seen before (changed, or interrupted mid-write) keeps its doc_id
+    # and only has its changed chunks embedded.
+    path, _, _, doc_id = row
+    added, kept, removed, deduplicated = index_document(doc_id, chunks)
+    if added or removed or deduplicated:
+        answer_cache.invalidate_document(doc_id)
+    insert_documents([(doc_id, os.path.basename(path), file_hash)])
+    upsert_bulk_ingest_files([(*row, "done", added + kept + deduplicated, None)])
+    return added, deduplicated
+
+def find_original(file_hash, new_hashes):
+    """doc_id of an indexed file, or of a new file of this run, with the same content hash."""
+    existing = get_document_by_hash(file_hash)
+    if existing is not None:
+        return existing["doc_id"]
+    return new_hashes.get(file_hash)
+
+def plan(root, extensions, retry_failed):
+    """Return (new file rows, previously seen file rows, skipped count) for the files under `root`."""
+    manifest = get_bulk_ingest_files()
+    new, seen, skipped = [], [], 0
+    for path in find_files(root, extensions):
+        stat = os.stat(path)
+        previous = manifest.get(path)
+        if previous is None:
+            new.append((path, stat.st_size, stat.st_mtime, str(uuid.uuid4())))
+            continue
+        unchanged = previous["size"] == stat.st_size and previous["mtime"] == stat.st_mtime
+        if unchanged and (previous["status"] in ("done", "duplicate") or (previous["status"] == "failed" and not retry_failed)):
+            skipped += 1
+            continue
+        if previous["status"] == "duplicate":
+            # The recorded doc_id belongs to the file this one used to be a copy of.
+            new.append((path, stat.st_size, stat.st_mtime, str(uuid.uuid4())))
+            continue
+        seen.append((path, stat.st_size, stat.st_mtime, previous["doc_id"]))
+    return new, seen, skipped
+
+def run(args):
+    root = os.path.abspath(args.directory)
+    extensions = tuple(extension.lower() for extension in args.extensions)
+    new, seen, skipped = plan(root, extensions, args.retry_failed)
+    rows = seen + new
+    logger.info("%d files to ingest (%d previously seen), %d already done", len(rows), len(seen), skipped)
+
+    writer = BulkWriter(args.batch_size, args.embed_workers)
+    seen_paths = {row[0] for row in seen}
+    # Hash -> doc_id of the new files in this run, which are not in `documents` until their chunks are written.
+    new_hashes = {}
+    failed = duplicates = 0
+    started = last_report = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.processes) as pool:
+        # At most max_pending files are parsed ahead of the writer.
+        pending = deque()
+        queue = iter(rows)
+        max_pending = 2 * args.processes
+        while True:
+            while len(pending) < max_pending:
+                row = next(queue, None)
+                if row is None:
+                    break
+                pending.append((row, pool.submit(split_file, row[0])))
+            if not pending:
+                break
+            row, future = pending.popleft()
+            try:
+                file_hash, chunks = future.result()
+                if row[0] in seen_paths:
+                    added, deduplicated = reindex_file(row, chunks, file_hash)
+                    writer.chunks_written += added
+                    writer.chunks_deduplicated += deduplicated
+                    writer.files_done += 1
+                elif (original := find_original(file_hash, new_hashes)) is not None:
+                    upsert_bulk_ingest_files([(*row[:3], original, "duplicate", len(chunks), None)])
+                    duplicates += 1
+                else:
+                    writer.add_file(row, chunks, file_hash)
+                    new_hashes[file_hash] = row[3]
+            except Exception as e:
+                logger.warning("Failed to ingest %s: %s", row[0], e)
+                upsert_bulk_ingest_files([(*row, "failed", None, str(e))])
+                failed += 1
+            if time.perf_counter() - last_report > args.report_interval:
+                last_report = time.perf_counter()
+                elapsed = last_report - started
+                logger.info(
+                    "%d/%d files done, %d chunks written (%.1f files/s, %.1f chunks/s)",
+                    writer.files_done, len(rows), writer.chunks_written,
+                    writer.files_done / elapsed, writer.chunks_written / elapsed,
+                )
+        writer.close()
+
+    elapsed = time.perf_counter() - started
+    logger.info(
+        "Ingested %d files (%d failed, %d skipped, %d duplicate files), %d new chunks, %d deduplicated chunks in %.1fs",
+        writer.files_done, failed, skipped, duplicates, writer.chunks_written, writer.chunks_deduplicated, elapsed,
+    )
+    return 1 if failed else 0
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="Parser processes")
+    parser.add_argument("--batch-size", type=int, default=1024, help="Chunks per embedding request and Chroma write")
+    parser.add_argument("--embed-workers", type=int, default=4, help="Embedding requests in flight")
+    parser.add_argument("--extensions", nargs="+", default=list(EXTENSIONS))
+    parser.add_argument("--retry-failed", action="store_true", help="Retry unchanged files that failed before")
+    parser.add_argument("--report-interval", type=float, default=10.0, help="Seconds between progress lines")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    raise SystemExit(run(parse_args()))
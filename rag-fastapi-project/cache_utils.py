@@ -0,0 +1,179 @@
+
+from threading import Lock
+from langchain_core.documents import Document
+from chroma_utils import get_vector_store
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_COLLECTION = os.environ.get("ANSWER_CACHE_COLLECTION", "answer-cache")
+# Minimum cosine similarity between standalone questions for a cached answer to be reused.
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", "86400"))
+# Entries kept; past it the least recently used ones are evicted.
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "10000"))
+# The bound is checked every this many answers added.
+ANSWER_CACHE_EVICT_INTERVAL = int(os.environ.get("ANSWER_CACHE_EVICT_INTERVAL", "100"))
+# A hit refreshes its entry's last_used at most this often (seconds), so most hits stay reads.
+ANSWER_CACHE_TOUCH_INTERVAL = 60
+
+def doc_key(doc_id):
+    return f"doc:{doc_id}"
+
+class SemanticAnswerCache:
+    """Caches answers in a Chroma collection keyed by the embedding of the standalone question.
+
+    Each entry carries one boolean `doc:<doc_id>` metadata key per cited document,
+    so every entry citing a document can be dropped with a single `where` filter.
+    Entries citing nothing (e.g. "I don't know") carry no such key; they are
+    dropped whenever any document changes, since a new one may answer them.
+    """
+
+    def __init__(self, collection_name=ANSWER_CACHE_COLLECTION, threshold=ANSWER_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL,
+                 max_entries=ANSWER_CACHE_MAX_ENTRIES, evict_interval=ANSWER_CACHE_EVICT_INTERVAL):
+        self.collection_name = collection_name
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.evict_interval = evict_interval
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.saved_seconds = 0.0
+        self._adds = 0
+        self._lock = Lock()
+
+    @property
+    def store(self):
+        # Entries are added and deleted all the time; the FAISS backend only reclaims deleted rows on vacuum.
+        return get_vector_store(self.collection_name, {"hnsw:space": "cosine"}, vector_backend="chroma")
+
+    def _record(self, hit, saved=0.0):
+        with self._lock:
+            if hit:
+                self.hits += 1
+                self.saved_seconds += saved
+            else:
+                self.misses += 1
+
+    def _to_entry(self, results):
+        if not results:
+            self._record(False)
+            return None
+        document, distance = results[0]
+        similarity = 1.0 - distance
+        metadata = document.metadata
+        if similarity < self.threshold:
+            self._record(False)
+            return None
+        if time.time() - metadata["created_at"] > self.ttl:
+            self.store.delete(ids=[document.id])
+            self._record(False)
+            return None
+        now = time.time()
+        if now - metadata.get("last_used", metadata["created_at"]) > ANSWER_CACHE_TOUCH_INTERVAL:
+            self.store._collection.update(ids=[document.id], metadatas=[{"last_used": now}])
+        self._record(True, metadata.get("latency", 0.0))
+        logger.info("Answer cache hit (similarity %.3f) for %r", similarity, document.page_content)
+        return {
+            "answer": metadata["answer"],
+            "context": [
+                Document(page_content="", metadata=source)
+                for source in json.loads(metadata["sources"])
+            ],
+        }
+
+    def lookup(self, question):
+        if not ANSWER_CACHE_ENABLED:
+            return None
+        return self._to_entry(self.store.similarity_search_with_score(question, k=1))
+
+    async def alookup(self, question):
+        if not ANSWER_CACHE_ENABLED:
+            return None
+        results = await self.store.asimilarity_search_with_score(question, k=1)
+        # Expired entries are deleted and hits touched, both Chroma writes.
+        return await asyncio.to_thread(self._to_entry, results)
+
+    def lookup_by_vectors(self, vectors):
+        if not ANSWER_CACHE_ENABLED or not vectors:
+            return [None] * len(vectors)
+        results = self.store._collection.query(
+            query_embeddings=vectors, n_results=1, include=["documents", "metadatas", "distances"]
+        )
+        entries = []
+        for texts, metadatas, ids, distances in zip(
+            results["documents"], results["metadatas"], results["ids"], results["distances"]
+        ):
+            matches = [
+                (Document(page_content=text, metadata=metadata, id=entry_id), distance)
+                for text, metadata, entry_id, distance in zip(texts, metadatas, ids, distances)
+            ]
+            entries.append(self._to_entry(matches))
+        return entries
+
+    def add(self, question, answer, context, latency):
+        if not ANSWER_CACHE_ENABLED:
+            return
+        now = time.time()
+        metadata = {
+            "answer": answer,
+            "sources": json.dumps([document.metadata for document in context]),
+            "created_at": now,
+            "last_used": now,
+            "latency": latency,
+        }
+        for document in context:
+            doc_id = document.metadata.get("doc_id")
+            if doc_id:
+                metadata[doc_key(doc_id)] = True
+                metadata["sourced"] = True
+        self.store.add_texts([question], metadatas=[metadata], ids=[str(uuid.uuid4())])
+        with self._lock:
+            self._adds += 1
+            evict = self._adds >= self.evict_interval
+            if evict:
+                self._adds = 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones past max_entries."""
+        collection = self.store._collection
+        entries = collection.get(include=["metadatas"])
+        now = time.time()
+        live, expired = [], []
+        for entry_id, metadata in zip(entries["ids"], entries["metadatas"]):
+            if now - metadata["created_at"] > self.ttl:
+                expired.append(entry_id)
+            else:
+                live.append((metadata.get("last_used", metadata["created_at"]), entry_id))
+        live.sort()
+        evicted = expired + [entry_id for _, entry_id in live[:max(0, len(live) - self.max_entries)]]
+        for start in range(0, len(evicted), 1000):
+            collection.delete(ids=evicted[start:start + 1000])
+        with self._lock:
+            self.evicted += len(evicted)
+
+    def invalidate_document(self, doc_id):
+        # Also drops entries without sources; `$ne` matches entries missing the key.
+        self.store.delete(where={"$or": [{doc_key(doc_id): True}, {"sourced": {"$ne": True}}]})
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evicted": self.evicted,
+                "saved_seconds": self.saved_seconds,
+            }
+
+answer_cache = SemanticAnswerCache()
@@ -1,23 +1,365 @@
 
-from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, TextLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
+from langchain_core.documents import Document
+from embedding_utils import CachedEmbeddings, EMBEDDING_BACKEND, create_embeddings
+from collections import deque
+from threading import RLock
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
 CHROMA_DB_PATH = "./chroma_db"
+# Collection used when callers do not ask for one (the langchain_chroma default).
+DEFAULT_COLLECTION = os.environ.get("CHROMA_DEFAULT_COLLECTION", "langchain")
+# Pages parsed per process-pool task when splitting PDFs.
+PDF_PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", "16"))
+# "structured" (token-sized chunks that follow headings, paragraphs, lists and
+# tables; see splitter_utils.py) or "recursive" (1000 characters, 200 overlap).
+TEXT_SPLITTER = os.environ.get("TEXT_SPLITTER", "structured").lower()
+# Characters of a text or DOCX file split at a time; windows end at a paragraph break.
+TEXT_WINDOW_CHARS = int(os.environ.get("TEXT_WINDOW_CHARS", str(1024 * 1024)))
+# PDF text extraction engine: "pymupdf", "pypdf", or "auto" (PyMuPDF when installed).
+# PyMuPDF failures fall back to pypdf; see benchmark_pdf.py for throughput.
+PDF_ENGINE = os.environ.get("PDF_ENGINE", "auto").lower()
+# HNSW parameters applied to collections when they are created (Chroma's defaults).
+# M and ef_construction are fixed once the index is built; see benchmark_ann.py for tuning.
+HNSW_M = int(os.environ.get("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.environ.get("HNSW_EF_CONSTRUCTION", "100"))
+# Unset keeps Chroma's default. When set, it is also applied to existing collections
+# as they are opened, which Chroma 1.x supports; older versions need a rebuild.
+HNSW_EF_SEARCH = int(os.environ["HNSW_EF_SEARCH"]) if os.environ.get("HNSW_EF_SEARCH") else None
+# Backend of the collections opened through get_vector_store: "chroma", or "faiss"
+# for compressed, memory-mapped indexes (see faiss_utils.py). Callers can pin one
+# per collection; the answer cache pins Chroma, so with "faiss" only the document
+# collections move. A collection keeps the backend it was first opened with.
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "chroma").lower()
+# Comma-separated collections whose index is loaded at startup.
+WARM_COLLECTIONS = [
+    name.strip()
+    for name in os.environ.get("CHROMA_WARM_COLLECTIONS", DEFAULT_COLLECTION).split(",")
+    if name.strip()
+]
 
-def get_vector_store():
-    return Chroma(persist_directory=CHROMA_DB_PATH, embedding_function=OpenAIEmbeddings())
+def collection_embedding_backend(metadata):
+    # Collections created before backends were recorded were embedded with OpenAI.
+    return (metadata or {}).get("embedding_backend", "openai")
 
-def load_and_split_document(file_path):
+def apply_hnsw_ef_search(collection, ef_search):
+    """Change ef_search of an existing collection.
+
+    Chroma reads it when it loads the index, so this takes effect when done
+    before the first query of the process, as _open does.
+    """
+    hnsw = (getattr(collection, "configuration", None) or {}).get("hnsw")
+    if hnsw is None:
+        logger.warning(
+            "HNSW_EF_SEARCH not applied to collection %s: this Chroma version only sets it "
+            "when a collection is created, so the collection must be rebuilt", collection.name,
+        )
+    elif hnsw.get("ef_search") != ef_search:
+        collection.modify(configuration={"hnsw": {"ef_search": ef_search}})
+        logger.info("Set ef_search of collection %s from %s to %d", collection.name, hnsw.get("ef_search"), ef_search)
+
+class VectorStoreManager:
+    """Owns the process-wide Chroma client and hands out one vector store per collection."""
+
+    def __init__(self, persist_directory=CHROMA_DB_PATH):
+        self.persist_directory = persist_directory
+        self.ready = False
+        self._client = None
+        self._embeddings = {}
+        self._stores = {}
+        self._vector_backends = {}
+        self._lock = RLock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                # chromadb and langchain_chroma are slow to import, so they are
+                # loaded with the first client rather than at startup.
+                import chromadb
+                self._client = chromadb.PersistentClient(path=self.persist_directory)
+            return self._client
+
+    def embeddings_for(self, backend, model=None):
+        """Return the shared (cached) embedding function for a backend/model pair."""
+        with self._lock:
+            key = (backend, model)
+            if key not in self._embeddings:
+                self._embeddings[key] = CachedEmbeddings(create_embeddings(backend, model))
+            return self._embeddings[key]
+
+    def _collection_metadata(self, collection_name, vector_backend):
+        if vector_backend == "faiss":
+            from faiss_utils import FaissCollection, collection_exists
+            return FaissCollection(collection_name).metadata if collection_exists(collection_name) else None
+        try:
+            return self.client.get_collection(collection_name).metadata or {}
+        except Exception:
+            return None
+
+    def get(self, collection_name=DEFAULT_COLLECTION, collection_metadata=None, embedding_backend=None, vector_backend=None):
+        store = self._stores.get(collection_name)
+        if store is None:
+            with self._lock:
+                store = self._stores.get(collection_name)
+                if store is None:
+                    backend = vector_backend or VECTOR_BACKEND
+                    store = self._open(collection_name, collection_metadata, embedding_backend, backend)
+                    self._vector_backends[collection_name] = backend
+                    self._stores[collection_name] = store
+                    return store
+        if embedding_backend and collection_embedding_backend(store._collection.metadata) != embedding_backend:
+            raise ValueError(f"Collection {collection_name} does not use the {embedding_backend} embedding backend")
+        if vector_backend and self._vector_backends[collection_name] != vector_backend:
+            raise ValueError(
+                f"Collection {collection_name} is open on the {self._vector_backends[collection_name]} vector backend"
+            )
+        return store
+
+    def _open(self, collection_name, collection_metadata, embedding_backend, vector_backend):
+        # The embedding backend is fixed when a collection is created and recorded in
+        # its metadata, so vectors from different models never end up side by side.
+        existing = self._collection_metadata(collection_name, vector_backend)
+        if existing is None:
+            backend = embedding_backend or EMBEDDING_BACKEND
+            embeddings = self.embeddings_for(backend)
+            metadata = {
+                "hnsw:M": HNSW_M,
+                "hnsw:construction_ef": HNSW_EF_CONSTRUCTION,
+                **({"hnsw:search_ef": HNSW_EF_SEARCH} if HNSW_EF_SEARCH is not None else {}),
+                **(collection_metadata or {}),
+                "embedding_backend": backend,
+                "embedding_model": embeddings.model_name,
+            }
+        else:
+            backend = collection_embedding_backend(existing)
+            if embedding_backend and embedding_backend != backend:
+                raise ValueError(f"Collection {collection_name} uses the {backend} embedding backend")
+            embeddings = self.embeddings_for(backend, existing.get("embedding_model"))
+            # An existing collection keeps the metadata it has. Collections from
+            # before this series have none, and Chroma rejects empty metadata.
+            metadata = None
+        if vector_backend == "faiss":
+            from faiss_utils import FaissCollection, FaissVectorStore
+            return FaissVectorStore(FaissCollection(collection_name, metadata), embeddings)
+        from langchain_chroma import Chroma
+        store = Chroma(
+            client=self.client,
+            collection_name=collection_name,
+            embedding_function=embeddings,
+            collection_metadata=metadata,
+        )
+        if existing is not None and HNSW_EF_SEARCH is not None:
+            apply_hnsw_ef_search(store._collection, HNSW_EF_SEARCH)
+        return store
+
+    def warm_up(self, collection_names=None):
+        # Chroma loads a collection's HNSW index lazily on the first query, so
+        # run one query with a stored vector to pay that cost before traffic arrives.
+        for name in collection_names or WARM_COLLECTIONS:
+            store = self.get(name)
+            # Local models are loaded here rather than on the first request.
+            load = getattr(store.embeddings.embeddings, "load", None)
+            if load is not None:
+                load()
+            collection = store._collection
+            sample = collection.get(limit=1, include=["embeddings"])
+            embeddings = sample.get("embeddings")
+            if embeddings is not None and len(embeddings):
+                collection.query(query_embeddings=[list(embeddings[0])], n_results=1)
+            logger.info("Warmed collection %s (%d vectors)", name, collection.count())
+        self.ready = True
+
+vector_store_manager = VectorStoreManager()
+
+def get_vector_store(collection_name=DEFAULT_COLLECTION, collection_metadata=None, embedding_backend=None, vector_backend=None):
+    return vector_store_manager.get(collection_name, collection_metadata, embedding_backend, vector_backend)
+
+def get_text_splitter():
+    if TEXT_SPLITTER == "structured":
+        from splitter_utils import StructuredTextSplitter
+        return StructuredTextSplitter()
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+
+def import_pymupdf():
+    try:
+        import pymupdf
+    except ImportError:
+        # Releases before 1.24.3 only provide the `fitz` module.
+        import fitz as pymupdf
+    return pymupdf
+
+def resolve_pdf_engine(engine=None):
+    engine = engine or PDF_ENGINE
+    if engine == "auto":
+        try:
+            import_pymupdf()
+        except ImportError:
+            return "pypdf"
+        return "pymupdf"
+    if engine not in ("pymupdf", "pypdf"):
+        raise ValueError(f"Unknown PDF engine: {engine}")
+    return engine
+
+def load_pdf_pages_pypdf(file_path, start, stop):
+    from pypdf import PdfReader
+    reader = PdfReader(file_path)
+    return [
+        Document(page_content=reader.pages[page].extract_text() or "", metadata={"source": file_path, "page": page})
+        for page in range(start, stop)
+    ]
+
+def load_pdf_pages_pymupdf(file_path, start, stop):
+    with import_pymupdf().open(file_path) as pdf:
+        return [
+            Document(page_content=pdf[page].get_text(), metadata={"source": file_path, "page": page})
+            for page in range(start, stop)
+        ]
+
+def load_pdf_pages(file_path, start, stop, engine=None):
+    """Extract pages [start, stop) as Documents with 0-based `page` metadata, like PyPDFLoader."""
+    if resolve_pdf_engine(engine) == "pymupdf":
+        try:
+            return load_pdf_pages_pymupdf(file_path, start, stop)
+        except Exception as e:
+            logger.warning("PyMuPDF failed on pages %d-%d of %s, using pypdf: %s", start, stop - 1, file_path, e)
+    return load_pdf_pages_pypdf(file_path, start, stop)
+
+def pdf_page_count(file_path, engine=None):
+    if resolve_pdf_engine(engine) == "pymupdf":
+        try:
+            with import_pymupdf().open(file_path) as pdf:
+                return pdf.page_count
+        except Exception as e:
+            logger.warning("PyMuPDF could not open %s, using pypdf: %s", file_path, e)
+    from pypdf import PdfReader
+    return len(PdfReader(file_path).pages)
+
+def split_pdf_pages(file_path, start, stop, engine=None):
+    return get_text_splitter().split_documents(load_pdf_pages(file_path, start, stop, engine))
+
+def iter_split_pdf(file_path, pool, max_pending, engine=None):
+    # Pages are parsed and split in windows on the process pool; at most
+    # `max_pending` windows are in flight, so memory does not grow with page count.
+    engine = resolve_pdf_engine(engine)
+    page_count = pdf_page_count(file_path, engine)
+    pending = deque()
+    for start in range(0, page_count, PDF_PAGES_PER_TASK):
+        stop = min(start + PDF_PAGES_PER_TASK, page_count)
+        pending.append(pool.submit(split_pdf_pages, file_path, start, stop, engine))
+        if len(pending) >= max_pending:
+            yield from pending.popleft().result()
+    while pending:
+        yield from pending.popleft().result()
+
+def iter_split_document(file_path, pool=None, max_pending=4):
+    """Yield chunks of a document one page (or page window) at a time."""
+    if file_path.endswith(".pdf") and pool is not None:
+        yield from iter_split_pdf(file_path, pool, max_pending)
+        return
+    if file_path.endswith(".pdf") and resolve_pdf_engine() == "pymupdf":
+        # Without a pool (e.g. inside bulk_ingest's parser processes) windows are parsed in turn.
+        page_count = pdf_page_count(file_path)
+        for start in range(0, page_count, PDF_PAGES_PER_TASK):
+            yield from split_pdf_pages(file_path, start, min(start + PDF_PAGES_PER_TASK, page_count))
+        return
+    text_splitter = get_text_splitter()
     if file_path.endswith(".pdf"):
-        loader = PyPDFLoader(file_path)
-    elif file_path.endswith(".docx"):
-        loader = Docx2txtLoader(file_path)
-    else:
-        loader = TextLoader(file_path)
-    
-    documents = loader.load()
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    return text_splitter.split_documents(documents)
+        from langchain_community.document_loaders import PyPDFLoader
+        for document in PyPDFLoader(file_path).lazy_load():
+            yield from text_splitter.split_documents([document])
+        return
+    paragraphs = iter_docx_paragraphs(file_path) if file_path.endswith(".docx") else iter_text_paragraphs(file_path)
+    for window in iter_windows(paragraphs):
+        yield from text_splitter.split_documents([Document(page_content=window, metadata={"source": file_path})])
+
+def iter_text_paragraphs(file_path):
+    """Yield a text file in pieces that each end at a blank line (or after TEXT_WINDOW_CHARS)."""
+    with open(file_path) as f:
+        lines, size = [], 0
+        for line in f:
+            lines.append(line)
+            size += len(line)
+            if not line.strip() or size >= TEXT_WINDOW_CHARS:
+                yield "".join(lines)
+                lines, size = [], 0
+        if lines:
+            yield "".join(lines)
+
+def iter_docx_paragraphs(file_path):
+    """Yield the text of a DOCX file paragraph by paragraph.
+
+    Produces the same text as docx2txt (headers, body, footers; tabs and
+    breaks kept; stripped), but parses document.xml incrementally instead of
+    loading it whole.
+    """
+    import re
+    import zipfile
+    from xml.etree.ElementTree import iterparse
+
+    namespace = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+    text_tag, paragraph_tag = namespace + "t", namespace + "p"
+    breaks = {namespace + "tab": "\t", namespace + "br": "\n", namespace + "cr": "\n"}
+
+    def parts(zipf, name):
+        piece = []
+        with zipf.open(name) as xml:
+            for event, element in iterparse(xml, events=("start", "end")):
+                if event == "start":
+                    if element.tag == paragraph_tag:
+                        if piece:
+                            yield "".join(piece)
+                        piece = ["\n\n"]
+                    elif element.tag in breaks:
+                        piece.append(breaks[element.tag])
+                else:
+                    if element.tag == text_tag and element.text:
+                        piece.append(element.text)
+                    element.clear()
+        if piece:
+            yield "".join(piece)
+
+    def pieces():
+        with zipfile.ZipFile(file_path) as zipf:
+            names = zipf.namelist()
+            for name in names:
+                if re.match(r"word/header[0-9]*.xml", name):
+                    yield from parts(zipf, name)
+            yield from parts(zipf, "word/document.xml")
+            for name in names:
+                if re.match(r"word/footer[0-9]*.xml", name):
+                    yield from parts(zipf, name)
+
+    # Strip the text as a whole: leading whitespace is dropped as it comes and
+    # trailing whitespace is held back until more text follows it.
+    held = []
+    for piece in pieces():
+        if not held:
+            piece = piece.lstrip()
+            if not piece:
+                continue
+        if piece.strip():
+            yield from held
+            held = [piece]
+        else:
+            held.append(piece)
+    if held:
+        yield held[0].rstrip()
+
+def iter_windows(pieces, window_chars=TEXT_WINDOW_CHARS):
+    """Join consecutive pieces into windows of at least `window_chars` characters (but the last)."""
+    window, size = [], 0
+    for piece in pieces:
+        window.append(piece)
+        size += len(piece)
+        if size >= window_chars:
+            yield "".join(window)
+            window, size = [], 0
+    if window:
+        yield "".join(window)
+
+def load_and_split_document(file_path):
+    return list(iter_split_document(file_path))
@@ -0,0 +1,123 @@
+
+from langchain_core.documents import Document
+from token_utils import count_tokens
+import os
+
+CONTEXT_PACKING_ENABLED = os.environ.get("CONTEXT_PACKING_ENABLED", "true").lower() == "true"
+# Approximate tokens of retrieved text passed to the answer prompt.
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "3000"))
+# Passages whose word-trigram Jaccard similarity to a more relevant one reaches this are dropped.
+CONTEXT_DEDUP_THRESHOLD = float(os.environ.get("CONTEXT_DEDUP_THRESHOLD", "0.9"))
+# Longest overlap looked for between neighbouring chunks (covers both splitters' default overlap).
+MAX_CHUNK_OVERLAP = int(os.environ.get("MAX_CHUNK_OVERLAP", "400"))
+
+def overlap_length(left, right, window=MAX_CHUNK_OVERLAP, probe=32):
+    """Length of the longest suffix of `left` (within `window`) that is also a prefix of `right`."""
+    tail = left[-window:]
+    head = right[:probe]
+    if not head:
+        return 0
+    start = tail.find(head)
+    while start != -1:
+        if right.startswith(tail[start:]):
+            return len(tail) - start
+        start = tail.find(head, start + 1)
+    return 0
+
+def merge_texts(left, right):
+    overlap = overlap_length(left, right)
+    if overlap:
+        return left + right[overlap:]
+    return left + "\n\n" + right
+
+def merge_adjacent(documents):
+    """Merge retrieved chunks that are neighbours in the same document.
+
+    Returns (rank, Document) pairs, one per merged passage, where rank is the
+    best (lowest) retrieval rank among the chunks it was built from. A chunk
+    retrieved twice (same id) is kept once; different chunks sharing a
+    position are never merged with each other.
+    """
+    runs = {}
+    passages = []
+    seen = set()
+    for rank, document in enumerate(documents):
+        if document.id is not None:
+            if document.id in seen:
+                continue
+            seen.add(document.id)
+        doc_id = document.metadata.get("doc_id")
+        index = document.metadata.get("chunk_index")
+        if doc_id is None or index is None:
+            passages.append((rank, document))
+        else:
+            runs.setdefault(doc_id, []).append((index, rank, document))
+
+    for chunks in runs.values():
+        chunks.sort(key=lambda item: (item[0], item[1]))
+        group = [chunks[0]]
+        for item in chunks[1:]:
+            if item[0] == group[-1][0] + 1:
+                group.append(item)
+            else:
+                passages.append(merge_group(group))
+                group = [item]
+        passages.append(merge_group(group))
+    return passages
+
+def merge_group(group):
+    if len(group) == 1:
+        _, rank, document = group[0]
+        return rank, document
+    text = group[0][2].page_content
+    for _, _, document in group[1:]:
+        text = merge_texts(text, document.page_content)
+    rank, best = min(((rank, document) for _, rank, document in group), key=lambda item: item[0])
+    metadata = dict(best.metadata)
+    metadata["chunk_index"] = group[0][0]
+    metadata["chunk_indexes"] = [index for index, _, _ in group]
+    return rank, Document(page_content=text, metadata=metadata, id=best.id)
+
+def shingles(text):
+    words = text.lower().split()
+    if len(words) < 3:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + 3]) for i in range(len(words) - 2)}
+
+def truncate_to_budget(text, budget):
+    # Inverse of count_tokens' four-characters-per-token estimate.
+    return text[:max(0, (budget - 1) * 4)]
+
+def pack_context(documents, token_budget=CONTEXT_TOKEN_BUDGET, threshold=CONTEXT_DEDUP_THRESHOLD):
+    """Turn retrieved chunks (best first) into the passages sent to the answer prompt.
+
+    Neighbouring chunks of a document are merged with their shared overlap
+    removed, near-duplicate passages are dropped, and passages are then added
+    in relevance order while they fit in `token_budget`.
+    """
+    if not CONTEXT_PACKING_ENABLED or not documents:
+        return documents
+    passages = sorted(merge_adjacent(documents), key=lambda item: item[0])
+
+    packed = []
+    kept_shingles = []
+    used = 0
+    for _, document in passages:
+        current = shingles(document.page_content)
+        if any(len(current & seen) / len(current | seen) >= threshold for seen in kept_shingles):
+            continue
+        tokens = count_tokens(document.page_content)
+        if used + tokens > token_budget:
+            if packed:
+                continue
+            # The most relevant passage is always included, cut to the budget if needed.
+            document = Document(
+                page_content=truncate_to_budget(document.page_content, token_budget),
+                metadata=document.metadata,
+                id=document.id,
+            )
+            tokens = count_tokens(document.page_content)
+        packed.append(document)
+        kept_shingles.append(current)
+        used += tokens
+    return packed
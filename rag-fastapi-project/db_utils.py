@@ -1,38 +1,438 @@
 
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from metrics_utils import track_stage
+import asyncio
+import os
+import queue
 import sqlite3
 
 DATABASE_NAME = "rag_chatbot.db"
+# Connections kept open per process; also the size of the executor used by run_db.
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+
+# WAL lets readers proceed while a writer commits; NORMAL sync is safe with WAL.
+PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-20000",
+]
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() hands it back to its pool instead of closing it.
+
+    Use it as `with get_db_connection() as conn:` so it is released even when a statement fails.
+    """
+
+    pool = None
+
+    def close(self):
+        if self.pool is None:
+            return super().close()
+        if self.in_transaction:
+            self.rollback()
+        self.pool.release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Unlike sqlite3's own, this also gives the connection back: the block's
+        # transaction is committed, or rolled back on error, and then released.
+        try:
+            if exc_type is None:
+                self.commit()
+        finally:
+            self.close()
+        return False
+
+class ConnectionPool:
+    def __init__(self, database, size=DB_POOL_SIZE):
+        self.database = database
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, timeout=30, check_same_thread=False, factory=PooledConnection)
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        conn.pool = self
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return self._connect()
+        return self._idle.get(timeout=30)
+
+    def release(self, conn):
+        self._idle.put(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.pool = None
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+db_pool = ConnectionPool(DATABASE_NAME)
+db_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+schema_lock = Lock()
+schema_ready = False
 
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE_NAME)
-    conn.row_factory = sqlite3.Row
-    return conn
+    global schema_ready
+    if not schema_ready:
+        with schema_lock:
+            if not schema_ready:
+                create_tables()
+                schema_ready = True
+    return db_pool.acquire()
+
+async def run_db(func, *args):
+    """Run a blocking db_utils function on the database thread pool."""
+    with track_stage("db", func.__name__):
+        return await asyncio.get_running_loop().run_in_executor(db_executor, func, *args)
+
+def add_column(cursor, table, column, definition):
+    # CREATE TABLE IF NOT EXISTS leaves tables created by older versions untouched.
+    columns = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
 
 def create_tables():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS chat_logs (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        session_id TEXT NOT NULL,
-        human_message TEXT NOT NULL,
-        ai_message TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    """)
-    
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS documents (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        doc_id TEXT NOT NULL UNIQUE,
-        filename TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    """)
-    
-    conn.commit()
-    conn.close()
-
-# Initialize the database and tables
-create_tables()
+    with db_pool.acquire() as conn:
+        cursor = conn.cursor()
+    
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS chat_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            human_message TEXT NOT NULL,
+            ai_message TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """)
+    
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_chat_logs_session_id ON chat_logs (session_id, id);
+        """)
+    
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_chat_logs_created_at ON chat_logs (created_at);
+        """)
+    
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS documents (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            doc_id TEXT NOT NULL UNIQUE,
+            filename TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """)
+    
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS document_chunks (
+            chunk_id TEXT PRIMARY KEY,
+            doc_id TEXT NOT NULL,
+            chunk_index INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """)
+    
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_document_chunks_doc_id ON document_chunks (doc_id);
+        """)
+    
+        # Set on near-duplicate chunks: the chunk whose vector they share.
+        add_column(cursor, "document_chunks", "canonical_chunk_id", "TEXT")
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_document_chunks_canonical ON document_chunks (canonical_chunk_id);
+        """)
+    
+        add_column(cursor, "documents", "file_hash", "TEXT")
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_documents_file_hash ON documents (file_hash);
+        """)
+    
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS chunk_signatures (
+            chunk_id TEXT PRIMARY KEY,
+            signature BLOB NOT NULL
+        );
+        """)
+    
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS chunk_lsh (
+            band INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            chunk_id TEXT NOT NULL
+        );
+        """)
+    
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_chunk_lsh_bucket ON chunk_lsh (band, bucket);
+        """)
+    
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_chunk_lsh_chunk_id ON chunk_lsh (chunk_id);
+        """)
+    
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ingestion_jobs (
+            job_id TEXT PRIMARY KEY,
+            doc_id TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            chunk_count INTEGER,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """)
+    
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_status ON ingestion_jobs (status, created_at);
+        """)
+    
+        add_column(cursor, "ingestion_jobs", "deduplicated_chunks", "INTEGER")
+        # The worker running a job holds it until lease_until (epoch seconds) and keeps renewing it.
+        add_column(cursor, "ingestion_jobs", "owner", "TEXT")
+        add_column(cursor, "ingestion_jobs", "lease_until", "REAL")
+    
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS bulk_ingest_files (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            doc_id TEXT NOT NULL,
+            status TEXT NOT NULL,
+            chunk_count INTEGER,
+            error TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """)
+    
+        # documents.doc_id is already indexed through its UNIQUE constraint.
+
+def insert_chat_logs(rows):
+    with get_db_connection() as conn:
+        conn.executemany(
+            "INSERT INTO chat_logs (session_id, human_message, ai_message) VALUES (?, ?, ?)",
+            rows,
+        )
+        return conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+
+# Returns the most recent `limit` turns of a session, oldest first.
+def get_chat_logs(session_id, limit):
+    with get_db_connection() as conn:
+        cursor = conn.execute(
+            "SELECT id, human_message, ai_message FROM chat_logs WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+            (session_id, limit),
+        )
+        rows = cursor.fetchall()
+    return list(reversed(rows))
+
+def get_last_chat_log_id(session_id):
+    with get_db_connection() as conn:
+        return conn.execute("SELECT MAX(id) FROM chat_logs WHERE session_id = ?", (session_id,)).fetchone()[0]
+
+def delete_chat_logs(session_id):
+    with get_db_connection() as conn:
+        conn.execute("DELETE FROM chat_logs WHERE session_id = ?", (session_id,))
+
+def insert_document(doc_id, filename, file_hash=None):
+    with get_db_connection() as conn:
+        conn.execute(
+            "INSERT INTO documents (doc_id, filename, file_hash) VALUES (?, ?, ?) "
+            "ON CONFLICT(doc_id) DO UPDATE SET filename = excluded.filename, file_hash = excluded.file_hash",
+            (doc_id, filename, file_hash),
+        )
+
+def insert_documents(rows):
+    with get_db_connection() as conn:
+        conn.executemany(
+            "INSERT INTO documents (doc_id, filename, file_hash) VALUES (?, ?, ?) "
+            "ON CONFLICT(doc_id) DO UPDATE SET filename = excluded.filename, file_hash = excluded.file_hash",
+            rows,
+        )
+
+# Keyset pagination: `cursor` is the internal id of the last document on the previous page.
+def list_documents(limit=None, cursor=None):
+    with get_db_connection() as conn:
+        query = "SELECT id, filename, doc_id FROM documents WHERE id > ? ORDER BY id"
+        params = [cursor or 0]
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        return conn.execute(query, params).fetchall()
+
+def delete_document(doc_id):
+    with get_db_connection() as conn:
+        conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+
+def get_document(doc_id):
+    with get_db_connection() as conn:
+        return conn.execute("SELECT doc_id, filename FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+
+def get_document_by_hash(file_hash):
+    with get_db_connection() as conn:
+        return conn.execute("SELECT doc_id, filename FROM documents WHERE file_hash = ? LIMIT 1", (file_hash,)).fetchone()
+
+def get_chunk_manifest(doc_id):
+    with get_db_connection() as conn:
+        return conn.execute(
+            "SELECT chunk_id, chunk_index, content_hash, canonical_chunk_id FROM document_chunks "
+            "WHERE doc_id = ? ORDER BY chunk_index",
+            (doc_id,),
+        ).fetchall()
+
+# Rows are (chunk_id, doc_id, chunk_index, content_hash, canonical_chunk_id).
+def insert_chunk_manifest(rows):
+    with get_db_connection() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO document_chunks (chunk_id, doc_id, chunk_index, content_hash, canonical_chunk_id) "
+            "VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+
+def delete_chunk_manifest(chunk_ids):
+    with get_db_connection() as conn:
+        conn.executemany("DELETE FROM document_chunks WHERE chunk_id = ?", [(chunk_id,) for chunk_id in chunk_ids])
+
+# Chunks that share the vector of one of `chunk_ids`.
+def get_chunk_references(chunk_ids):
+    with get_db_connection() as conn:
+        rows = []
+        for start in range(0, len(chunk_ids), 500):
+            batch = chunk_ids[start:start + 500]
+            rows += conn.execute(
+                f"SELECT * FROM document_chunks WHERE canonical_chunk_id IN ({','.join('?' * len(batch))})", batch
+            ).fetchall()
+    return rows
+
+# Rows are (chunk_id, signature blob, [(band, bucket), ...]).
+def insert_chunk_signatures(rows):
+    with get_db_connection() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO chunk_signatures (chunk_id, signature) VALUES (?, ?)",
+            [(chunk_id, signature) for chunk_id, signature, _ in rows],
+        )
+        conn.executemany("DELETE FROM chunk_lsh WHERE chunk_id = ?", [(chunk_id,) for chunk_id, _, _ in rows])
+        conn.executemany(
+            "INSERT INTO chunk_lsh (band, bucket, chunk_id) VALUES (?, ?, ?)",
+            [(band, bucket, chunk_id) for chunk_id, _, keys in rows for band, bucket in keys],
+        )
+
+def find_lsh_candidates(keys):
+    """Map each (band, bucket) key that has entries to the chunk ids stored under it."""
+    with get_db_connection() as conn:
+        found = {}
+        for start in range(0, len(keys), 400):
+            batch = keys[start:start + 400]
+            values = ",".join("(?, ?)" for _ in batch)
+            rows = conn.execute(
+                f"SELECT band, bucket, chunk_id FROM chunk_lsh WHERE (band, bucket) IN (VALUES {values})",
+                [value for key in batch for value in key],
+            ).fetchall()
+            for band, bucket, chunk_id in rows:
+                found.setdefault((band, bucket), []).append(chunk_id)
+    return found
+
+def get_chunk_signatures(chunk_ids):
+    with get_db_connection() as conn:
+        found = {}
+        for start in range(0, len(chunk_ids), 500):
+            batch = chunk_ids[start:start + 500]
+            rows = conn.execute(
+                f"SELECT chunk_id, signature FROM chunk_signatures WHERE chunk_id IN ({','.join('?' * len(batch))})", batch
+            ).fetchall()
+            found.update((chunk_id, signature) for chunk_id, signature in rows)
+    return found
+
+def delete_chunk_signatures(chunk_ids):
+    with get_db_connection() as conn:
+        conn.executemany("DELETE FROM chunk_signatures WHERE chunk_id = ?", [(chunk_id,) for chunk_id in chunk_ids])
+        conn.executemany("DELETE FROM chunk_lsh WHERE chunk_id = ?", [(chunk_id,) for chunk_id in chunk_ids])
+
+def insert_job(job_id, doc_id, filename, file_path):
+    with get_db_connection() as conn:
+        conn.execute(
+            "INSERT INTO ingestion_jobs (job_id, doc_id, filename, file_path) VALUES (?, ?, ?, ?)",
+            (job_id, doc_id, filename, file_path),
+        )
+
+def update_job(job_id, status, chunk_count=None, error=None, deduplicated_chunks=None):
+    with get_db_connection() as conn:
+        conn.execute(
+            "UPDATE ingestion_jobs SET status = ?, chunk_count = COALESCE(?, chunk_count), error = ?, "
+            "deduplicated_chunks = COALESCE(?, deduplicated_chunks), updated_at = CURRENT_TIMESTAMP WHERE job_id = ?",
+            (status, chunk_count, error, deduplicated_chunks, job_id),
+        )
+
+def get_job(job_id):
+    with get_db_connection() as conn:
+        return conn.execute("SELECT * FROM ingestion_jobs WHERE job_id = ?", (job_id,)).fetchone()
+
+def claim_job(job_id, owner, lease_until, now):
+    """Mark a queued job, or a running one whose lease has expired, as running under `owner`.
+
+    Returns False when another worker holds the job or it has already finished.
+    """
+    with get_db_connection() as conn:
+        cursor = conn.execute(
+            "UPDATE ingestion_jobs SET status = 'running', owner = ?, lease_until = ?, updated_at = CURRENT_TIMESTAMP "
+            "WHERE job_id = ? AND (status = 'queued' OR (status = 'running' AND COALESCE(lease_until, 0) < ?))",
+            (owner, lease_until, job_id, now),
+        )
+        return cursor.rowcount == 1
+
+def renew_job_lease(job_id, owner, lease_until):
+    with get_db_connection() as conn:
+        cursor = conn.execute(
+            "UPDATE ingestion_jobs SET lease_until = ? WHERE job_id = ? AND owner = ? AND status = 'running'",
+            (lease_until, job_id, owner),
+        )
+        return cursor.rowcount == 1
+
+# Jobs waiting for a worker, and jobs whose worker stopped renewing its lease.
+def get_claimable_jobs(now):
+    with get_db_connection() as conn:
+        return conn.execute(
+            "SELECT * FROM ingestion_jobs WHERE status = 'queued' "
+            "OR (status = 'running' AND COALESCE(lease_until, 0) < ?) ORDER BY created_at",
+            (now,),
+        ).fetchall()
+
+# Manifest of the bulk ingestion CLI: one row per file, keyed by its path.
+def get_bulk_ingest_files():
+    with get_db_connection() as conn:
+        rows = conn.execute("SELECT * FROM bulk_ingest_files").fetchall()
+    return {row["path"]: row for row in rows}
+
+def upsert_bulk_ingest_files(rows):
+    with get_db_connection() as conn:
+        conn.executemany(
+            "INSERT INTO bulk_ingest_files (path, size, mtime, doc_id, status, chunk_count, error) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(path) DO UPDATE SET size = excluded.size, mtime = excluded.mtime, doc_id = excluded.doc_id, "
+            "status = excluded.status, chunk_count = excluded.chunk_count, error = excluded.error, "
+            "updated_at = CURRENT_TIMESTAMP",
+            rows,
+        )
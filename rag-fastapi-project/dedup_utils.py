@@ -0,0 +1,125 @@
+
+from db_utils import find_lsh_candidates, get_chunk_signatures, insert_chunk_signatures
+import hashlib
+import os
+import zlib
+import numpy as np
+
+CHUNK_DEDUP_ENABLED = os.environ.get("CHUNK_DEDUP_ENABLED", "true").lower() == "true"
+# Estimated Jaccard similarity of word shingles at which a new chunk reuses an existing vector.
+CHUNK_DEDUP_THRESHOLD = float(os.environ.get("CHUNK_DEDUP_THRESHOLD", "0.85"))
+SHINGLE_WORDS = 5
+# 16 bands of 4 rows make chunks with a similarity of about 0.5 or more LSH
+# candidates; the threshold above is then checked on the full signature.
+LSH_BANDS = 16
+LSH_ROWS = 4
+MINHASH_PERMUTATIONS = LSH_BANDS * LSH_ROWS
+# Smallest prime above 2**32, so (a * x + b) % PRIME stays within uint64 for 32-bit x.
+PRIME = 4294967311
+
+_rng = np.random.RandomState(20240601)
+_A = _rng.randint(1, 2 ** 31, size=MINHASH_PERMUTATIONS).astype(np.uint64)
+_B = _rng.randint(0, 2 ** 31, size=MINHASH_PERMUTATIONS).astype(np.uint64)
+
+def minhash(text):
+    """MinHash signature of the text's word shingles, or None for empty text."""
+    words = text.lower().split()
+    if not words:
+        return None
+    if len(words) <= SHINGLE_WORDS:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+    return ((hashes[:, None] * _A + _B) % PRIME).min(axis=0)
+
+def lsh_keys(signature):
+    keys = []
+    for band in range(LSH_BANDS):
+        rows = signature[band * LSH_ROWS:(band + 1) * LSH_ROWS].tobytes()
+        keys.append((band, int.from_bytes(hashlib.blake2b(rows, digest_size=8).digest(), "little", signed=True)))
+    return keys
+
+def similarity(left, right):
+    return float(np.count_nonzero(left == right)) / MINHASH_PERMUTATIONS
+
+class ChunkDeduplicator:
+    """Finds new chunks that nearly match an indexed chunk, using MinHash signatures in LSH buckets.
+
+    Chunks accepted as new are remembered until `commit` stores their
+    signatures, so duplicates within one upload or across batches still
+    waiting to be written are found too.
+    """
+
+    def __init__(self, threshold=CHUNK_DEDUP_THRESHOLD, enabled=CHUNK_DEDUP_ENABLED):
+        self.threshold = threshold
+        self.enabled = enabled
+        self.pending = {}
+        self.pending_buckets = {}
+
+    def assign(self, items, exclude=()):
+        """Split (chunk_id, chunk) pairs into near duplicates and new chunks.
+
+        Returns ({chunk_id: canonical chunk_id}, {chunk_id: (signature, keys)});
+        the second dict holds every chunk that needs its own vector. Chunks in
+        `exclude` are never chosen as canonical.
+        """
+        if not self.enabled:
+            return {}, {chunk_id: (None, []) for chunk_id, _ in items}
+        signatures = {chunk_id: minhash(chunk.page_content) for chunk_id, chunk in items}
+        keys = {chunk_id: lsh_keys(signature) for chunk_id, signature in signatures.items() if signature is not None}
+        stored_buckets = find_lsh_candidates(list({key for chunk_keys in keys.values() for key in chunk_keys}))
+        stored = {
+            chunk_id: np.frombuffer(blob, dtype=np.uint64)
+            for chunk_id, blob in get_chunk_signatures(
+                list({chunk_id for ids in stored_buckets.values() for chunk_id in ids})
+            ).items()
+        }
+
+        duplicates = {}
+        new = {}
+        for chunk_id, _ in items:
+            signature = signatures[chunk_id]
+            if signature is None:
+                new[chunk_id] = (None, [])
+                continue
+            best, best_score = None, self.threshold
+            for key in keys[chunk_id]:
+                for candidate in stored_buckets.get(key, []) + self.pending_buckets.get(key, []):
+                    # A chunk id is derived from its content, so a re-indexed chunk can meet its own old signature.
+                    if candidate == chunk_id or candidate in exclude:
+                        continue
+                    candidate_signature = stored.get(candidate)
+                    if candidate_signature is None:
+                        candidate_signature = self.pending.get(candidate)
+                    if candidate_signature is None:
+                        continue
+                    score = similarity(signature, candidate_signature)
+                    if score >= best_score:
+                        best, best_score = candidate, score
+            if best is not None:
+                duplicates[chunk_id] = best
+            else:
+                new[chunk_id] = (signature, keys[chunk_id])
+                self.pending[chunk_id] = signature
+                for key in keys[chunk_id]:
+                    self.pending_buckets.setdefault(key, []).append(chunk_id)
+        return duplicates, new
+
+    def commit(self, new):
+        """Store signatures of chunks whose vectors have been written."""
+        rows = [(chunk_id, signature.tobytes(), keys) for chunk_id, (signature, keys) in new.items() if signature is not None]
+        if rows:
+            insert_chunk_signatures(rows)
+        self.forget(new)
+
+    def forget(self, new):
+        """Stop matching against chunks from `assign`, once stored or when they will not be written."""
+        for chunk_id, (_, keys) in new.items():
+            self.pending.pop(chunk_id, None)
+            for key in keys:
+                bucket = self.pending_buckets.get(key)
+                if bucket and chunk_id in bucket:
+                    bucket.remove(chunk_id)
+                    if not bucket:
+                        del self.pending_buckets[key]
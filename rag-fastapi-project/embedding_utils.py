@@ -0,0 +1,204 @@
+
+from array import array
+from threading import Lock
+from langchain_core.embeddings import Embeddings
+import hashlib
+import os
+import sqlite3
+import time
+
+# Backend used for collections created without an explicit choice: "openai" or "local".
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "openai")
+# Empty means the OpenAIEmbeddings default model.
+OPENAI_EMBEDDING_MODEL = os.environ.get("OPENAI_EMBEDDING_MODEL", "")
+LOCAL_EMBEDDING_MODEL = os.environ.get("LOCAL_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+# "torch" or "onnx"; ONNX needs sentence-transformers[onnx] 3.2 or newer.
+LOCAL_EMBEDDING_RUNTIME = os.environ.get("LOCAL_EMBEDDING_RUNTIME", "torch")
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.environ.get("LOCAL_EMBEDDING_BATCH_SIZE", "64"))
+
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", "./embedding_cache.db")
+# Upper bound on cached vectors; the least recently used ones are evicted past it.
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", "500000"))
+# The bound is checked every this many inserts, so it can be overshot by up to that many per process.
+EMBEDDING_CACHE_EVICT_INTERVAL = int(os.environ.get("EMBEDDING_CACHE_EVICT_INTERVAL", "1000"))
+
+def embedding_model_name(embeddings):
+    for attr in ("model", "model_name"):
+        name = getattr(embeddings, attr, None)
+        if name:
+            return str(name)
+    return type(embeddings).__name__
+
+def runtime_kwargs(runtime, version):
+    """SentenceTransformer arguments that select `runtime` with the installed sentence-transformers `version`."""
+    if runtime == "torch":
+        return {}
+    if runtime != "onnx":
+        raise ValueError(f"Unknown local embedding runtime: {runtime}")
+    # The backend argument was added in sentence-transformers 3.2.
+    if tuple(int(part) for part in version.split(".")[:2]) < (3, 2):
+        raise RuntimeError(
+            f"LOCAL_EMBEDDING_RUNTIME=onnx needs sentence-transformers 3.2 or newer, found {version}: "
+            "pip install 'sentence-transformers[onnx]>=3.2'"
+        )
+    return {"backend": "onnx"}
+
+class LocalEmbeddings(Embeddings):
+    """In-process sentence-transformers model on CPU, loaded once and shared across threads."""
+
+    def __init__(self, model_name=LOCAL_EMBEDDING_MODEL, runtime=LOCAL_EMBEDDING_RUNTIME, batch_size=LOCAL_EMBEDDING_BATCH_SIZE):
+        self.model_name = model_name
+        self.runtime = runtime
+        self.batch_size = batch_size
+        self._model = None
+        self._load_lock = Lock()
+        self._encode_lock = Lock()
+
+    def load(self):
+        with self._load_lock:
+            if self._model is None:
+                try:
+                    from sentence_transformers import SentenceTransformer
+                except ImportError as e:
+                    raise ImportError(
+                        "The local embedding backend requires sentence-transformers: "
+                        "pip install sentence-transformers"
+                    ) from e
+                import sentence_transformers
+                kwargs = runtime_kwargs(self.runtime, sentence_transformers.__version__)
+                self._model = SentenceTransformer(self.model_name, device="cpu", **kwargs)
+            return self._model
+
+    def embed_documents(self, texts):
+        model = self.load()
+        with self._encode_lock:
+            vectors = model.encode(
+                list(texts),
+                batch_size=self.batch_size,
+                normalize_embeddings=True,
+                convert_to_numpy=True,
+                show_progress_bar=False,
+            )
+        return vectors.tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+def create_embeddings(backend, model=None):
+    if backend == "openai":
+        from langchain_openai import OpenAIEmbeddings
+        model = model or OPENAI_EMBEDDING_MODEL
+        return OpenAIEmbeddings(model=model) if model else OpenAIEmbeddings()
+    if backend == "local":
+        return LocalEmbeddings(model or LOCAL_EMBEDDING_MODEL)
+    raise ValueError(f"Unknown embedding backend: {backend}")
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an embedding model with an on-disk cache keyed by hash(model name + text).
+
+    Lookups and inserts are separate short transactions, so the SQLite write
+    lock is never held while the model computes missing vectors.
+    """
+
+    def __init__(self, embeddings, path=EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+                 evict_interval=EMBEDDING_CACHE_EVICT_INTERVAL):
+        self.embeddings = embeddings
+        self.model_name = embedding_model_name(embeddings)
+        self.path = path
+        self.max_entries = max_entries
+        self.evict_interval = evict_interval
+        # Starts due, so the first insert of a process checks the bound.
+        self._unchecked_inserts = evict_interval
+        self._evict_lock = Lock()
+        conn = self._connect()
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS embeddings (
+            key TEXT PRIMARY KEY,
+            vector BLOB NOT NULL,
+            last_used REAL NOT NULL
+        );
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+        conn.commit()
+        conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys):
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        conn = self._connect()
+        try:
+            # Stay well below SQLite's bound-parameter limit.
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("d", blob).tolist()
+            if found:
+                now = time.time()
+                conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+            conn.commit()
+        finally:
+            conn.close()
+        return found
+
+    def _store(self, vectors_by_key):
+        now = time.time()
+        with self._evict_lock:
+            self._unchecked_inserts += len(vectors_by_key)
+            evict = self._unchecked_inserts >= self.evict_interval
+            if evict:
+                self._unchecked_inserts = 0
+        conn = self._connect()
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, array("d", vector).tobytes(), now) for key, vector in vectors_by_key.items()],
+            )
+            if evict:
+                # COUNT(*) scans the table, so it only runs every evict_interval inserts.
+                count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                if count > self.max_entries:
+                    conn.execute(
+                        "DELETE FROM embeddings WHERE key IN "
+                        "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                        (count - self.max_entries,),
+                    )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def embed_documents(self, texts):
+        keys = [self._key(text) for text in texts]
+        cached = self._lookup(keys)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self._store(computed)
+            cached.update(computed)
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text):
+        key = self._key(text)
+        cached = self._lookup([key])
+        if key not in cached:
+            cached[key] = self.embeddings.embed_query(text)
+            self._store(cached)
+        return cached[key]
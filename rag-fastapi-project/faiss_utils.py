@@ -0,0 +1,616 @@
+
+"""FAISS vector backend, selected with VECTOR_BACKEND=faiss.
+
+Each collection lives in its own directory under FAISS_DB_PATH:
+
+- `vectors.f32` holds every vector as float32, one row after another. It is
+  memory-mapped and only read for the rows a query re-scores.
+- `store.db` (SQLite) maps rows to chunk ids, texts and metadata. Deleted or
+  replaced chunks are marked as such, not removed.
+- `index-<rows>.faiss` is a compressed FAISS index (FAISS_INDEX, IVF-PQ by
+  default) over the first <rows> rows. It is opened memory-mapped, so workers
+  share one copy through the page cache and startup does not read it.
+
+Rows added after the index was built are searched exactly; once there are
+FAISS_DELTA_ROWS of them a background thread of the writing process folds
+them into a new index file, so writes never wait for training. Every
+candidate is re-scored against its exact vector before results are returned.
+Metadata filters (`where`, Chroma's syntax) are evaluated in SQLite: narrow
+ones are searched exactly over the matching rows, broader ones filter the
+approximate candidates.
+
+VECTOR_BACKEND applies to the document collections only; the answer cache
+stays on Chroma (see cache_utils.py).
+
+Memory is dominated by the index codes: with "IVF16384,PQ64", 50M chunks take
+about 3.2 GB of codes plus ids, while their float32 vectors (300 GB at 1536
+dimensions) stay on disk and only re-scored rows are paged in. Training is the
+slow step (PQ k-means); it happens once, when the collection first reaches
+FAISS_DELTA_ROWS rows, and again on vacuum.
+
+    python faiss_utils.py import-chroma   # copy the Chroma collection over
+    python faiss_utils.py compact         # index pending rows now
+    python faiss_utils.py vacuum          # drop deleted rows and retrain (API stopped)
+"""
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from langchain_core.vectorstores.utils import maximal_marginal_relevance
+from threading import Lock, Thread
+import argparse
+import fcntl
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FAISS_DB_PATH = os.environ.get("FAISS_DB_PATH", "./faiss_db")
+# Any faiss.index_factory description, e.g. "IVF4096,PQ64" (64 bytes a vector) or "HNSW32,SQ8".
+FAISS_INDEX = os.environ.get("FAISS_INDEX", "IVF1024,PQ32")
+FAISS_NPROBE = int(os.environ.get("FAISS_NPROBE", "32"))
+FAISS_EF_SEARCH = int(os.environ.get("FAISS_EF_SEARCH", "128"))
+# Approximate candidates fetched per requested result and re-scored with exact vectors.
+FAISS_RESCORE_FACTOR = int(os.environ.get("FAISS_RESCORE_FACTOR", "8"))
+# Rows outside the index are searched exactly; past this many they are indexed.
+FAISS_DELTA_ROWS = int(os.environ.get("FAISS_DELTA_ROWS", "20000"))
+# Vectors sampled to train the index.
+FAISS_TRAIN_SIZE = int(os.environ.get("FAISS_TRAIN_SIZE", "100000"))
+# Filters matching at most this many rows are searched exactly over those rows.
+FAISS_FILTER_SCAN_ROWS = int(os.environ.get("FAISS_FILTER_SCAN_ROWS", "10000"))
+# Rows copied per step when building an index or importing.
+FAISS_ADD_BATCH = 65536
+# Chroma `where` operators and their SQL; `$ne` and `$nin` also match rows without the key, as in Chroma.
+WHERE_OPERATORS = {"$eq": "=", "$ne": "IS NOT", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+def collection_path(name, root=FAISS_DB_PATH):
+    return os.path.join(root, name)
+
+def collection_exists(name, root=FAISS_DB_PATH):
+    return os.path.exists(os.path.join(collection_path(name, root), "store.db"))
+
+def where_sql(where):
+    """Translate a Chroma `where` filter into an SQL condition on the chunks' JSON metadata, with its parameters."""
+    clauses, params = [], []
+    for key, value in where.items():
+        if key in ("$and", "$or"):
+            parts = [where_sql(item) for item in value]
+            clauses.append("(" + f" {key[1:].upper()} ".join(clause for clause, _ in parts) + ")")
+            params += [param for _, part_params in parts for param in part_params]
+            continue
+        field = "json_extract(metadata, ?)"
+        path = f'$."{key}"'
+        for operator, operand in (value.items() if isinstance(value, dict) else [("$eq", value)]):
+            if operator in ("$in", "$nin"):
+                placeholders = ",".join("?" * len(operand))
+                if operator == "$in":
+                    clauses.append(f"{field} IN ({placeholders})")
+                    params += [path, *operand]
+                else:
+                    clauses.append(f"({field} IS NULL OR {field} NOT IN ({placeholders}))")
+                    params += [path, path, *operand]
+            elif operator in WHERE_OPERATORS:
+                clauses.append(f"{field} {WHERE_OPERATORS[operator]} ?")
+                params += [path, operand]
+            else:
+                raise ValueError(f"Unsupported where operator: {operator}")
+    return "(" + " AND ".join(clauses) + ")", params
+
+class FaissCollection:
+    """The subset of the Chroma collection API the app uses, on top of a FAISS index."""
+
+    def __init__(self, name, metadata=None, root=FAISS_DB_PATH):
+        self.name = name
+        self.path = collection_path(name, root)
+        os.makedirs(self.path, exist_ok=True)
+        self.vectors_path = os.path.join(self.path, "vectors.f32")
+        self.db_path = os.path.join(self.path, "store.db")
+        conn = self._connect()
+        conn.executescript("""
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS chunks (
+            row INTEGER PRIMARY KEY,
+            id TEXT NOT NULL,
+            document TEXT,
+            metadata TEXT,
+            deleted INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_chunks_live_id ON chunks (id) WHERE deleted = 0;
+        """)
+        if self._meta(conn, "metadata") is None:
+            conn.execute("INSERT INTO meta (key, value) VALUES ('metadata', ?)", (json.dumps(metadata or {}),))
+            conn.commit()
+        self.metadata = json.loads(self._meta(conn, "metadata"))
+        conn.close()
+        self.space = self.metadata.get("hnsw:space", "l2")
+        self._lock = Lock()
+        self._vectors = None
+        self._index = None
+        self._index_file = None
+        self._train_after = 0
+        self._compactor = None
+        # Bulk loads turn this off and build the index once at the end.
+        self.auto_compact = True
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    @staticmethod
+    def _meta(conn, key):
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _state(self):
+        """Return (dim, row count, index file, rows covered by the index) as committed."""
+        conn = self._connect()
+        try:
+            values = dict(conn.execute("SELECT key, value FROM meta WHERE key IN ('dim', 'index_file', 'index_rows')").fetchall())
+            rows = conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM chunks").fetchone()[0]
+        finally:
+            conn.close()
+        return int(values.get("dim") or 0), rows, values.get("index_file"), int(values.get("index_rows") or 0)
+
+    def _prepare(self, embeddings):
+        vectors = np.ascontiguousarray(np.asarray(embeddings, dtype=np.float32))
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        if self.space == "cosine":
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.where(norms == 0, 1, norms)
+        return vectors
+
+    def _vector_rows(self, dim, rows):
+        # The file only grows, so a mapping is replaced once rows were appended past it.
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[0] < rows or self._vectors.shape[1] != dim:
+                self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, dim)) if rows else None
+            return self._vectors
+
+    def _load_index(self, index_file):
+        with self._lock:
+            if index_file != self._index_file:
+                import faiss
+                path = os.path.join(self.path, index_file)
+                try:
+                    index = faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+                except RuntimeError:
+                    # Not every index type can be memory-mapped.
+                    index = faiss.read_index(path)
+                set_search_parameters(index)
+                self._index, self._index_file = index, index_file
+            return self._index
+
+    def count(self):
+        conn = self._connect()
+        count = conn.execute("SELECT COUNT(*) FROM chunks WHERE deleted = 0").fetchone()[0]
+        conn.close()
+        return count
+
+    def upsert(self, ids, embeddings, metadatas=None, documents=None):
+        if not ids:
+            return
+        vectors = self._prepare(embeddings)
+        metadatas = metadatas or [None] * len(ids)
+        documents = documents or [None] * len(ids)
+        # Later entries win when an id repeats within the batch.
+        latest = {chunk_id: position for position, chunk_id in enumerate(ids)}
+        positions = sorted(latest.values())
+        vectors = vectors[positions]
+
+        conn = self._connect()
+        try:
+            # The write lock serializes row allocation across processes; vectors
+            # land before the rows that point at them are committed.
+            conn.execute("BEGIN IMMEDIATE")
+            dim = int(self._meta(conn, "dim") or 0)
+            if not dim:
+                dim = vectors.shape[1]
+                conn.execute("INSERT INTO meta (key, value) VALUES ('dim', ?)", (str(dim),))
+            elif vectors.shape[1] != dim:
+                raise ValueError(f"Collection {self.name} stores {dim}-dimensional vectors, got {vectors.shape[1]}")
+            start = conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM chunks").fetchone()[0]
+            fd = os.open(self.vectors_path, os.O_RDWR | os.O_CREAT)
+            try:
+                os.pwrite(fd, vectors.tobytes(), start * dim * 4)
+            finally:
+                os.close(fd)
+            conn.executemany(
+                "UPDATE chunks SET deleted = 1 WHERE id = ? AND deleted = 0", [(ids[position],) for position in positions]
+            )
+            conn.executemany(
+                "INSERT INTO chunks (row, id, document, metadata) VALUES (?, ?, ?, ?)",
+                [
+                    (start + offset, ids[position], documents[position], json.dumps(metadatas[position] or {}))
+                    for offset, position in enumerate(positions)
+                ],
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        if self.auto_compact and self.needs_compaction():
+            self.compact_in_background()
+
+    add = upsert
+
+    def update(self, ids, metadatas=None, documents=None):
+        conn = self._connect()
+        if metadatas is not None:
+            conn.executemany(
+                "UPDATE chunks SET metadata = ? WHERE id = ? AND deleted = 0",
+                [(json.dumps(metadata or {}), chunk_id) for chunk_id, metadata in zip(ids, metadatas)],
+            )
+        if documents is not None:
+            conn.executemany(
+                "UPDATE chunks SET document = ? WHERE id = ? AND deleted = 0", list(zip(documents, ids))
+            )
+        conn.commit()
+        conn.close()
+
+    def delete(self, ids=None, where=None):
+        """Mark chunks deleted by id, by metadata filter, or by both (chunks matching both)."""
+        conn = self._connect()
+        try:
+            if where is None:
+                conn.executemany(
+                    "UPDATE chunks SET deleted = 1 WHERE id = ? AND deleted = 0", [(chunk_id,) for chunk_id in ids or []]
+                )
+            else:
+                condition, params = where_sql(where)
+                if ids is None:
+                    conn.execute(f"UPDATE chunks SET deleted = 1 WHERE deleted = 0 AND {condition}", params)
+                for start in range(0, len(ids or []), 500):
+                    batch = ids[start:start + 500]
+                    conn.execute(
+                        f"UPDATE chunks SET deleted = 1 WHERE deleted = 0 AND {condition} "
+                        f"AND id IN ({','.join('?' * len(batch))})",
+                        params + list(batch),
+                    )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=("documents", "metadatas")):
+        condition, params = where_sql(where) if where else ("1", [])
+        conn = self._connect()
+        try:
+            if ids is not None:
+                rows = []
+                for start in range(0, len(ids), 500):
+                    batch = ids[start:start + 500]
+                    rows += conn.execute(
+                        f"SELECT * FROM chunks WHERE deleted = 0 AND {condition} "
+                        f"AND id IN ({','.join('?' * len(batch))}) ORDER BY row",
+                        params + list(batch),
+                    ).fetchall()
+            else:
+                rows = conn.execute(
+                    f"SELECT * FROM chunks WHERE deleted = 0 AND {condition} ORDER BY row LIMIT ? OFFSET ?",
+                    params + [-1 if limit is None else limit, offset or 0],
+                ).fetchall()
+        finally:
+            conn.close()
+        result = {"ids": [row["id"] for row in rows]}
+        if "documents" in include:
+            result["documents"] = [row["document"] for row in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [json.loads(row["metadata"]) for row in rows]
+        if "embeddings" in include:
+            dim, count, _, _ = self._state()
+            vectors = self._vector_rows(dim, count)
+            result["embeddings"] = vectors[[row["row"] for row in rows]] if rows else np.empty((0, dim), np.float32)
+        return result
+
+    def distances(self, queries, vectors):
+        """Exact distances, in Chroma's conventions: squared L2, or 1 - similarity for cosine and ip."""
+        if self.space == "l2":
+            return (queries ** 2).sum(axis=1)[:, None] - 2 * queries @ vectors.T + (vectors ** 2).sum(axis=1)[None, :]
+        return 1.0 - queries @ vectors.T
+
+    def search(self, queries, k, where=None):
+        """Return, per query, up to `k` (row, distance) pairs of live chunks matching `where`, nearest first."""
+        dim, rows, index_file, index_rows = self._state()
+        if not rows:
+            return [[] for _ in queries]
+        queries = self._prepare(queries)
+        vectors = self._vector_rows(dim, rows)
+        allowed = self._matching_rows(where) if where else None
+        if allowed is not None and len(allowed) <= FAISS_FILTER_SCAN_ROWS:
+            candidates = [allowed] * len(queries)
+        else:
+            candidates = self._candidates(queries, k, vectors, rows, index_file, index_rows)
+            if allowed is None:
+                allowed = self._live_rows(set().union(*candidates))
+
+        results = []
+        for query, query_candidates in zip(queries, candidates):
+            query_rows = sorted(query_candidates & allowed)
+            if not query_rows:
+                results.append([])
+                continue
+            exact = self.distances(query[None, :], np.asarray(vectors[query_rows]))[0]
+            order = np.argsort(exact)[:k]
+            results.append([(query_rows[i], float(exact[i])) for i in order])
+        return results
+
+    def _candidates(self, queries, k, vectors, rows, index_file, index_rows):
+        """Approximate nearest rows per query: index hits plus the best of the rows outside the index."""
+        fetch = k * FAISS_RESCORE_FACTOR
+        candidates = [set() for _ in queries]
+        if index_file and index_rows:
+            _, found = self._load_index(index_file).search(queries, fetch)
+            for query_candidates, query_rows in zip(candidates, found):
+                query_candidates.update(int(row) for row in query_rows if row >= 0)
+        # Rows the index does not cover yet are scanned exactly, in blocks.
+        for start in range(index_rows, rows, FAISS_ADD_BATCH):
+            block = np.asarray(vectors[start:min(rows, start + FAISS_ADD_BATCH)])
+            scores = self.distances(queries, block)
+            if block.shape[0] <= fetch:
+                nearest = np.argsort(scores, axis=1)
+            else:
+                nearest = np.argpartition(scores, fetch, axis=1)[:, :fetch]
+            for query_candidates, query_rows in zip(candidates, nearest):
+                query_candidates.update(int(row) + start for row in query_rows)
+        return candidates
+
+    def _matching_rows(self, where):
+        condition, params = where_sql(where)
+        conn = self._connect()
+        try:
+            return {row[0] for row in conn.execute(f"SELECT row FROM chunks WHERE deleted = 0 AND {condition}", params)}
+        finally:
+            conn.close()
+
+    def _live_rows(self, rows):
+        if not rows:
+            return set()
+        conn = self._connect()
+        live = set()
+        rows = list(rows)
+        for start in range(0, len(rows), 500):
+            batch = rows[start:start + 500]
+            live.update(
+                row[0] for row in conn.execute(
+                    f"SELECT row FROM chunks WHERE deleted = 0 AND row IN ({','.join('?' * len(batch))})", batch
+                )
+            )
+        conn.close()
+        return live
+
+    def _rows(self, rows):
+        conn = self._connect()
+        found = {
+            row["row"]: row
+            for row in conn.execute(
+                f"SELECT * FROM chunks WHERE row IN ({','.join('?' * len(rows))})", rows
+            ).fetchall()
+        } if rows else {}
+        conn.close()
+        return found
+
+    def query(self, query_embeddings, n_results=4, where=None, include=("documents", "metadatas", "distances")):
+        matches = self.search(query_embeddings, n_results, where)
+        stored = self._rows(list({row for query_matches in matches for row, _ in query_matches}))
+        result = {"ids": [[stored[row]["id"] for row, _ in query_matches] for query_matches in matches]}
+        if "documents" in include:
+            result["documents"] = [[stored[row]["document"] for row, _ in query_matches] for query_matches in matches]
+        if "metadatas" in include:
+            result["metadatas"] = [
+                [json.loads(stored[row]["metadata"]) for row, _ in query_matches] for query_matches in matches
+            ]
+        if "distances" in include:
+            result["distances"] = [[distance for _, distance in query_matches] for query_matches in matches]
+        if "embeddings" in include:
+            dim, rows, _, _ = self._state()
+            vectors = self._vector_rows(dim, rows)
+            result["embeddings"] = [[np.asarray(vectors[row]) for row, _ in query_matches] for query_matches in matches]
+        return result
+
+    def needs_compaction(self):
+        _, rows, _, index_rows = self._state()
+        return rows - index_rows >= FAISS_DELTA_ROWS and rows >= self._train_after
+
+    def compact_in_background(self):
+        """Run compact on a daemon thread, unless one is already running; returns the thread."""
+        with self._lock:
+            if self._compactor is None or not self._compactor.is_alive():
+                self._compactor = Thread(target=self._compact_logged, name=f"faiss-compact-{self.name}", daemon=True)
+                self._compactor.start()
+            return self._compactor
+
+    def _compact_logged(self):
+        try:
+            self.compact()
+        except Exception:
+            logger.exception("Compacting FAISS collection %s failed", self.name)
+
+    def compact(self, retrain=False):
+        """Add the rows the index does not cover to a new index file (training one first if needed)."""
+        import faiss
+        with open(os.path.join(self.path, "compact.lock"), "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another process is already building one.
+                return
+            dim, rows, index_file, index_rows = self._state()
+            vectors = self._vector_rows(dim, rows)
+            if index_file and not retrain:
+                index = faiss.read_index(os.path.join(self.path, index_file))
+            else:
+                index = self._train(faiss, dim, vectors, rows)
+                if index is None:
+                    return
+                index_rows = 0
+            # Index ids are row numbers because rows are added in order.
+            for start in range(index_rows, rows, FAISS_ADD_BATCH):
+                index.add(np.ascontiguousarray(vectors[start:min(rows, start + FAISS_ADD_BATCH)]))
+            new_file = f"index-{rows}.faiss"
+            faiss.write_index(index, os.path.join(self.path, new_file + ".tmp"))
+            os.replace(os.path.join(self.path, new_file + ".tmp"), os.path.join(self.path, new_file))
+            conn = self._connect()
+            conn.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                [("index_file", new_file), ("index_rows", str(rows))],
+            )
+            conn.commit()
+            conn.close()
+            # Processes still mapping the old file keep reading it until they reload.
+            if index_file and index_file != new_file:
+                os.remove(os.path.join(self.path, index_file))
+            logger.info("Indexed %d rows of FAISS collection %s in %s", rows, self.name, new_file)
+
+    def _train(self, faiss, dim, vectors, rows):
+        metric = faiss.METRIC_L2 if self.space == "l2" else faiss.METRIC_INNER_PRODUCT
+        index = faiss.index_factory(dim, FAISS_INDEX, metric)
+        sample = np.sort(np.random.default_rng(0).choice(rows, size=min(rows, FAISS_TRAIN_SIZE), replace=False))
+        try:
+            index.train(np.ascontiguousarray(vectors[sample]))
+        except RuntimeError as e:
+            # Usually too few vectors for the index's clusters; search stays exact until more arrive.
+            logger.warning("Could not train %s on %d vectors of %s: %s", FAISS_INDEX, len(sample), self.name, e)
+            self._train_after = rows + FAISS_DELTA_ROWS
+            return None
+        return index
+
+def set_search_parameters(index):
+    import faiss
+    space = faiss.ParameterSpace()
+    for name, value in (("nprobe", FAISS_NPROBE), ("efSearch", FAISS_EF_SEARCH)):
+        try:
+            space.set_index_parameter(index, name, value)
+        except RuntimeError:
+            pass
+
+class FaissVectorStore(VectorStore):
+    """LangChain vector store over a FaissCollection, mirroring the Chroma methods the app calls."""
+
+    def __init__(self, collection, embedding_function):
+        self._collection = collection
+        self._embedding_function = embedding_function
+
+    @property
+    def embeddings(self):
+        return self._embedding_function
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        import uuid
+        texts = list(texts)
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        vectors = self._embedding_function.embed_documents(texts)
+        self._collection.upsert(ids=ids, embeddings=vectors, metadatas=metadatas, documents=texts)
+        return ids
+
+    def delete(self, ids=None, **kwargs):
+        self._collection.delete(ids=ids, where=kwargs.get("where") or kwargs.get("filter"))
+
+    def _results(self, result, index=0):
+        return [
+            (Document(page_content=text or "", metadata=metadata or {}, id=chunk_id), distance)
+            for chunk_id, text, metadata, distance in zip(
+                result["ids"][index], result["documents"][index], result["metadatas"][index], result["distances"][index]
+            )
+        ]
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k=4, filter=None, **kwargs):
+        # Like Chroma, the "score" is the distance.
+        return self._results(self._collection.query(query_embeddings=[embedding], n_results=k, where=filter))
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vector_with_relevance_scores(self._embedding_function.embed_query(query), k, filter)
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [document for document, _ in self.similarity_search_by_vector_with_relevance_scores(embedding, k, filter)]
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [document for document, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def max_marginal_relevance_search_by_vector(self, embedding, k=4, fetch_k=20, lambda_mult=0.5, filter=None, **kwargs):
+        result = self._collection.query(
+            query_embeddings=[embedding], n_results=fetch_k, where=filter,
+            include=["documents", "metadatas", "distances", "embeddings"],
+        )
+        if not result["ids"][0]:
+            return []
+        selected = maximal_marginal_relevance(
+            np.array(embedding, dtype=np.float32), result["embeddings"][0], k=k, lambda_mult=lambda_mult
+        )
+        candidates = self._results(result)
+        return [candidates[i][0] for i in selected]
+
+    def max_marginal_relevance_search(self, query, k=4, fetch_k=20, lambda_mult=0.5, filter=None, **kwargs):
+        return self.max_marginal_relevance_search_by_vector(
+            self._embedding_function.embed_query(query), k, fetch_k, lambda_mult, filter
+        )
+
+    def _select_relevance_score_fn(self):
+        if self._collection.space == "cosine":
+            return self._cosine_relevance_score_fn
+        if self._collection.space == "ip":
+            return self._max_inner_product_relevance_score_fn
+        return self._euclidean_relevance_score_fn
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, collection_name="langchain",
+                   collection_metadata=None, persist_directory=FAISS_DB_PATH, **kwargs):
+        """Create (or extend) a collection from texts, like Chroma.from_texts. The app opens its collections with get_vector_store."""
+        store = cls(FaissCollection(collection_name, collection_metadata, root=persist_directory), embedding)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+def import_chroma(collection_name, batch_size=5000):
+    """Copy a Chroma collection, vectors included, into a FAISS collection of the same name."""
+    from chroma_utils import vector_store_manager
+    source = vector_store_manager.client.get_collection(collection_name)
+    target = FaissCollection(collection_name, source.metadata)
+    target.auto_compact = False
+    offset = 0
+    while True:
+        batch = source.get(limit=batch_size, offset=offset, include=["embeddings", "documents", "metadatas"])
+        if not len(batch["ids"]):
+            break
+        target.upsert(batch["ids"], batch["embeddings"], batch["metadatas"], batch["documents"])
+        offset += len(batch["ids"])
+    target.compact()
+    logger.info("Imported %d vectors from Chroma collection %s", offset, collection_name)
+
+def vacuum(collection_name, root=FAISS_DB_PATH):
+    """Rewrite a collection without its deleted rows and retrain its index. Run with the API stopped."""
+    source = FaissCollection(collection_name, root=root)
+    staging = collection_name + ".vacuum"
+    shutil.rmtree(collection_path(staging, root), ignore_errors=True)
+    target = FaissCollection(staging, source.metadata, root=root)
+    target.auto_compact = False
+    offset = 0
+    while True:
+        batch = source.get(limit=FAISS_ADD_BATCH, offset=offset, include=["documents", "metadatas", "embeddings"])
+        if not batch["ids"]:
+            break
+        target.upsert(batch["ids"], batch["embeddings"], batch["metadatas"], batch["documents"])
+        offset += len(batch["ids"])
+    if offset:
+        target.compact(retrain=True)
+    shutil.rmtree(source.path)
+    os.replace(target.path, source.path)
+    logger.info("Vacuumed FAISS collection %s (%d live vectors)", collection_name, offset)
+
+def parse_args():
+    from chroma_utils import DEFAULT_COLLECTION
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["import-chroma", "compact", "vacuum"])
+    parser.add_argument("--collection", default=DEFAULT_COLLECTION)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    args = parse_args()
+    if args.command == "import-chroma":
+        import_chroma(args.collection)
+    elif args.command == "compact":
+        FaissCollection(args.collection).compact()
+    else:
+        vacuum(args.collection)
@@ -0,0 +1,221 @@
+
+from collections import OrderedDict
+from threading import Event, Lock, Thread
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, HumanMessage
+from db_utils import run_db, insert_chat_logs, get_chat_logs, get_last_chat_log_id, delete_chat_logs
+from metrics_utils import track_stage
+from token_utils import count_tokens
+import logging
+import os
+import queue
+
+logger = logging.getLogger(__name__)
+
+# Number of sessions kept in memory per worker; least recently used ones are evicted.
+HISTORY_CACHE_SIZE = int(os.environ.get("HISTORY_CACHE_SIZE", "1000"))
+# Only the last N turns (human + AI message pairs) are passed to the chain as chat_history.
+HISTORY_MAX_TURNS = int(os.environ.get("HISTORY_MAX_TURNS", "10"))
+# Older turns are dropped until the history fits this many (approximate) tokens.
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", "2000"))
+# Turns waiting to be written to chat_logs; turns arriving while it is full are dropped.
+CHAT_LOG_QUEUE_SIZE = int(os.environ.get("CHAT_LOG_QUEUE_SIZE", "10000"))
+# A flush happens once this many turns are pending or the interval has elapsed.
+CHAT_LOG_BATCH_SIZE = int(os.environ.get("CHAT_LOG_BATCH_SIZE", "200"))
+CHAT_LOG_FLUSH_INTERVAL = float(os.environ.get("CHAT_LOG_FLUSH_INTERVAL", "1.0"))
+
+def trim_turns(turns, max_turns=HISTORY_MAX_TURNS, token_budget=HISTORY_TOKEN_BUDGET):
+    turns = turns[-max_turns:] if max_turns > 0 else []
+    total = 0
+    kept = []
+    for human, ai in reversed(turns):
+        total += count_tokens(human) + count_tokens(ai)
+        if total > token_budget:
+            break
+        kept.append((human, ai))
+    kept.reverse()
+    return kept
+
+class ChatLogWriter:
+    """Write-behind queue that stores chat turns in `chat_logs` in batched transactions."""
+
+    def __init__(self, max_queue=CHAT_LOG_QUEUE_SIZE, batch_size=CHAT_LOG_BATCH_SIZE, interval=CHAT_LOG_FLUSH_INTERVAL):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+        self._thread = None
+        self._stopping = Event()
+        self._start_lock = Lock()
+        self._write_lock = Lock()
+        self._stats_lock = Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = Thread(target=self._run, name="chat-log-writer", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        # Anything enqueued after the thread's final drain.
+        self.flush()
+
+    def put(self, row):
+        self.start()
+        try:
+            self.queue.put_nowait(row)
+            with self._stats_lock:
+                self.enqueued += 1
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+            logger.warning("Chat log queue full, dropped turn for session %s (%d dropped)", row[0], self.dropped)
+
+    def _take(self, block):
+        rows = []
+        try:
+            rows.append(self.queue.get(timeout=self.interval) if block else self.queue.get_nowait())
+            while len(rows) < self.batch_size:
+                rows.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return rows
+
+    def _write(self, rows):
+        if not rows:
+            return
+        with self._write_lock:
+            try:
+                with track_stage("chat", "log_write", rows=len(rows)):
+                    insert_chat_logs(rows)
+                self.written += len(rows)
+                self.flushes += 1
+            except Exception:
+                self.failed += len(rows)
+                logger.exception("Failed to write %d chat log rows", len(rows))
+
+    def flush(self):
+        while rows := self._take(block=False):
+            self._write(rows)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._write(self._take(block=True))
+        self.flush()
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "flushes": self.flushes,
+        }
+
+chat_log_writer = ChatLogWriter()
+
+class SQLiteChatMessageHistory(BaseChatMessageHistory):
+    """Chat history that persists every turn to `chat_logs` and keeps a bounded window in memory.
+
+    Turns are visible in memory immediately and reach the table through the
+    write-behind `chat_log_writer`; once they land, the session's newer row id
+    makes the store reload it from the database.
+    """
+
+    def __init__(self, session_id, turns=None, last_log_id=None):
+        self.session_id = session_id
+        self.turns = trim_turns(turns or [])
+        self.last_log_id = last_log_id
+        self._lock = Lock()
+
+    @classmethod
+    def load(cls, session_id):
+        rows = get_chat_logs(session_id, HISTORY_MAX_TURNS)
+        turns = [(row["human_message"], row["ai_message"]) for row in rows]
+        last_log_id = rows[-1]["id"] if rows else None
+        return cls(session_id, turns, last_log_id)
+
+    @property
+    def messages(self):
+        messages = []
+        for human, ai in self.turns:
+            messages.append(HumanMessage(content=human))
+            messages.append(AIMessage(content=ai))
+        return messages
+
+    def add_messages(self, messages):
+        turns = []
+        human = None
+        for message in messages:
+            if message.type == "human":
+                human = message.content
+            elif message.type == "ai" and human is not None:
+                turns.append((human, message.content))
+                human = None
+        if not turns:
+            return
+        with self._lock:
+            self.turns = trim_turns(self.turns + turns)
+        for human, ai in turns:
+            chat_log_writer.put((self.session_id, human, ai))
+
+    def clear(self):
+        with self._lock:
+            chat_log_writer.flush()
+            delete_chat_logs(self.session_id)
+            self.turns = []
+            self.last_log_id = None
+
+class SessionHistoryStore:
+    """LRU cache of hot sessions in front of the SQLite `chat_logs` table."""
+
+    def __init__(self, max_sessions=HISTORY_CACHE_SIZE):
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, session_id):
+        with track_stage("chat", "history_load", session_id=session_id):
+            return self._get(session_id)
+
+    def _get(self, session_id):
+        # Another worker may have appended turns since we cached this session,
+        # so compare against the newest row id before trusting the cache.
+        last_log_id = get_last_chat_log_id(session_id)
+        with self._lock:
+            history = self.sessions.get(session_id)
+            if history is not None and history.last_log_id == last_log_id:
+                self.sessions.move_to_end(session_id)
+                return history
+        # Turns still on the write-behind queue would be missing from the reload.
+        chat_log_writer.flush()
+        history = SQLiteChatMessageHistory.load(session_id)
+        with self._lock:
+            self.sessions[session_id] = history
+            self.sessions.move_to_end(session_id)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+        return history
+
+session_history_store = SessionHistoryStore()
+
+def get_session_history(session_id, session_history=None):
+    # Async callers load the history with aget_session_history and pass it in
+    # through the config; RunnableWithMessageHistory calls this on the event
+    # loop, so only synchronous callers should leave it to load here.
+    if session_history is not None:
+        return session_history
+    return session_history_store.get(session_id)
+
+async def aget_session_history(session_id):
+    return await run_db(get_session_history, session_id)
@@ -0,0 +1,329 @@
+
+from concurrent.futures import ProcessPoolExecutor
+from chroma_utils import get_vector_store, iter_split_document
+from lexical_utils import lexical_index
+from cache_utils import answer_cache
+from metrics_utils import timed_iter, track_stage
+from langchain_core.documents import Document
+from db_utils import (
+    run_db, insert_document, get_document, update_job, claim_job, renew_job_lease, get_claimable_jobs,
+    get_chunk_manifest, insert_chunk_manifest, delete_chunk_manifest, get_chunk_references, delete_chunk_signatures,
+)
+import asyncio
+import hashlib
+import logging
+import os
+import socket
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Number of jobs processed concurrently per worker process.
+INGESTION_WORKERS = int(os.environ.get("INGESTION_WORKERS", "2"))
+# Processes used for parsing and splitting PDFs.
+PARSER_PROCESSES = int(os.environ.get("PARSER_PROCESSES", str(os.cpu_count() or 1)))
+# Chunks sent to the embedding model per add_documents call.
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "256"))
+
+# Seconds a worker holds a claimed job without renewing it. A job whose
+# worker died is claimed again by another worker once its lease expires.
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "120"))
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+job_queue = asyncio.Queue()
+queued_job_ids = set()
+worker_tasks = []
+parser_pool = None
+
+def get_parser_pool():
+    global parser_pool
+    if parser_pool is None:
+        parser_pool = ProcessPoolExecutor(max_workers=PARSER_PROCESSES)
+    return parser_pool
+
+def chunk_hash(chunk):
+    return hashlib.sha256(chunk.page_content.encode("utf-8")).hexdigest()
+
+def chunk_id(doc_id, index, content_hash):
+    return f"{doc_id}:{index}:{content_hash[:16]}"
+
+def file_sha256(path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+def index_document(doc_id, chunks):
+    """Bring the indexed chunks of `doc_id` in line with `chunks`, embedding only what changed.
+
+    `chunks` may be a generator; it is consumed once and embedded in batches of
+    EMBEDDING_BATCH_SIZE, so only one batch is held in memory at a time. New
+    chunks that nearly duplicate an indexed chunk are not embedded: one with
+    the same text references that chunk's entry, one whose text differs is
+    stored with its own text and metadata under the matched vector. Returns
+    (added, kept, removed, deduplicated) chunk counts.
+    """
+    # numpy is only needed once something is indexed.
+    from dedup_utils import ChunkDeduplicator
+
+    # Existing chunks are matched by content hash; identical chunks that only
+    # moved keep their vectors, duplicates are matched one occurrence at a time.
+    existing = {}
+    own_ids = set()
+    for row in get_chunk_manifest(doc_id):
+        existing.setdefault(row["content_hash"], []).append(row)
+        own_ids.add(row["chunk_id"])
+
+    vector_store = get_vector_store()
+    deduplicator = ChunkDeduplicator()
+
+    # The manifest is written batch by batch right after the vectors, so an
+    # interrupted run can simply be diffed again.
+    def flush(batch):
+        # The document's own previous chunks may be about to be removed, so
+        # they are not used as canonical chunks.
+        duplicates, new = deduplicator.assign([(item[0], item[3]) for item in batch], exclude=own_ids)
+        chunks_by_id = {item[0]: item[3] for item in batch}
+        new_ids = [cid for cid in chunks_by_id if cid in new]
+        vectors = {}
+        if new_ids:
+            with track_stage("ingest", "embed", doc_id=doc_id, chunks=len(new_ids)):
+                texts = [chunks_by_id[cid].page_content for cid in new_ids]
+                vectors = dict(zip(new_ids, vector_store.embeddings.embed_documents(texts)))
+        own = own_entry_vectors(vector_store, duplicates, chunks_by_id, vectors)
+        vectors.update(own)
+        if vectors:
+            batch_ids = list(vectors)
+            batch_chunks = [chunks_by_id[cid] for cid in batch_ids]
+            with track_stage("ingest", "insert", doc_id=doc_id, chunks=len(batch_ids)):
+                vector_store._collection.upsert(
+                    ids=batch_ids,
+                    embeddings=[list(map(float, vector)) for vector in vectors.values()],
+                    metadatas=[chunk.metadata for chunk in batch_chunks],
+                    documents=[chunk.page_content for chunk in batch_chunks],
+                )
+                lexical_index.add(batch_ids, batch_chunks)
+        insert_chunk_manifest([
+            (cid, doc_id, index, content_hash, None if cid in own else duplicates.get(cid))
+            for cid, index, content_hash, _ in batch
+        ])
+        deduplicator.commit(new)
+        return len(new_ids), len(duplicates)
+
+    batch = []
+    moved = []
+    added = kept = deduplicated = 0
+    # Parsing and splitting are interleaved page by page, so they are timed together.
+    for index, chunk in enumerate(timed_iter(chunks, "ingest", "parse_split")):
+        content_hash = chunk_hash(chunk)
+        if existing.get(content_hash):
+            row = existing[content_hash].pop(0)
+            kept += 1
+            if row["chunk_index"] != index:
+                moved.append((row, index))
+                if len(moved) >= EMBEDDING_BATCH_SIZE:
+                    move_chunks(doc_id, moved)
+                    moved = []
+            continue
+        chunk.metadata["doc_id"] = doc_id
+        chunk.metadata["chunk_index"] = index
+        batch.append((chunk_id(doc_id, index, content_hash), index, content_hash, chunk))
+        if len(batch) >= EMBEDDING_BATCH_SIZE:
+            embedded, shared = flush(batch)
+            added += embedded
+            deduplicated += shared
+            batch = []
+    if batch:
+        embedded, shared = flush(batch)
+        added += embedded
+        deduplicated += shared
+    move_chunks(doc_id, moved)
+
+    stale = [row for rows in existing.values() for row in rows]
+    remove_chunks(stale)
+    return added, kept, len(stale), deduplicated
+
+def own_entry_vectors(vector_store, duplicates, chunks_by_id, new_vectors):
+    """Vectors of the near duplicates that need an entry of their own.
+
+    One whose text differs from its match's keeps its own text and metadata
+    under the match's vector; one whose match has left the store is embedded
+    after all. The rest simply reference their match's entry.
+    """
+    matches = {canonical for canonical in duplicates.values() if canonical not in new_vectors}
+    texts, vectors = {}, dict(new_vectors)
+    if matches:
+        stored = vector_store._collection.get(ids=list(matches), include=["documents", "embeddings"])
+        texts.update(zip(stored["ids"], stored["documents"]))
+        vectors.update(zip(stored["ids"], stored["embeddings"]))
+    texts.update((cid, chunks_by_id[cid].page_content) for cid in new_vectors)
+
+    own = {
+        cid: vectors[canonical] for cid, canonical in duplicates.items()
+        if canonical in texts and texts[canonical] != chunks_by_id[cid].page_content
+    }
+    missing = [cid for cid, canonical in duplicates.items() if canonical not in texts]
+    if missing:
+        own.update(zip(missing, vector_store.embeddings.embed_documents([chunks_by_id[cid].page_content for cid in missing])))
+    return own
+
+def move_chunks(doc_id, moves):
+    """Give kept chunks whose position changed, as (manifest row, new index) pairs, their new chunk_index.
+
+    Chunks with an entry of their own get it updated in the vector store and
+    the lexical index too; chunks referencing another document's entry only
+    have a manifest row.
+    """
+    if not moves:
+        return
+    insert_chunk_manifest([
+        (row["chunk_id"], doc_id, index, row["content_hash"], row["canonical_chunk_id"]) for row, index in moves
+    ])
+    owned = {row["chunk_id"]: index for row, index in moves if row["canonical_chunk_id"] is None}
+    if not owned:
+        return
+    vector_store = get_vector_store()
+    stored = vector_store._collection.get(ids=list(owned), include=["documents", "metadatas"])
+    documents = [
+        Document(page_content=text or "", metadata=dict(metadata or {}, chunk_index=owned[cid]))
+        for cid, text, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"])
+    ]
+    if documents:
+        vector_store._collection.update(ids=stored["ids"], metadatas=[document.metadata for document in documents])
+        lexical_index.add(stored["ids"], documents)
+
+def remove_chunks(rows):
+    """Remove chunk manifest rows along with the vectors only they use.
+
+    A removed vector that other chunks still reference is handed over to one
+    of them instead: it keeps its id and takes that chunk's metadata.
+    """
+    if not rows:
+        return
+    removed_ids = {row["chunk_id"] for row in rows}
+    owner_ids = [row["chunk_id"] for row in rows if row["canonical_chunk_id"] is None]
+    heirs = {}
+    for row in get_chunk_references(owner_ids):
+        if row["chunk_id"] not in removed_ids:
+            heirs.setdefault(row["canonical_chunk_id"], row)
+
+    vector_store = get_vector_store()
+    if heirs:
+        stored = vector_store._collection.get(ids=list(heirs), include=["documents", "metadatas"])
+        documents = []
+        for owner_id, text, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"]):
+            heir = heirs[owner_id]
+            metadata = dict(metadata or {}, doc_id=heir["doc_id"], chunk_index=heir["chunk_index"])
+            documents.append(Document(page_content=text or "", metadata=metadata))
+        vector_store._collection.update(ids=stored["ids"], metadatas=[document.metadata for document in documents])
+        lexical_index.add(stored["ids"], documents)
+        # The heir's manifest row is replaced by one under the vector's id, so
+        # the other chunks referencing it stay valid.
+        insert_chunk_manifest([
+            (owner_id, heir["doc_id"], heir["chunk_index"], heir["content_hash"], None) for owner_id, heir in heirs.items()
+        ])
+        delete_chunk_manifest([heir["chunk_id"] for heir in heirs.values()])
+
+    orphan_ids = [cid for cid in owner_ids if cid not in heirs]
+    if orphan_ids:
+        vector_store.delete(ids=orphan_ids)
+        lexical_index.delete(orphan_ids)
+        delete_chunk_signatures(orphan_ids)
+    delete_chunk_manifest([cid for cid in removed_ids if cid not in heirs])
+
+def delete_document_vectors(doc_id):
+    remove_chunks(get_chunk_manifest(doc_id))
+    answer_cache.invalidate_document(doc_id)
+
+async def run_job(job):
+    # Several processes may list the same job; only the one whose claim succeeds runs it.
+    now = time.time()
+    if not await run_db(claim_job, job["job_id"], WORKER_ID, now + JOB_LEASE_SECONDS, now):
+        logger.info("Job %s is already taken", job["job_id"])
+        return
+    lease = asyncio.create_task(keep_lease(job["job_id"]))
+    try:
+        await index_job(job)
+    finally:
+        lease.cancel()
+
+async def keep_lease(job_id):
+    while True:
+        await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+        if not await run_db(renew_job_lease, job_id, WORKER_ID, time.time() + JOB_LEASE_SECONDS):
+            logger.warning("Lost the lease on job %s", job_id)
+            return
+
+async def index_job(job):
+    loop = asyncio.get_running_loop()
+    job_id, doc_id = job["job_id"], job["doc_id"]
+    try:
+        chunks = iter_split_document(job["file_path"], get_parser_pool(), max_pending=2 * PARSER_PROCESSES)
+        # to_thread carries the current span over to the indexing thread.
+        with track_stage("ingest", "total", doc_id=doc_id, job_id=job_id):
+            added, kept, removed, deduplicated = await asyncio.to_thread(index_document, doc_id, chunks)
+        logger.info(
+            "Job %s indexed %s: %d added, %d unchanged, %d removed, %d deduplicated",
+            job_id, doc_id, added, kept, removed, deduplicated,
+        )
+        if added or removed or deduplicated:
+            await loop.run_in_executor(None, answer_cache.invalidate_document, doc_id)
+        # Jobs resumed after a restart were queued without the upload's hash.
+        file_hash = job.get("file_hash") or await asyncio.to_thread(file_sha256, job["file_path"])
+        await run_db(insert_document, doc_id, job["filename"], file_hash)
+        await run_db(update_job, job_id, "completed", added + kept + deduplicated, None, deduplicated)
+    except Exception as e:
+        logger.exception("Ingestion job %s failed", job_id)
+        # A brand-new document must not stay half-indexed; an update keeps
+        # its previous chunks and can be retried.
+        if await run_db(get_document, doc_id) is None:
+            try:
+                await loop.run_in_executor(None, delete_document_vectors, doc_id)
+            except Exception:
+                logger.exception("Could not clean up vectors for job %s", job_id)
+        await run_db(update_job, job_id, "failed", None, str(e))
+
+async def worker():
+    while True:
+        job = await job_queue.get()
+        try:
+            await run_job(job)
+        except Exception:
+            logger.exception("Could not run ingestion job %s", job["job_id"])
+        finally:
+            queued_job_ids.discard(job["job_id"])
+            job_queue.task_done()
+
+def enqueue_job(job):
+    if job["job_id"] not in queued_job_ids:
+        queued_job_ids.add(job["job_id"])
+        job_queue.put_nowait(job)
+
+async def recover_jobs():
+    # Picks up jobs left queued by a stopped process and jobs whose worker
+    # died mid-run; indexing is diff-based, so re-running an interrupted job
+    # only fills in the missing chunks.
+    while True:
+        try:
+            for job in await run_db(get_claimable_jobs, time.time()):
+                enqueue_job(dict(job))
+        except Exception:
+            logger.exception("Could not list ingestion jobs to recover")
+        await asyncio.sleep(JOB_LEASE_SECONDS)
+
+async def start_workers():
+    for _ in range(INGESTION_WORKERS):
+        worker_tasks.append(asyncio.create_task(worker()))
+    worker_tasks.append(asyncio.create_task(recover_jobs()))
+
+async def stop_workers():
+    global parser_pool
+    for task in worker_tasks:
+        task.cancel()
+    await asyncio.gather(*worker_tasks, return_exceptions=True)
+    worker_tasks.clear()
+    if parser_pool is not None:
+        parser_pool.shutdown(cancel_futures=True)
+        parser_pool = None
@@ -1,20 +1,34 @@
 
-from langchain_openai import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.chains import create_history_aware_retriever, create_retrieval_chain
-from langchain.chains.combine_documents import create_stuff_documents_chain
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import ConfigurableFieldSpec, RunnableBranch, RunnableGenerator, RunnableLambda, RunnablePassthrough
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, HumanMessage
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from db_utils import get_db_connection
+from operator import itemgetter
+from threading import Lock
 from chroma_utils import get_vector_store
+from embedding_utils import embedding_model_name
+from cache_utils import answer_cache
+from lexical_utils import lexical_index
+from retriever_utils import HybridRetriever, retriever_settings
+from history_utils import get_session_history, aget_session_history
+from planner_utils import skip_rewrite
+from context_utils import pack_context
+from metrics_utils import StageMetricsHandler, track_stage
+import asyncio
 import os
+import time
+
+# Maximum number of LLM calls in flight for a single /chat/batch request.
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "8"))
 
 # Set your OpenAI API key
 os.environ["OPENAI_API_KEY"] = "YOUR_OPENAI_API_KEY"
 
-llm = ChatOpenAI(model="gpt-3.5-turbo-0125", temperature=0.2)
-
 def get_retriever():
-    return get_vector_store().as_retriever()
+    vector_store = get_vector_store()
+    return HybridRetriever(vector_store=vector_store, lexical_index=lexical_index, **retriever_settings(vector_store))
 
 contextualize_q_system_prompt = """
 Given a chat history and the latest user question 
@@ -32,12 +46,6 @@ contextualize_q_prompt = ChatPromptTemplate.from_messages(
     ]
 )
 
-history_aware_retriever = create_history_aware_retriever(
-    llm,
-    get_retriever(),
-    contextualize_q_prompt
-)
-
 qa_system_prompt = """
 Answer the user's questions based on the below context.
 If the context doesn't contain the answer, say that you don't know.
@@ -53,23 +61,202 @@ qa_prompt = ChatPromptTemplate.from_messages(
     ]
 )
 
-question_answer_chain = create_stuff_documents_chain(llm, qa_prompt)
-
-rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
-
-def get_session_history(session_id):
-    # This is a placeholder for a proper session management system.
-    # In a real application, you would use a database or a cache to store session history.
-    if not hasattr(get_session_history, "history"):
-        get_session_history.history = {}
-    if session_id not in get_session_history.history:
-        get_session_history.history[session_id] = []
-    return get_session_history.history[session_id]
-
-conversational_rag_chain = RunnableWithMessageHistory(
-    rag_chain,
-    get_session_history,
-    input_messages_key="input",
-    history_messages_key="chat_history",
-    output_messages_key="answer",
-)
+def cache_answer(chunks):
+    started = time.perf_counter()
+    output = None
+    for chunk in chunks:
+        output = chunk if output is None else output + chunk
+        yield chunk
+    answer_cache.add(output["standalone_question"], output["answer"], output["context"], time.perf_counter() - started)
+
+async def acache_answer(chunks):
+    started = time.perf_counter()
+    output = None
+    async for chunk in chunks:
+        output = chunk if output is None else output + chunk
+        yield chunk
+    await asyncio.get_running_loop().run_in_executor(
+        None,
+        answer_cache.add,
+        output["standalone_question"],
+        output["answer"],
+        output["context"],
+        time.perf_counter() - started,
+    )
+
+class RagChains:
+    """The LLM client, retriever and chains, built together on first use."""
+
+    def __init__(self):
+        from langchain_openai import ChatOpenAI
+        from langchain.chains.combine_documents import create_stuff_documents_chain
+
+        # stream_usage makes streamed responses report token counts too.
+        self.llm = ChatOpenAI(model="gpt-3.5-turbo-0125", temperature=0.2, stream_usage=True)
+        self.retriever = get_retriever()
+
+        # The rewrite LLM call only runs when the planner thinks the question leans on
+        # the chat history; first turns and self-contained follow-ups go straight through.
+        self.standalone_question_chain = RunnableBranch(
+            (skip_rewrite, itemgetter("input")),
+            (contextualize_q_prompt | self.llm | StrOutputParser()).with_config(run_name="rewrite"),
+        )
+
+        self.question_answer_chain = create_stuff_documents_chain(self.llm, qa_prompt)
+
+        # Retrieval, context packing and generation, streamed through a pass-through
+        # step that stores the finished answer in the semantic cache.
+        answer_chain = (
+            RunnablePassthrough.assign(
+                context=itemgetter("standalone_question")
+                | self.retriever.with_config(run_name="retrieval")
+                | RunnableLambda(pack_context).with_config(run_name="context_packing")
+            )
+            .assign(answer=self.question_answer_chain.with_config(run_name="generation"))
+            | RunnableGenerator(cache_answer, acache_answer)
+        )
+
+        cached_answer_chain = (
+            RunnablePassthrough.assign(context=lambda x: x["cached"]["context"])
+            .assign(answer=lambda x: x["cached"]["answer"])
+        )
+
+        rag_chain = (
+            RunnablePassthrough.assign(standalone_question=self.standalone_question_chain)
+            | RunnablePassthrough.assign(
+                cached=itemgetter("standalone_question")
+                | RunnableLambda(answer_cache.lookup, afunc=answer_cache.alookup).with_config(run_name="cache_lookup")
+            )
+            | RunnableBranch(
+                (lambda x: x["cached"] is not None, cached_answer_chain),
+                answer_chain,
+            )
+        )
+
+        # Callers pass both the session id and its history, loaded with
+        # aget_session_history; a None history is loaded synchronously.
+        self.conversational_rag_chain = RunnableWithMessageHistory(
+            rag_chain,
+            get_session_history,
+            input_messages_key="input",
+            history_messages_key="chat_history",
+            output_messages_key="answer",
+            history_factory_config=[
+                ConfigurableFieldSpec(id="session_id", annotation=str, default="", is_shared=True),
+                ConfigurableFieldSpec(id="session_history", annotation=BaseChatMessageHistory, default=None, is_shared=True),
+            ],
+        ).with_config(callbacks=[StageMetricsHandler("chat", ["rewrite", "cache_lookup", "retrieval", "context_packing", "generation"])])
+
+chains = None
+chains_lock = Lock()
+
+def get_chains():
+    global chains
+    if chains is None:
+        with chains_lock:
+            if chains is None:
+                chains = RagChains()
+    return chains
+
+async def aget_chains():
+    # The first build imports the OpenAI client and opens the vector store, so
+    # it must not run on the event loop.
+    if chains is not None:
+        return chains
+    return await asyncio.to_thread(get_chains)
+
+async def lookup_and_retrieve(rag, questions):
+    """Return (cache entry or None, packed context or None) per question, embedding each model's input once."""
+    loop = asyncio.get_running_loop()
+    embeddings = get_vector_store().embeddings
+    cache_embeddings = answer_cache.store.embeddings
+    with track_stage("batch", "embed"):
+        vectors = await loop.run_in_executor(None, embeddings.embed_documents, questions)
+        # The answer cache may use another embedding model than the documents.
+        if embedding_model_name(cache_embeddings) == embedding_model_name(embeddings):
+            cache_vectors = vectors
+        else:
+            cache_vectors = await loop.run_in_executor(None, cache_embeddings.embed_documents, questions)
+    with track_stage("batch", "cache_lookup"):
+        cached = await loop.run_in_executor(None, answer_cache.lookup_by_vectors, cache_vectors)
+    uncached = [i for i, entry in enumerate(cached) if entry is None]
+    with track_stage("batch", "retrieval"):
+        retrieved = await loop.run_in_executor(
+            None, rag.retriever.batch_retrieve, [questions[i] for i in uncached], [vectors[i] for i in uncached]
+        )
+    contexts = [None] * len(questions)
+    for i, documents in zip(uncached, retrieved):
+        contexts[i] = pack_context(documents)
+    return cached, contexts
+
+async def abatch_chat(queries, concurrency=BATCH_CONCURRENCY):
+    """Answer many (query, session_id) pairs, yielding one result dict per query in input order.
+
+    Standalone questions are embedded in one request and searched in one Chroma
+    query; rewrite and answer LLM calls run with at most `concurrency` in flight.
+    Each query sees its session's history as it was when the batch started.
+    """
+    loop = asyncio.get_running_loop()
+    rag = await aget_chains()
+    semaphore = asyncio.Semaphore(concurrency)
+    rewrite_metrics = StageMetricsHandler("batch", root_stage="rewrite")
+    generation_metrics = StageMetricsHandler("batch", root_stage="generation")
+    with track_stage("batch", "history_load"):
+        histories = [await aget_session_history(q.session_id) for q in queries]
+    chat_histories = [history.messages for history in histories]
+
+    async def standalone(query, chat_history):
+        inputs = {"input": query.query, "chat_history": chat_history}
+        config = {"configurable": {"session_id": query.session_id}, "callbacks": [rewrite_metrics]}
+        async with semaphore:
+            return await rag.standalone_question_chain.ainvoke(inputs, config=config)
+
+    questions = await asyncio.gather(
+        *(standalone(query, chat_history) for query, chat_history in zip(queries, chat_histories)),
+        return_exceptions=True,
+    )
+    errors = {i: question for i, question in enumerate(questions) if isinstance(question, BaseException)}
+    pending = [i for i in range(len(queries)) if i not in errors]
+    cached, contexts = {}, {}
+    # The shared steps run after the response has started, so a failure there
+    # becomes an error result for each query instead of ending the stream.
+    try:
+        if pending:
+            cached, contexts = await lookup_and_retrieve(rag, [questions[i] for i in pending])
+            cached, contexts = dict(zip(pending, cached)), dict(zip(pending, contexts))
+    except Exception as e:
+        errors.update((i, e) for i in pending)
+
+    async def answer(i):
+        query = queries[i]
+        if i in errors:
+            return {"index": i, "session_id": query.session_id, "error": str(errors[i])}
+        try:
+            if cached[i] is not None:
+                response, context = cached[i]["answer"], cached[i]["context"]
+            else:
+                context = contexts[i]
+                async with semaphore:
+                    started = time.perf_counter()
+                    response = await rag.question_answer_chain.ainvoke(
+                        {"input": query.query, "chat_history": chat_histories[i], "context": context},
+                        config={"metadata": {"session_id": query.session_id}, "callbacks": [generation_metrics]},
+                    )
+                    latency = time.perf_counter() - started
+                await loop.run_in_executor(None, answer_cache.add, questions[i], response, context, latency)
+            await loop.run_in_executor(
+                None,
+                histories[i].add_messages,
+                [HumanMessage(content=query.query), AIMessage(content=response)],
+            )
+            return {"index": i, "session_id": query.session_id, "response": response}
+        except Exception as e:
+            return {"index": i, "session_id": query.session_id, "error": str(e)}
+
+    tasks = [asyncio.create_task(answer(i)) for i in range(len(queries))]
+    try:
+        for task in tasks:
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,146 @@
+
+from langchain_core.documents import Document
+from threading import Lock
+import json
+import os
+import re
+import sqlite3
+
+LEXICAL_INDEX_PATH = os.environ.get("LEXICAL_INDEX_PATH", "./lexical_index.db")
+
+# Hyphens and underscores are kept inside tokens so identifiers such as
+# "XJ-42" or "ERR_TIMEOUT" are indexed as a single term.
+FTS_TOKENIZER = "unicode61 tokenchars '-_'"
+
+TERM_PATTERN = re.compile(r"[\w\-.]+")
+IDENTIFIER_PATTERN = re.compile(r"\d|[A-Za-z][-_][A-Za-z0-9]")
+
+def query_terms(query):
+    return [term.strip("-.") for term in TERM_PATTERN.findall(query) if term.strip("-.")]
+
+def identifier_terms(query):
+    # Part numbers, clause IDs, error codes: anything with a digit, an inner
+    # hyphen/underscore, or written in capitals.
+    return [
+        term for term in query_terms(query)
+        if IDENTIFIER_PATTERN.search(term) or (term.isupper() and len(term) > 1)
+    ]
+
+def to_match_expression(terms):
+    # Each term is quoted so FTS5 treats punctuation inside it (e.g. "4.2.1") as a phrase.
+    return " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+class LexicalIndex:
+    """BM25 inverted index of chunk text, stored in SQLite FTS5."""
+
+    def __init__(self, path=LEXICAL_INDEX_PATH):
+        self.path = path
+        self._schema_ready = False
+        self._schema_lock = Lock()
+
+    def _create_tables(self, conn):
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS lexical_chunks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chunk_id TEXT NOT NULL UNIQUE,
+            doc_id TEXT NOT NULL,
+            metadata TEXT NOT NULL
+        );
+        """)
+        conn.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(content, tokenize="{FTS_TOKENIZER}");
+        """)
+        conn.commit()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.row_factory = sqlite3.Row
+        # The tables are created on first use, not when the module is imported.
+        if not self._schema_ready:
+            with self._schema_lock:
+                if not self._schema_ready:
+                    self._create_tables(conn)
+                    self._schema_ready = True
+        return conn
+
+    def add(self, chunk_ids, documents):
+        conn = self._connect()
+        try:
+            self._delete(conn, chunk_ids)
+            for chunk_id, document in zip(chunk_ids, documents):
+                cursor = conn.execute(
+                    "INSERT INTO lexical_chunks (chunk_id, doc_id, metadata) VALUES (?, ?, ?)",
+                    (chunk_id, document.metadata.get("doc_id", ""), json.dumps(document.metadata)),
+                )
+                conn.execute(
+                    "INSERT INTO chunks_fts (rowid, content) VALUES (?, ?)",
+                    (cursor.lastrowid, document.page_content),
+                )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _delete(self, conn, chunk_ids):
+        for chunk_id in chunk_ids:
+            row = conn.execute("SELECT id FROM lexical_chunks WHERE chunk_id = ?", (chunk_id,)).fetchone()
+            if row is not None:
+                conn.execute("DELETE FROM chunks_fts WHERE rowid = ?", (row["id"],))
+                conn.execute("DELETE FROM lexical_chunks WHERE id = ?", (row["id"],))
+
+    def delete(self, chunk_ids):
+        conn = self._connect()
+        try:
+            self._delete(conn, chunk_ids)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def count(self):
+        conn = self._connect()
+        count = conn.execute("SELECT COUNT(*) FROM lexical_chunks").fetchone()[0]
+        conn.close()
+        return count
+
+    def search(self, query, k=4):
+        """Return up to `k` (Document, bm25 score) pairs, best first; lower scores are better."""
+        terms = query_terms(query)
+        if not terms:
+            return []
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                """
+                SELECT l.chunk_id, l.metadata, f.content, bm25(chunks_fts) AS score
+                FROM chunks_fts f JOIN lexical_chunks l ON l.id = f.rowid
+                WHERE chunks_fts MATCH ?
+                ORDER BY score
+                LIMIT ?
+                """,
+                (to_match_expression(terms), k),
+            ).fetchall()
+        finally:
+            conn.close()
+        return [
+            (Document(page_content=row["content"], metadata=json.loads(row["metadata"]), id=row["chunk_id"]), row["score"])
+            for row in rows
+        ]
+
+    def rebuild_from(self, vector_store, batch_size=1000):
+        # Backfill for chunks that were indexed in Chroma before this index existed.
+        collection = vector_store._collection
+        offset = 0
+        while True:
+            batch = collection.get(limit=batch_size, offset=offset, include=["documents", "metadatas"])
+            if not batch["ids"]:
+                break
+            self.add(
+                batch["ids"],
+                [
+                    Document(page_content=text or "", metadata=metadata or {})
+                    for text, metadata in zip(batch["documents"], batch["metadatas"])
+                ],
+            )
+            offset += len(batch["ids"])
+
+lexical_index = LexicalIndex()
@@ -1,65 +1,289 @@
 
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from pydantic_models import QueryInput, QueryResponse, DocumentInfo, DeleteFileRequest
-from langchain_utils import conversational_rag_chain
-from chroma_utils import get_vector_store, load_and_split_document
-from db_utils import get_db_connection
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from contextlib import asynccontextmanager, suppress
+from pydantic_models import (
+    QueryInput, QueryResponse, BatchQueryInput, BatchQueryResult, DocumentInfo, DeleteFileRequest, JobInfo,
+)
+from langchain_utils import BATCH_CONCURRENCY, get_chains, aget_chains, abatch_chat
+from db_utils import (
+    run_db, db_pool, insert_job, update_job, get_job, get_document, get_document_by_hash, list_documents, delete_document,
+    get_chunk_manifest,
+)
+from chroma_utils import vector_store_manager, get_vector_store
+from lexical_utils import lexical_index
+from cache_utils import answer_cache
+from history_utils import chat_log_writer, aget_session_history
+from ingestion_utils import enqueue_job, start_workers, stop_workers, delete_document_vectors
+from metrics_utils import register_stats, track_stage
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from typing import Optional
+from threading import Event
+import asyncio
+import hashlib
+import json
 import os
 import uuid
 
-app = FastAPI()
+warmed_up = Event()
+
+def warm_up():
+    # Nothing expensive happens at import; the vector store, models and chains
+    # are built here, in the background, and /ready reports when it is done.
+    vector_store_manager.warm_up()
+    vector_store = get_vector_store()
+    if lexical_index.count() == 0 and vector_store._collection.count() > 0:
+        lexical_index.rebuild_from(vector_store)
+    get_chains()
+    warmed_up.set()
+
+@asynccontextmanager
+async def lifespan(app):
+    warm_up_task = asyncio.create_task(asyncio.to_thread(warm_up))
+    chat_log_writer.start()
+    await start_workers()
+    yield
+    warm_up_task.cancel()
+    await stop_workers()
+    await asyncio.to_thread(chat_log_writer.stop)
+    db_pool.close_all()
+
+app = FastAPI(lifespan=lifespan)
+
+register_stats("rag_answer_cache", answer_cache.stats, "Semantic answer cache")
+register_stats("rag_chat_log_writer", chat_log_writer.stats, "Chat log write-behind queue")
 
 UPLOAD_DIR = "./uploads"
 if not os.path.exists(UPLOAD_DIR):
     os.makedirs(UPLOAD_DIR)
 
+UPLOAD_BLOCK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(1024 * 1024 * 1024)))
+
+# Maximum number of /chat requests running the RAG chain at once per worker.
+CHAT_CONCURRENCY_LIMIT = int(os.environ.get("CHAT_CONCURRENCY_LIMIT", "16"))
+# Seconds a request may wait for a free slot before being rejected with 429.
+CHAT_QUEUE_TIMEOUT = float(os.environ.get("CHAT_QUEUE_TIMEOUT", "5"))
+
+chat_semaphore = asyncio.Semaphore(CHAT_CONCURRENCY_LIMIT)
+
+async def acquire_chat_slots(count=1):
+    """Take `count` chat slots; if they are not all free within CHAT_QUEUE_TIMEOUT, take none and raise 429."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + CHAT_QUEUE_TIMEOUT
+    acquired = 0
+    try:
+        while acquired < count:
+            await asyncio.wait_for(chat_semaphore.acquire(), timeout=max(0, deadline - loop.time()))
+            acquired += 1
+    except asyncio.TimeoutError:
+        release_chat_slots(acquired)
+        raise HTTPException(
+            status_code=429,
+            detail="Too many concurrent chat requests, please retry later",
+            headers={"Retry-After": str(max(1, int(CHAT_QUEUE_TIMEOUT)))},
+        )
+    except BaseException:
+        release_chat_slots(acquired)
+        raise
+
+def release_chat_slots(count=1):
+    for _ in range(count):
+        chat_semaphore.release()
+
+@app.get("/ready")
+async def ready():
+    if not warmed_up.is_set():
+        raise HTTPException(status_code=503, detail="Service is warming up")
+    return {"status": "ready"}
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return answer_cache.stats()
+
+@app.get("/metrics")
+async def metrics():
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 @app.post("/chat", response_model=QueryResponse)
 async def chat(query: QueryInput):
-    result = conversational_rag_chain.invoke(
-        {"input": query.query},
-        config={
-            "configurable": {"session_id": query.session_id}
-        },
-    )
+    await acquire_chat_slots()
+    try:
+        chains = await aget_chains()
+        history = await aget_session_history(query.session_id)
+        result = await chains.conversational_rag_chain.ainvoke(
+            {"input": query.query},
+            config={
+                "configurable": {"session_id": query.session_id, "session_history": history}
+            },
+        )
+    finally:
+        release_chat_slots()
     return QueryResponse(response=result["answer"], session_id=query.session_id)
 
-@app.post("/upload-doc", response_model=DocumentInfo)
-async def upload_doc(file: UploadFile = File(...)):
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+class ChatSlotResponse(StreamingResponse):
+    """Streaming response that frees its chat slots once the response ends.
+
+    The release happens here rather than in the body generator, which never
+    runs when the client disconnects before streaming starts.
+    """
+
+    def __init__(self, content, slots=1, **kwargs):
+        super().__init__(content, **kwargs)
+        self.slots = slots
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            release_chat_slots(self.slots)
+
+@app.post("/chat/stream")
+async def chat_stream(query: QueryInput):
+    await acquire_chat_slots()
+
+    async def event_stream():
+        answer = []
+        try:
+            chains = await aget_chains()
+            history = await aget_session_history(query.session_id)
+            async for chunk in chains.conversational_rag_chain.astream(
+                {"input": query.query},
+                config={
+                    "configurable": {"session_id": query.session_id, "session_history": history}
+                },
+            ):
+                if "context" in chunk:
+                    sources = [doc.metadata for doc in chunk["context"]]
+                    yield sse_event("sources", sources)
+                if "answer" in chunk:
+                    answer.append(chunk["answer"])
+                    yield sse_event("token", chunk["answer"])
+            response = QueryResponse(response="".join(answer), session_id=query.session_id)
+            yield sse_event("done", response.model_dump())
+        except Exception as e:
+            yield sse_event("error", {"detail": str(e)})
+
+    return ChatSlotResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Upper bound on the number of questions in one /chat/batch request.
+BATCH_MAX_QUERIES = int(os.environ.get("BATCH_MAX_QUERIES", "1000"))
+
+@app.post("/chat/batch")
+async def chat_batch(batch: BatchQueryInput):
+    if len(batch.queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_QUERIES} queries per batch")
+
+    # A batch holds one chat slot per LLM call it may have in flight, so it
+    # counts against CHAT_CONCURRENCY_LIMIT like that many /chat requests.
+    slots = max(1, min(len(batch.queries), BATCH_CONCURRENCY, CHAT_CONCURRENCY_LIMIT))
+    await acquire_chat_slots(slots)
+
+    async def result_stream():
+        async for result in abatch_chat(batch.queries, concurrency=slots):
+            yield BatchQueryResult(**result).model_dump_json() + "\n"
+
+    return ChatSlotResponse(result_stream(), slots=slots, media_type="application/x-ndjson")
+
+async def save_upload(file, file_path):
+    """Write the upload to `file_path` and return its SHA-256 hex digest."""
+    # Copy in fixed-size blocks so an upload is never held in memory in full.
+    size = 0
+    digest = hashlib.sha256()
     try:
-        file_path = os.path.join(UPLOAD_DIR, file.filename)
         with open(file_path, "wb") as f:
-            f.write(await file.read())
+            while block := await file.read(UPLOAD_BLOCK_SIZE):
+                size += len(block)
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail=f"File exceeds {MAX_UPLOAD_BYTES} bytes")
+                f.write(block)
+                digest.update(block)
+    except BaseException:
+        # Also on cancellation, so an aborted upload leaves no partial file;
+        # the file may not exist if open() itself failed.
+        with suppress(FileNotFoundError):
+            os.remove(file_path)
+        raise
+    return digest.hexdigest()
+
+async def enqueue_ingestion(doc_id, file, reuse_duplicates=False):
+    try:
+        job_id = str(uuid.uuid4())
+        file_path = os.path.join(UPLOAD_DIR, f"{doc_id}_{os.path.basename(file.filename)}")
+        with track_stage("ingest", "upload", doc_id=doc_id):
+            file_hash = await save_upload(file, file_path)
         
-        doc_id = str(uuid.uuid4())
-        chunks = load_and_split_document(file_path)
-        get_vector_store().add_documents(chunks, ids=[doc_id] * len(chunks))
+        if reuse_duplicates:
+            # An identical file is already indexed: answer with its doc_id instead of indexing a copy.
+            existing = await run_db(get_document_by_hash, file_hash)
+            if existing is not None:
+                os.remove(file_path)
+                chunk_count = len(await run_db(get_chunk_manifest, existing["doc_id"]))
+                await run_db(insert_job, job_id, existing["doc_id"], file.filename, file_path)
+                await run_db(update_job, job_id, "duplicate", chunk_count, None, chunk_count)
+                return JobInfo(
+                    job_id=job_id, doc_id=existing["doc_id"], filename=file.filename, status="duplicate",
+                    chunk_count=chunk_count, deduplicated_chunks=chunk_count,
+                )
         
-        conn = get_db_connection()
-        conn.execute("INSERT INTO documents (doc_id, filename) VALUES (?, ?)", (doc_id, file.filename))
-        conn.commit()
-        conn.close()
+        await run_db(insert_job, job_id, doc_id, file.filename, file_path)
+        enqueue_job({
+            "job_id": job_id, "doc_id": doc_id, "filename": file.filename, "file_path": file_path, "file_hash": file_hash,
+        })
         
-        return DocumentInfo(filename=file.filename, doc_id=doc_id)
+        return JobInfo(job_id=job_id, doc_id=doc_id, filename=file.filename, status="queued")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/upload-doc", response_model=JobInfo, status_code=202)
+async def upload_doc(file: UploadFile = File(...)):
+    return await enqueue_ingestion(str(uuid.uuid4()), file, reuse_duplicates=True)
+
+@app.put("/update-doc/{doc_id}", response_model=JobInfo, status_code=202)
+async def update_doc(doc_id: str, file: UploadFile = File(...)):
+    if await run_db(get_document, doc_id) is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return await enqueue_ingestion(doc_id, file)
+
+@app.get("/jobs/{job_id}", response_model=JobInfo)
+async def job_status(job_id: str):
+    job = await run_db(get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JobInfo(
+        job_id=job["job_id"],
+        doc_id=job["doc_id"],
+        filename=job["filename"],
+        status=job["status"],
+        chunk_count=job["chunk_count"],
+        error=job["error"],
+        deduplicated_chunks=job["deduplicated_chunks"],
+    )
+
 @app.get("/list-docs", response_model=list[DocumentInfo])
-async def list_docs():
-    conn = get_db_connection()
-    cursor = conn.execute("SELECT filename, doc_id FROM documents")
-    docs = [DocumentInfo(filename=row["filename"], doc_id=row["doc_id"]) for row in cursor.fetchall()]
-    conn.close()
-    return docs
+async def list_docs(response: Response, limit: Optional[int] = Query(None, ge=1, le=1000), cursor: Optional[int] = None):
+    # Without `limit` every document is returned; with it, the X-Next-Cursor
+    # header carries the cursor for the next page until the last one.
+    rows = await run_db(list_documents, limit + 1 if limit else None, cursor)
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = str(rows[-1]["id"])
+    return [DocumentInfo(filename=row["filename"], doc_id=row["doc_id"]) for row in rows]
 
 @app.post("/delete-doc")
 async def delete_doc(request: DeleteFileRequest):
     try:
-        conn = get_db_connection()
-        conn.execute("DELETE FROM documents WHERE doc_id = ?", (request.doc_id,))
-        conn.commit()
-        conn.close()
-        
-        get_vector_store().delete(ids=[request.doc_id])
+        await run_db(delete_document, request.doc_id)
+        await asyncio.get_running_loop().run_in_executor(None, delete_document_vectors, request.doc_id)
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
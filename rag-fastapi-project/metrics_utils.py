@@ -0,0 +1,171 @@
+
+from contextlib import contextmanager, nullcontext
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import REGISTRY, Histogram
+from prometheus_client.core import GaugeMetricFamily
+import os
+import time
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+# Spans are emitted through the OpenTelemetry API when it is installed; they are
+# no-ops until an SDK and exporter are configured for the process.
+TRACING_ENABLED = os.environ.get("TRACING_ENABLED", "true").lower() == "true" and trace is not None
+
+tracer = trace.get_tracer("rag-fastapi") if TRACING_ENABLED else None
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_duration_seconds",
+    "Time spent in each stage of the chat and ingestion pipelines",
+    ["pipeline", "stage"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_TOKENS = Histogram(
+    "rag_llm_tokens",
+    "Tokens per LLM call by chat stage and token type",
+    ["stage", "type"],
+    buckets=TOKEN_BUCKETS,
+)
+
+def span_attributes(attributes):
+    return {key: str(value) for key, value in attributes.items() if value is not None}
+
+@contextmanager
+def track_stage(pipeline, stage, **attributes):
+    """Time a block into STAGE_SECONDS and wrap it in a span carrying `attributes`."""
+    span = tracer.start_as_current_span(f"{pipeline}.{stage}", attributes=span_attributes(attributes)) if tracer else nullcontext()
+    started = time.perf_counter()
+    try:
+        with span:
+            yield
+    finally:
+        STAGE_SECONDS.labels(pipeline, stage).observe(time.perf_counter() - started)
+
+def timed_iter(iterable, pipeline, stage):
+    """Yield from `iterable`, recording the total time spent waiting on it as one observation."""
+    iterator = iter(iterable)
+    elapsed = 0.0
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.perf_counter() - started
+            yield item
+    finally:
+        STAGE_SECONDS.labels(pipeline, stage).observe(elapsed)
+
+def record_token_usage(stage, response):
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                LLM_TOKENS.labels(stage, "input").observe(usage.get("input_tokens", 0))
+                LLM_TOKENS.labels(stage, "output").observe(usage.get("output_tokens", 0))
+                return
+    usage = (response.llm_output or {}).get("token_usage")
+    if usage:
+        LLM_TOKENS.labels(stage, "input").observe(usage.get("prompt_tokens", 0))
+        LLM_TOKENS.labels(stage, "output").observe(usage.get("completion_tokens", 0))
+
+class StageMetricsHandler(BaseCallbackHandler):
+    """Times the named runs of a chain as pipeline stages and records LLM token usage.
+
+    The root run is recorded as `root_stage`. Runs whose name is in `stages`
+    get their own observation and span; LLM calls are attributed to the nearest
+    named ancestor.
+    """
+
+    run_inline = True
+
+    def __init__(self, pipeline, stages=(), root_stage="total"):
+        self.pipeline = pipeline
+        self.stages = set(stages)
+        self.root_stage = root_stage
+        # run_id -> (stage or None, start time, span or None, parent_run_id)
+        self.runs = {}
+
+    def _named_ancestor(self, run_id):
+        while run_id in self.runs:
+            stage, _, span, parent_run_id = self.runs[run_id]
+            if stage is not None:
+                return stage, span
+            run_id = parent_run_id
+        return None, None
+
+    def _start(self, run_id, parent_run_id, name, metadata):
+        stage = self.root_stage if parent_run_id is None else name if name in self.stages else None
+        span = None
+        if stage is not None and tracer is not None:
+            _, parent_span = self._named_ancestor(parent_run_id)
+            context = trace.set_span_in_context(parent_span) if parent_span is not None else None
+            attributes = {key: (metadata or {}).get(key) for key in ("session_id", "doc_id")}
+            span = tracer.start_span(f"{self.pipeline}.{stage}", context=context, attributes=span_attributes(attributes))
+        self.runs[run_id] = (stage, time.perf_counter(), span, parent_run_id)
+
+    def _end(self, run_id, error=None):
+        run = self.runs.pop(run_id, None)
+        if run is None or run[0] is None:
+            return
+        stage, started, span, _ = run
+        STAGE_SECONDS.labels(self.pipeline, stage).observe(time.perf_counter() - started)
+        if span is not None:
+            if error is not None:
+                span.record_exception(error)
+            span.end()
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        self._start(run_id, parent_run_id, kwargs.get("name"), metadata)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        self._start(run_id, parent_run_id, kwargs.get("name"), metadata)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        self._start(run_id, parent_run_id, kwargs.get("name"), metadata)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        self._start(run_id, parent_run_id, kwargs.get("name"), metadata)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        stage, _ = self._named_ancestor(run_id)
+        record_token_usage(stage or "other", response)
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+class StatsCollector:
+    """Exposes the dict returned by `stats()` as gauges named `<prefix>_<key>`."""
+
+    def __init__(self, prefix, stats, documentation):
+        self.prefix = prefix
+        self.stats = stats
+        self.documentation = documentation
+
+    def collect(self):
+        for key, value in self.stats().items():
+            yield GaugeMetricFamily(f"{self.prefix}_{key}", f"{self.documentation}: {key}", value=value)
+
+def register_stats(prefix, stats, documentation):
+    REGISTRY.register(StatsCollector(prefix, stats, documentation))
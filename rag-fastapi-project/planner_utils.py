@@ -0,0 +1,46 @@
+
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+REWRITE_PLANNER_ENABLED = os.environ.get("REWRITE_PLANNER_ENABLED", "true").lower() == "true"
+# Follow-ups shorter than this are assumed to lean on the conversation ("why?", "and the price?").
+REWRITE_MIN_WORDS = int(os.environ.get("REWRITE_MIN_WORDS", "4"))
+
+# Words that usually point back at something said earlier in the conversation.
+REFERENCE_PATTERN = re.compile(
+    r"\b(it|its|this|that|these|those|they|them|their|he|him|his|she|her|"
+    r"former|latter|above|previous|earlier|same|one|ones|else)\b",
+    re.IGNORECASE,
+)
+FOLLOW_UP_PATTERN = re.compile(
+    r"^\s*(and|but|also|so|then|or|what about|how about|more|again)\b",
+    re.IGNORECASE,
+)
+
+def plan_rewrite(question, chat_history):
+    """Return (rewrite, reason): whether the question needs the history-aware rewrite."""
+    if not chat_history:
+        return False, "no_history"
+    if not REWRITE_PLANNER_ENABLED:
+        return True, "planner_disabled"
+    if len(question.split()) < REWRITE_MIN_WORDS:
+        return True, "short_question"
+    match = FOLLOW_UP_PATTERN.match(question)
+    if match:
+        return True, f"follow_up:{match.group(1).lower()}"
+    match = REFERENCE_PATTERN.search(question)
+    if match:
+        return True, f"reference:{match.group(1).lower()}"
+    return False, "standalone"
+
+def skip_rewrite(inputs, config):
+    rewrite, reason = plan_rewrite(inputs["input"], inputs.get("chat_history"))
+    session_id = config.get("configurable", {}).get("session_id")
+    logger.debug(
+        "Rewrite planner: session=%s rewrite=%s reason=%s question=%r",
+        session_id, rewrite, reason, inputs["input"],
+    )
+    return not rewrite
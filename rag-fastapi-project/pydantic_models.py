@@ -1,6 +1,6 @@
 
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 
 class QueryInput(BaseModel):
     query: str
@@ -10,9 +10,28 @@ class QueryResponse(BaseModel):
     response: str
     session_id: str
 
+class BatchQueryInput(BaseModel):
+    queries: List[QueryInput]
+
+class BatchQueryResult(BaseModel):
+    index: int
+    session_id: str
+    response: Optional[str] = None
+    error: Optional[str] = None
+
 class DocumentInfo(BaseModel):
     filename: str
     doc_id: str
 
+class JobInfo(BaseModel):
+    job_id: str
+    doc_id: str
+    filename: str
+    status: str
+    chunk_count: Optional[int] = None
+    error: Optional[str] = None
+    # Chunks served by vectors that were already indexed instead of new ones.
+    deduplicated_chunks: Optional[int] = None
+
 class DeleteFileRequest(BaseModel):
     doc_id: str
@@ -0,0 +1,152 @@
+
+from typing import Any
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from lexical_utils import identifier_terms
+from db_utils import run_db
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+RETRIEVER_K = int(os.environ.get("RETRIEVER_K", "4"))
+# "similarity", "mmr" or "similarity_score_threshold".
+RETRIEVER_SEARCH_TYPE = os.environ.get("RETRIEVER_SEARCH_TYPE", "similarity")
+RETRIEVER_FETCH_K = int(os.environ.get("RETRIEVER_FETCH_K", "20"))
+RETRIEVER_SCORE_THRESHOLD = float(os.environ.get("RETRIEVER_SCORE_THRESHOLD", "0.5"))
+SEARCH_TYPES = ("similarity", "mmr", "similarity_score_threshold")
+# Constant of reciprocal rank fusion; larger values flatten the influence of rank.
+RRF_K = int(os.environ.get("RRF_K", "60"))
+
+def reciprocal_rank_fusion(result_lists, k, rrf_k=RRF_K):
+    scores = {}
+    documents = {}
+    for results in result_lists:
+        for rank, document in enumerate(results):
+            key = document.id or document.page_content
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+            documents.setdefault(key, document)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [documents[key] for key in ranked[:k]]
+
+def batch_similarity_search(vector_store, vectors, k):
+    """Run one Chroma query for several precomputed query vectors."""
+    if not vectors:
+        return []
+    results = vector_store._collection.query(
+        query_embeddings=vectors, n_results=k, include=["documents", "metadatas"]
+    )
+    return [
+        [
+            Document(page_content=text, metadata=metadata or {}, id=chunk_id)
+            for text, metadata, chunk_id in zip(texts, metadatas, ids)
+        ]
+        for texts, metadatas, ids in zip(results["documents"], results["metadatas"], results["ids"])
+    ]
+
+def retriever_settings(vector_store):
+    """Retrieval settings for a collection: its metadata overrides the environment defaults."""
+    metadata = vector_store._collection.metadata or {}
+    settings = {
+        "k": int(metadata.get("retriever:k", RETRIEVER_K)),
+        "search_type": metadata.get("retriever:search_type", RETRIEVER_SEARCH_TYPE),
+        "fetch_k": int(metadata.get("retriever:fetch_k", RETRIEVER_FETCH_K)),
+        "score_threshold": float(metadata.get("retriever:score_threshold", RETRIEVER_SCORE_THRESHOLD)),
+    }
+    if settings["search_type"] not in SEARCH_TYPES:
+        raise ValueError(f"Unknown search type {settings['search_type']!r}, expected one of {SEARCH_TYPES}")
+    return settings
+
+class HybridRetriever(BaseRetriever):
+    """Answers exact-term lookups from the BM25 index alone and fuses it with dense search otherwise."""
+
+    vector_store: Any
+    lexical_index: Any
+    k: int = RETRIEVER_K
+    search_type: str = RETRIEVER_SEARCH_TYPE
+    fetch_k: int = RETRIEVER_FETCH_K
+    score_threshold: float = RETRIEVER_SCORE_THRESHOLD
+
+    def lexical_fast_path(self, query):
+        """Return lexical hits if they confidently answer an identifier lookup, else (None, hits)."""
+        hits = [document for document, _ in self.lexical_index.search(query, self.k)]
+        identifiers = [term.lower() for term in identifier_terms(query)]
+        if not identifiers or not hits:
+            return None, hits
+        exact = [
+            document for document in hits
+            if all(term in document.page_content.lower() for term in identifiers)
+        ]
+        # Confident only when the best BM25 hit contains every identifier verbatim.
+        if exact and exact[0] is hits[0]:
+            logger.info("Lexical fast path for %r (%d hits)", query, len(exact))
+            return exact, hits
+        return None, hits
+
+    def dense_search(self, query):
+        if self.search_type == "mmr":
+            return self.vector_store.max_marginal_relevance_search(query, k=self.k, fetch_k=self.fetch_k)
+        if self.search_type == "similarity_score_threshold":
+            results = self.vector_store.similarity_search_with_relevance_scores(
+                query, k=self.k, score_threshold=self.score_threshold
+            )
+            return [document for document, _ in results]
+        return self.vector_store.similarity_search(query, k=self.k)
+
+    async def adense_search(self, query):
+        if self.search_type == "mmr":
+            return await self.vector_store.amax_marginal_relevance_search(query, k=self.k, fetch_k=self.fetch_k)
+        if self.search_type == "similarity_score_threshold":
+            results = await self.vector_store.asimilarity_search_with_relevance_scores(
+                query, k=self.k, score_threshold=self.score_threshold
+            )
+            return [document for document, _ in results]
+        return await self.vector_store.asimilarity_search(query, k=self.k)
+
+    def dense_search_by_vectors(self, vectors):
+        if self.search_type == "similarity":
+            return batch_similarity_search(self.vector_store, vectors, self.k)
+        if self.search_type == "mmr":
+            return [
+                self.vector_store.max_marginal_relevance_search_by_vector(vector, k=self.k, fetch_k=self.fetch_k)
+                for vector in vectors
+            ]
+        relevance = self.vector_store._select_relevance_score_fn()
+        return [
+            [
+                document
+                for document, distance in self.vector_store.similarity_search_by_vector_with_relevance_scores(vector, k=self.k)
+                if relevance(distance) >= self.score_threshold
+            ]
+            for vector in vectors
+        ]
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        fast, hits = self.lexical_fast_path(query)
+        if fast is not None:
+            return fast
+        return reciprocal_rank_fusion([self.dense_search(query), hits], self.k)
+
+    async def _aget_relevant_documents(self, query, *, run_manager):
+        # The BM25 lookup is an SQLite query, so it runs on the database pool.
+        fast, hits = await run_db(self.lexical_fast_path, query)
+        if fast is not None:
+            return fast
+        return reciprocal_rank_fusion([await self.adense_search(query), hits], self.k)
+
+    def batch_retrieve(self, queries, vectors):
+        """Retrieve for many queries at once, given their precomputed embeddings."""
+        results = [None] * len(queries)
+        lexical_hits = [None] * len(queries)
+        dense_indexes = []
+        for i, query in enumerate(queries):
+            fast, hits = self.lexical_fast_path(query)
+            if fast is not None:
+                results[i] = fast
+            else:
+                lexical_hits[i] = hits
+                dense_indexes.append(i)
+        dense = self.dense_search_by_vectors([vectors[i] for i in dense_indexes])
+        for i, documents in zip(dense_indexes, dense):
+            results[i] = reciprocal_rank_fusion([documents, lexical_hits[i]], self.k)
+        return results
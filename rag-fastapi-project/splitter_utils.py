@@ -0,0 +1,213 @@
+
+from langchain_core.documents import Document
+from token_utils import get_token_counter
+import os
+import re
+
+# Chunk size in tokens for the structured splitter.
+CHUNK_SIZE_TOKENS = int(os.environ.get("CHUNK_SIZE_TOKENS", "300"))
+# Tokens repeated from the end of a chunk at the start of the next: a number, or
+# "auto" to overlap only chunks that break inside a paragraph (by CHUNK_SIZE_TOKENS // 8).
+CHUNK_OVERLAP_TOKENS = os.environ.get("CHUNK_OVERLAP_TOKENS", "auto")
+# "estimate" (the ~4 characters per token rule used elsewhere) or a tiktoken encoding name.
+CHUNK_TOKENIZER = os.environ.get("CHUNK_TOKENIZER", "estimate")
+
+SENTENCE_BREAK = re.compile(r"(?<=[.!?;:])\s+")
+LIST_MARKERS = ("- ", "* ", "+ ", "• ", "– ")
+
+def line_kind(line):
+    stripped = line.lstrip()
+    if not stripped:
+        return "blank"
+    if stripped.startswith("#"):
+        return "heading"
+    if stripped.startswith("|") or line.count("\t") >= 2:
+        return "row"
+    if stripped.startswith(LIST_MARKERS):
+        return "item"
+    digits = len(stripped) - len(stripped.lstrip("0123456789"))
+    if 0 < digits <= 3 and stripped[digits:digits + 2] in (". ", ") "):
+        return "item"
+    return "text"
+
+def iter_blocks(text):
+    """Yield (kind, separator before, text) for the headings, paragraphs, list items and table rows of `text`.
+
+    Lines are scanned once; a paragraph or list item runs until a blank line
+    or the next heading, item or row.
+    """
+    kind, lines, separator = None, [], ""
+    for line in text.splitlines():
+        current = line_kind(line)
+        if current == "blank":
+            if lines:
+                yield kind, separator, "\n".join(lines)
+                kind, lines, separator = None, [], "\n\n"
+            elif separator:
+                separator = "\n\n"
+            continue
+        if lines and (current != "text" or kind in ("heading", "row")):
+            yield kind, separator, "\n".join(lines)
+            kind, lines, separator = None, [], "\n"
+        if not lines:
+            kind = "paragraph" if current == "text" else current
+        lines.append(line.rstrip())
+    if lines:
+        yield kind, separator, "\n".join(lines)
+
+def split_sentences(text):
+    """Yield (separator before, sentence) pairs; joining them gives back `text`."""
+    start, separator = 0, ""
+    for match in SENTENCE_BREAK.finditer(text):
+        yield separator, text[start:match.start()]
+        start, separator = match.end(), match.group()
+    yield separator, text[start:]
+
+def split_long(text, max_chars):
+    """Cut text with no usable sentence break at the last whitespace before `max_chars`."""
+    start, separator = 0, ""
+    while len(text) - start > max_chars:
+        end = start + max_chars
+        cut = text.rfind(" ", start + max_chars // 2, end)
+        if cut == -1:
+            yield separator, text[start:end]
+            start, separator = end, ""
+        else:
+            yield separator, text[start:cut]
+            start, separator = cut + 1, " "
+    yield separator, text[start:]
+
+class StructuredTextSplitter:
+    """Token-sized chunks that break at headings, paragraphs, list items and table rows.
+
+    Blocks are packed into chunks of at most `chunk_size` tokens; a heading
+    starts a new chunk once the current one is half full and is never left at
+    the end of one, a table split across chunks repeats its header row, and
+    only blocks larger than a chunk are cut, at sentence boundaries and then
+    at whitespace. Pieces are measured with the configured tokenizer, so none
+    exceeds `chunk_size` tokens, and splitting stays linear in the input.
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE_TOKENS, chunk_overlap=CHUNK_OVERLAP_TOKENS, tokenizer=CHUNK_TOKENIZER):
+        self.chunk_size = chunk_size
+        self.adaptive_overlap = str(chunk_overlap).lower() == "auto"
+        self.chunk_overlap = chunk_size // 8 if self.adaptive_overlap else int(chunk_overlap)
+        self.count_tokens = get_token_counter(tokenizer)
+        # First guess at the longest piece cut from an oversized sentence, from the
+        # four-characters-per-token estimate; pieces are then checked with the real counter.
+        self.max_piece_chars = max(16, (chunk_size - 1) * 4)
+
+    def fit_pieces(self, text, max_chars):
+        """Yield (separator, piece, tokens) pieces of `text` of at most `chunk_size` tokens each."""
+        for separator, piece in split_long(text, max_chars):
+            tokens = self.count_tokens(piece)
+            if tokens <= self.chunk_size or len(piece) <= 1:
+                yield separator, piece, tokens
+                continue
+            # The tokenizer packs fewer characters per token than estimated: cut this piece smaller.
+            smaller = max(1, min(len(piece) - 1, len(piece) * self.chunk_size // tokens))
+            for index, (inner_separator, part, part_tokens) in enumerate(self.fit_pieces(piece, smaller)):
+                yield separator if index == 0 else inner_separator, part, part_tokens
+
+    def iter_pieces(self, text):
+        """Yield (kind, separator, text, tokens, inner) pieces; `inner` marks pieces continuing a split block."""
+        for kind, separator, block in iter_blocks(text):
+            tokens = self.count_tokens(block)
+            if tokens <= self.chunk_size:
+                yield kind, separator, block, tokens, False
+                continue
+            parts = split_sentences(block) if kind != "row" else [("", block)]
+            inner = False
+            for part_separator, part in parts:
+                for index, (long_separator, piece, piece_tokens) in enumerate(self.fit_pieces(part, self.max_piece_chars)):
+                    if not piece:
+                        continue
+                    if not inner:
+                        piece_separator = separator
+                    else:
+                        piece_separator = part_separator if index == 0 else long_separator
+                    yield kind, piece_separator, piece, piece_tokens, inner
+                    inner = True
+
+    def split_sections(self, text):
+        """Return (chunk text, section heading) pairs for `text`."""
+        chunks = []
+        current, used = [], 0
+        section = chunk_section = ""
+        table_header = []
+
+        def emit(with_overlap):
+            # Trailing headings move to the next chunk; otherwise it may start
+            # with the last pieces of this one.
+            nonlocal current, used, chunk_section
+            carried = []
+            while current and current[-1][0] == "heading":
+                carried.insert(0, current.pop())
+            if current:
+                chunks.append((join(current), chunk_section))
+            overlap = []
+            if with_overlap and self.chunk_overlap and not carried:
+                budget = self.chunk_overlap
+                for piece in reversed(current):
+                    if piece[3] > budget or piece[0] == "heading":
+                        break
+                    overlap.insert(0, piece)
+                    budget -= piece[3]
+            current = carried or overlap
+            used = sum(piece[3] for piece in current)
+            chunk_section = section
+
+        for kind, separator, piece_text, tokens, inner in self.iter_pieces(text):
+            if kind == "heading":
+                section = piece_text.lstrip("#").strip()
+                if used >= self.chunk_size // 2 and any(piece[0] != "heading" for piece in current):
+                    emit(False)
+            if kind != "row":
+                table_header = []
+            elif not table_header or separator != "\n":
+                table_header = [(kind, separator, piece_text, tokens)]
+            elif len(table_header) == 1 and set(piece_text) <= set("|-:+ \t"):
+                table_header.append((kind, separator, piece_text, tokens))
+
+            if current and used + tokens > self.chunk_size:
+                emit(inner or not self.adaptive_overlap)
+                # A table continued in a new chunk gets its header rows again.
+                header = [piece for piece in table_header if piece[2] is not piece_text]
+                if kind == "row" and header and not any(piece[0] == "row" for piece in current):
+                    if sum(piece[3] for piece in header) + tokens <= self.chunk_size:
+                        current = header
+                        used = sum(piece[3] for piece in current)
+                while current and used + tokens > self.chunk_size:
+                    if current[0][0] == "heading":
+                        # Carried headings are text of the document, not overlap: if the
+                        # piece does not fit next to them they become a chunk of their own.
+                        chunks.append((join(current), chunk_section))
+                        current, used = [], 0
+                        break
+                    used -= current.pop(0)[3]
+            if not current:
+                chunk_section = section
+            current.append((kind, separator, piece_text, tokens))
+            used += tokens
+        if current:
+            chunks.append((join(current), chunk_section))
+        return chunks
+
+    def split_text(self, text):
+        return [chunk for chunk, _ in self.split_sections(text)]
+
+    def split_documents(self, documents):
+        chunks = []
+        for document in documents:
+            for text, section in self.split_sections(document.page_content):
+                metadata = dict(document.metadata)
+                if section:
+                    metadata["section"] = section
+                chunks.append(Document(page_content=text, metadata=metadata))
+        return chunks
+
+def join(pieces):
+    text = pieces[0][2]
+    for _, separator, piece_text, _ in pieces[1:]:
+        text += separator + piece_text
+    return text
@@ -0,0 +1,27 @@
+
+import os
+import sys
+import tempfile
+import types
+import pytest
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+# The app keeps its databases, uploads and Chroma directory relative to the
+# working directory, so the suite runs in a scratch one.
+os.chdir(tempfile.mkdtemp(prefix="rag-tests-"))
+
+# The OpenAI models are replaced by the deterministic stubs of the load test.
+from benchmark_load import StubChatModel, StubEmbeddings
+stubs = types.ModuleType("langchain_openai")
+stubs.ChatOpenAI = StubChatModel
+stubs.OpenAIEmbeddings = StubEmbeddings
+sys.modules["langchain_openai"] = stubs
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    import main
+    with TestClient(main.app) as client:
+        yield client
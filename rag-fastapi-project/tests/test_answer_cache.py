@@ -0,0 +1,31 @@
+
+from langchain_core.documents import Document
+from cache_utils import SemanticAnswerCache
+
+def cited(doc_id):
+    return [Document(page_content="", metadata={"doc_id": doc_id, "source": f"{doc_id}.txt"})]
+
+def test_entries_are_capped_least_recently_used_first(client):
+    cache = SemanticAnswerCache("answer-cache-lru", max_entries=3, evict_interval=1)
+    cache.add("what is the payment schedule", "monthly", cited("contract"), 0.1)
+    cache.add("who owns the backup policy", "the ops team", cited("policy"), 0.1)
+    cache.add("what does the sensor measure", "pressure", cited("sensor"), 0.1)
+    # Make the first entry the most recently used one.
+    entry_id = cache.store._collection.get(where={"doc:contract": True})["ids"][0]
+    cache.store._collection.update(ids=[entry_id], metadatas=[{"last_used": 4102444800.0}])
+    cache.add("when is the contract renewal", "in march", cited("renewal"), 0.1)
+
+    assert cache.store._collection.count() == 3
+    assert cache.lookup("what is the payment schedule")["answer"] == "monthly"
+    assert cache.lookup("who owns the backup policy") is None
+    assert cache.stats()["evicted"] == 1
+
+def test_any_document_change_drops_answers_without_sources(client):
+    cache = SemanticAnswerCache("answer-cache-unsourced")
+    cache.add("what is the escalation path", "I don't know.", [], 0.1)
+    cache.add("what is the shipment tolerance", "two days", cited("shipping"), 0.1)
+
+    cache.invalidate_document("unrelated")
+
+    assert cache.lookup("what is the escalation path") is None
+    assert cache.lookup("what is the shipment tolerance")["answer"] == "two days"
@@ -0,0 +1,76 @@
+
+from cache_utils import SemanticAnswerCache
+from chroma_utils import vector_store_manager
+from langchain_core.embeddings import Embeddings
+import json
+import langchain_utils
+import main
+
+def test_batch_answers_and_releases_its_slots(client):
+    free = main.chat_semaphore._value
+    queries = [{"query": f"What is the tolerance of sensor {i}?", "session_id": f"batch-{i}"} for i in range(3)]
+    response = client.post("/chat/batch", json={"queries": queries})
+    assert response.status_code == 200
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert [result["index"] for result in results] == [0, 1, 2]
+    assert all(result["response"] for result in results)
+    assert main.chat_semaphore._value == free
+
+def test_batch_is_rejected_when_chat_slots_are_taken(client, monkeypatch):
+    monkeypatch.setattr(main, "CHAT_QUEUE_TIMEOUT", 0.05)
+    free = main.chat_semaphore._value
+    # Leave fewer slots than the batch needs.
+    main.chat_semaphore._value = 1
+    try:
+        queries = [{"query": "Who approves the invoice?", "session_id": f"busy-{i}"} for i in range(2)]
+        response = client.post("/chat/batch", json={"queries": queries})
+        assert response.status_code == 429
+        assert main.chat_semaphore._value == 1
+    finally:
+        main.chat_semaphore._value = free
+
+class TinyEmbeddings(Embeddings):
+    """A three-dimensional model, unlike the documents' stub embeddings."""
+
+    model = "tiny"
+
+    def embed_documents(self, texts):
+        return [[1.0, float(len(text) % 7), 0.5] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+class TinyAnswerCache(SemanticAnswerCache):
+    @property
+    def store(self):
+        from langchain_chroma import Chroma
+        return Chroma(
+            client=vector_store_manager.client,
+            collection_name=self.collection_name,
+            embedding_function=TinyEmbeddings(),
+            collection_metadata={"hnsw:space": "cosine"},
+        )
+
+def batch(client, queries):
+    response = client.post("/chat/batch", json={"queries": queries})
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.text.splitlines()]
+
+def test_batch_embeds_cache_lookups_with_the_cache_model(client, monkeypatch):
+    cache = TinyAnswerCache(collection_name="tiny-answer-cache")
+    cache.add("Which valve is on pump P-3?", "Valve V-12.", [], 0.1)
+    monkeypatch.setattr(langchain_utils, "answer_cache", cache)
+    results = batch(client, [{"query": "Which valve is on pump P-3?", "session_id": "tiny-1"},
+                             {"query": "Who audits the pumps?", "session_id": "tiny-2"}])
+    assert [result["error"] for result in results] == [None, None]
+    assert results[0]["response"] == "Valve V-12."
+
+def test_batch_reports_shared_step_failures_per_query(client, monkeypatch):
+    def fail(vectors):
+        raise RuntimeError("cache unavailable")
+
+    monkeypatch.setattr(langchain_utils.answer_cache, "lookup_by_vectors", fail)
+    results = batch(client, [{"query": f"Where is manual {i} stored?", "session_id": f"broken-{i}"} for i in range(2)])
+    assert results == [
+        {"index": i, "session_id": f"broken-{i}", "response": None, "error": "cache unavailable"} for i in range(2)
+    ]
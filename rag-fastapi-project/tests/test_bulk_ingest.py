@@ -0,0 +1,144 @@
+
+from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
+from chroma_utils import get_vector_store
+from db_utils import get_bulk_ingest_files, get_chunk_manifest, get_document, upsert_bulk_ingest_files
+from langchain_core.documents import Document
+import bulk_ingest
+import os
+import pytest
+
+def paragraph(name):
+    # Over half and under a full chunk of tokens, so every paragraph becomes a chunk of its own.
+    return " ".join(f"{name}{i}" for i in range(80)) + "."
+
+def write_file(path, names, mtime=None):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("\n\n".join(paragraph(name) for name in names.split()))
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return str(path)
+
+def ingest(root, retry_failed=False):
+    args = Namespace(
+        directory=str(root), processes=2, batch_size=4, embed_workers=2,
+        extensions=list(bulk_ingest.EXTENSIONS), retry_failed=retry_failed, report_interval=60.0,
+    )
+    return bulk_ingest.run(args)
+
+@pytest.fixture
+def threads(monkeypatch):
+    # Files are split in threads so the test process is never forked.
+    monkeypatch.setattr(bulk_ingest, "ProcessPoolExecutor", ThreadPoolExecutor)
+
+def chunk_texts(doc_id):
+    manifest = get_chunk_manifest(doc_id)
+    stored = get_vector_store()._collection.get(ids=[row["chunk_id"] for row in manifest])
+    return sorted(text.split()[0] for text in stored["documents"])
+
+def test_plan_sorts_files_into_new_seen_and_skipped(client, tmp_path):
+    root = tmp_path / "plan"
+    done = write_file(root / "done.txt", "alpha", mtime=1000)
+    changed = write_file(root / "changed.txt", "beta", mtime=1000)
+    failed = write_file(root / "failed.txt", "gamma", mtime=1000)
+    running = write_file(root / "running.txt", "delta", mtime=1000)
+    copy = write_file(root / "sub" / "copy.txt", "epsilon", mtime=1000)
+    fresh = write_file(root / "sub" / "fresh.md", "zeta", mtime=1000)
+    write_file(root / "ignored.csv", "eta")
+    upsert_bulk_ingest_files([
+        (done, os.path.getsize(done), 1000.0, "plan-done", "done", 1, None),
+        (changed, 1, 1000.0, "plan-changed", "done", 1, None),
+        (failed, os.path.getsize(failed), 1000.0, "plan-failed", "failed", None, "boom"),
+        (running, os.path.getsize(running), 1000.0, "plan-running", "running", None, None),
+        (copy, 1, 1000.0, "plan-original", "duplicate", 1, None),
+    ])
+
+    new, seen, skipped = bulk_ingest.plan(str(root), bulk_ingest.EXTENSIONS, retry_failed=False)
+    assert skipped == 2
+    assert [(row[0], row[3]) for row in seen] == [(changed, "plan-changed"), (running, "plan-running")]
+    # A changed copy is no longer a copy, so it gets a doc_id of its own.
+    assert [row[0] for row in new] == [copy, fresh]
+    assert "plan-original" not in [row[3] for row in new]
+
+    _, seen, skipped = bulk_ingest.plan(str(root), bulk_ingest.EXTENSIONS, retry_failed=True)
+    assert skipped == 1
+    assert failed in [row[0] for row in seen]
+
+def test_run_indexes_new_files_and_skips_unchanged_ones(client, tmp_path, threads):
+    root = tmp_path / "library"
+    first = write_file(root / "first.txt", "bulkfirsta bulkfirstb bulkfirstc")
+    second = write_file(root / "nested" / "second.txt", "bulksecond")
+    copy = write_file(root / "nested" / "copy.txt", "bulksecond")
+    (root / "broken.pdf").write_bytes(b"not a pdf")
+
+    assert ingest(root) == 1
+    files = get_bulk_ingest_files()
+    assert files[str(root / "broken.pdf")]["status"] == "failed"
+    assert files[first]["status"] == "done"
+    assert files[first]["chunk_count"] == 3
+    doc_id = files[first]["doc_id"]
+    # Like uploads, documents record the file name, not the path it was ingested from.
+    assert get_document(doc_id)["filename"] == "first.txt"
+    assert chunk_texts(doc_id) == ["bulkfirsta0", "bulkfirstb0", "bulkfirstc0"]
+    # Identical files are ingested once, whichever of the two came first.
+    assert {files[second]["status"], files[copy]["status"]} == {"done", "duplicate"}
+    assert files[second]["doc_id"] == files[copy]["doc_id"]
+
+    count = get_vector_store()._collection.count()
+    assert ingest(root) == 0
+    assert get_vector_store()._collection.count() == count
+    assert get_bulk_ingest_files()[first]["updated_at"] == files[first]["updated_at"]
+
+def test_run_reindexes_changed_and_interrupted_files_under_their_doc_id(client, tmp_path, threads):
+    root = tmp_path / "resume"
+    changed = write_file(root / "changed.txt", "resumea resumeb")
+    interrupted = write_file(root / "interrupted.txt", "resumec resumed resumee")
+    assert ingest(root) == 0
+    files = get_bulk_ingest_files()
+
+    write_file(root / "changed.txt", "resumea resumef resumeb")
+    # A crash after some chunks of a file were written leaves it running.
+    row = files[interrupted]
+    upsert_bulk_ingest_files([(row["path"], row["size"], row["mtime"], row["doc_id"], "running", None, None)])
+    count = get_vector_store()._collection.count()
+
+    assert ingest(root) == 0
+    after = get_bulk_ingest_files()
+    assert after[changed]["doc_id"] == files[changed]["doc_id"]
+    assert after[interrupted]["doc_id"] == files[interrupted]["doc_id"]
+    assert (after[changed]["status"], after[interrupted]["status"]) == ("done", "done")
+    assert chunk_texts(files[changed]["doc_id"]) == ["resumea0", "resumeb0", "resumef0"]
+    assert chunk_texts(files[interrupted]["doc_id"]) == ["resumec0", "resumed0", "resumee0"]
+    assert get_document(files[changed]["doc_id"])["filename"] == "changed.txt"
+    # Only the paragraph added to the changed file needed an entry.
+    assert get_vector_store()._collection.count() == count + 1
+
+def test_failed_file_leaves_no_chunks_behind(client, tmp_path, monkeypatch):
+    writer = bulk_ingest.BulkWriter(batch_size=2, embed_workers=1)
+    assign = writer.deduplicator.assign
+    calls = []
+
+    def failing_assign(items, exclude=()):
+        calls.append(items)
+        if len(calls) == 3:
+            raise RuntimeError("signature store unavailable")
+        return assign(items, exclude)
+
+    monkeypatch.setattr(writer.deduplicator, "assign", failing_assign)
+    kept = ("/library/kept.txt", 1, 1.0, "bulk-kept")
+    failed = ("/library/failed.txt", 1, 1.0, "bulk-failed")
+    writer.add_file(kept, [Document(page_content=paragraph(f"bulkkept{i}")) for i in range(2)], "kept-hash")
+    # The failed file's first batch is in flight and its next one queued when the third batch fails.
+    with pytest.raises(RuntimeError):
+        writer.add_file(failed, [Document(page_content=paragraph(f"bulkfailed{i}")) for i in range(5)], "failed-hash")
+    writer.add_file(("/library/later.txt", 1, 1.0, "bulk-later"), [Document(page_content=paragraph("bulklater"))], "later-hash")
+    writer.close()
+
+    assert writer.files == {}
+    assert get_document("bulk-failed") is None
+    assert get_chunk_manifest("bulk-failed") == []
+    assert get_vector_store()._collection.get(where={"doc_id": "bulk-failed"})["ids"] == []
+    # run() records the failure; the writer never marks the file done.
+    assert get_bulk_ingest_files()["/library/failed.txt"]["status"] == "running"
+    assert chunk_texts("bulk-kept") == ["bulkkept00", "bulkkept10"]
+    assert get_document("bulk-later")["filename"] == "later.txt"
@@ -0,0 +1,73 @@
+
+from starlette.requests import ClientDisconnect
+from history_utils import get_session_history
+import asyncio
+import main
+
+def test_chat_answers_and_records_history(client):
+    first = client.post("/chat", json={"query": "What does the warranty clause cover?", "session_id": "chat-history"})
+    assert first.status_code == 200
+    assert first.json()["response"]
+
+    second = client.post("/chat", json={"query": "And the renewal?", "session_id": "chat-history"})
+    assert second.status_code == 200
+    assert second.json()["session_id"] == "chat-history"
+
+    humans = [message.content for message in get_session_history("chat-history").messages if message.type == "human"]
+    assert humans == ["What does the warranty clause cover?", "And the renewal?"]
+
+def test_chat_stream_releases_its_slot(client):
+    free = main.chat_semaphore._value
+    response = client.post("/chat/stream", json={"query": "Which sensor needs calibration?", "session_id": "chat-stream"})
+    assert response.status_code == 200
+    assert "event: done" in response.text
+    assert main.chat_semaphore._value == free
+
+def test_chat_stream_slot_released_when_body_never_runs():
+    started = []
+
+    async def body():
+        started.append(True)
+        yield "never sent"
+
+    async def send(message):
+        raise OSError("client went away")
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def respond():
+        await main.acquire_chat_slots()
+        free = main.chat_semaphore._value
+        response = main.ChatSlotResponse(body(), media_type="text/event-stream")
+        try:
+            await response({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send)
+        except ClientDisconnect:
+            pass
+        return free
+
+    free = asyncio.run(respond())
+    assert not started
+    assert main.chat_semaphore._value == free + 1
+
+def test_chat_loads_history_off_the_event_loop(client, monkeypatch):
+    import history_utils
+    on_loop = []
+
+    def spy(func):
+        def wrapper(*args):
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(func.__name__)
+            except RuntimeError:
+                pass
+            return func(*args)
+        return wrapper
+
+    monkeypatch.setattr(history_utils, "get_last_chat_log_id", spy(history_utils.get_last_chat_log_id))
+    monkeypatch.setattr(history_utils, "get_chat_logs", spy(history_utils.get_chat_logs))
+    history_utils.session_history_store.sessions.clear()
+
+    assert client.post("/chat", json={"query": "Who signs the audit?", "session_id": "chat-loop"}).status_code == 200
+    assert client.post("/chat/stream", json={"query": "Who signs the audit?", "session_id": "chat-loop"}).status_code == 200
+    assert on_loop == []
@@ -0,0 +1,57 @@
+
+from db_utils import get_chat_logs
+from history_utils import ChatLogWriter, get_session_history, session_history_store
+from langchain_core.messages import AIMessage, HumanMessage
+import history_utils
+import time
+
+def idle_writer(monkeypatch, **kwargs):
+    """A writer whose background thread never starts, so rows stay queued until flushed."""
+    writer = ChatLogWriter(**kwargs)
+    monkeypatch.setattr(writer, "start", lambda: None)
+    return writer
+
+def logged(session_id):
+    return [(row["human_message"], row["ai_message"]) for row in get_chat_logs(session_id, 10)]
+
+def test_stop_flushes_pending_rows(monkeypatch):
+    writer = idle_writer(monkeypatch)
+    for i in range(3):
+        writer.put(("log-stop", f"question {i}", f"answer {i}"))
+    assert logged("log-stop") == []
+    writer.stop()
+    assert logged("log-stop") == [(f"question {i}", f"answer {i}") for i in range(3)]
+
+    running = ChatLogWriter(interval=60)
+    running.put(("log-running", "question", "answer"))
+    running.stop()
+    assert logged("log-running") == [("question", "answer")]
+    assert running.stats()["written"] == 1
+
+def test_overflow_is_counted_instead_of_blocking(monkeypatch):
+    writer = idle_writer(monkeypatch, max_queue=2)
+    started = time.perf_counter()
+    for i in range(5):
+        writer.put(("log-overflow", f"question {i}", "answer"))
+    assert time.perf_counter() - started < 1
+    assert {key: writer.stats()[key] for key in ("queued", "enqueued", "dropped")} == {"queued": 2, "enqueued": 2, "dropped": 3}
+    writer.stop()
+    assert len(logged("log-overflow")) == 2
+
+def test_session_read_sees_its_queued_turns(monkeypatch):
+    writer = idle_writer(monkeypatch)
+    monkeypatch.setattr(history_utils, "chat_log_writer", writer)
+
+    def turns(session_id):
+        return [message.content for message in get_session_history(session_id).messages]
+
+    get_session_history("log-read").add_messages([HumanMessage("first?"), AIMessage("one")])
+    # The first turn lands while the second is still queued; the newer row id
+    # makes the next read reload the session from the table.
+    writer.flush()
+    get_session_history("log-read").add_messages([HumanMessage("second?"), AIMessage("two")])
+    assert turns("log-read") == ["first?", "one", "second?", "two"]
+
+    get_session_history("log-read").add_messages([HumanMessage("third?"), AIMessage("three")])
+    session_history_store.sessions.clear()
+    assert turns("log-read") == ["first?", "one", "second?", "two", "third?", "three"]
@@ -0,0 +1,81 @@
+
+from langchain_core.documents import Document
+from context_utils import merge_adjacent, pack_context
+from token_utils import count_tokens
+
+def chunk(doc_id, index, text, chunk_id=None):
+    return Document(
+        page_content=text,
+        metadata={"doc_id": doc_id, "chunk_index": index},
+        id=chunk_id or f"{doc_id}:{index}",
+    )
+
+def sentence(word, count=12):
+    return " ".join(f"{word}{i}" for i in range(count)) + "."
+
+def test_adjacent_chunks_merge_without_repeating_overlap():
+    shared = "The pump seal is replaced every 500 hours of running time."
+    first = chunk(1, 3, "Maintenance of pump P-3 starts with draining. " + shared)
+    second = chunk(1, 4, shared + " Then the bearings are greased.")
+    far = chunk(1, 9, sentence("valve"))
+
+    packed = pack_context([second, far, first])
+    assert len(packed) == 2
+    merged = packed[0]
+    assert merged.page_content == (
+        "Maintenance of pump P-3 starts with draining. " + shared + " Then the bearings are greased."
+    )
+    assert merged.metadata["chunk_index"] == 3
+    assert merged.metadata["chunk_indexes"] == [3, 4]
+    # The merged passage takes the id and rank of its best chunk.
+    assert merged.id == second.id
+    assert packed[1] is far
+
+def test_passages_keep_retrieval_order():
+    documents = [chunk(2, 0, sentence("gamma")), chunk(1, 5, sentence("alpha")), chunk(3, 1, sentence("beta"))]
+    assert pack_context(documents) == documents
+
+def test_gaps_and_other_documents_are_not_merged():
+    documents = [chunk(1, 1, sentence("a")), chunk(1, 3, sentence("b")), chunk(2, 2, sentence("c"))]
+    passages = merge_adjacent(documents)
+    assert sorted(rank for rank, _ in passages) == [0, 1, 2]
+    assert all("chunk_indexes" not in document.metadata for _, document in passages)
+
+def test_different_chunks_at_the_same_position_are_both_kept():
+    # E.g. a kept chunk and a freshly indexed one while a document is being renumbered.
+    old = chunk(1, 2, sentence("old"), chunk_id="1:2:aaaa")
+    new = chunk(1, 2, sentence("new"), chunk_id="1:2:bbbb")
+    following = chunk(1, 3, sentence("next"))
+
+    packed = pack_context([new, old, following])
+    texts = "\n".join(document.page_content for document in packed)
+    assert sentence("old") in texts
+    assert sentence("new") in texts
+    assert sentence("next") in texts
+
+def test_same_chunk_retrieved_twice_is_kept_once():
+    document = chunk(1, 0, sentence("widget"))
+    copy = Document(page_content=document.page_content, metadata=dict(document.metadata), id=document.id)
+    assert pack_context([document, copy]) == [document]
+
+def test_near_duplicates_are_dropped():
+    text = sentence("manual", 40)
+    documents = [chunk(1, 0, text), chunk(2, 7, text + " Revised."), chunk(3, 0, sentence("other"))]
+    packed = pack_context(documents)
+    assert [document.metadata["doc_id"] for document in packed] == [1, 3]
+
+def test_budget_skips_passages_that_do_not_fit():
+    small = chunk(1, 0, "x" * 40)
+    large = chunk(2, 0, " ".join(["y" * 7] * 100))
+    fits = chunk(3, 0, "z" * 40)
+    packed = pack_context([small, large, fits], token_budget=40)
+    assert packed == [small, fits]
+    assert sum(count_tokens(document.page_content) for document in packed) <= 40
+
+def test_first_passage_is_truncated_to_the_budget():
+    first = chunk(1, 0, " ".join(f"word{i}" for i in range(400)))
+    packed = pack_context([first, chunk(2, 0, "short passage")], token_budget=50)
+    assert len(packed) == 1
+    assert first.page_content.startswith(packed[0].page_content)
+    assert count_tokens(packed[0].page_content) <= 50
+    assert packed[0].id == first.id
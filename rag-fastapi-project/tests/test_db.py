@@ -0,0 +1,24 @@
+
+import db_utils
+import pytest
+import sqlite3
+
+def test_failed_statement_leaves_the_pool_usable(tmp_path, monkeypatch):
+    path = str(tmp_path / "rag.db")
+    monkeypatch.setattr(db_utils, "db_pool", db_utils.ConnectionPool(path, size=1))
+    monkeypatch.setattr(db_utils, "schema_ready", False)
+
+    db_utils.insert_job("job-1", "doc-1", "a.pdf", "uploads/a.pdf")
+    with pytest.raises(sqlite3.IntegrityError):
+        db_utils.insert_job("job-1", "doc-1", "a.pdf", "uploads/a.pdf")
+
+    # The only connection is back in the pool, with no write transaction left open.
+    assert db_utils.db_pool._idle.qsize() == 1
+    other = sqlite3.connect(path, timeout=0)
+    other.execute("UPDATE ingestion_jobs SET status = 'running'")
+    other.commit()
+    other.close()
+
+    db_utils.update_job("job-1", "done", 3)
+    assert db_utils.get_job("job-1")["status"] == "done"
+    db_utils.db_pool.close_all()
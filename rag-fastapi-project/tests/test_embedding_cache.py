@@ -0,0 +1,46 @@
+
+from embedding_utils import CachedEmbeddings
+from langchain_core.embeddings import Embeddings
+import sqlite3
+
+class ProbeEmbeddings(Embeddings):
+    """Embeds texts as their length and checks, mid-call, that the cache can still be written."""
+
+    model = "probe"
+
+    def __init__(self, path):
+        self.path = path
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        # A write lock left open by the lookup would make this fail at once.
+        conn = sqlite3.connect(self.path, timeout=0)
+        conn.execute("UPDATE embeddings SET last_used = last_used")
+        conn.commit()
+        conn.close()
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+def test_provider_call_runs_outside_the_cache_transaction(tmp_path):
+    path = str(tmp_path / "embeddings.db")
+    probe = ProbeEmbeddings(path)
+    cache = CachedEmbeddings(probe, path=path)
+    assert cache.embed_documents(["alpha", "beta"]) == [[5.0, 1.0], [4.0, 1.0]]
+    # The second call hits the cache for "alpha" and touches its last_used.
+    assert cache.embed_documents(["alpha", "gamma"]) == [[5.0, 1.0], [5.0, 1.0]]
+    assert cache.embed_query("alpha") == [5.0, 1.0]
+    assert probe.calls == 2
+
+def test_eviction_keeps_the_cache_bounded(tmp_path):
+    path = str(tmp_path / "embeddings.db")
+    cache = CachedEmbeddings(ProbeEmbeddings(path), path=path, max_entries=10, evict_interval=5)
+    for start in range(0, 40, 4):
+        cache.embed_documents([f"text {i}" for i in range(start, start + 4)])
+    conn = sqlite3.connect(path)
+    count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+    conn.close()
+    # The bound is only checked every five inserts, so the last batch of four may sit above it.
+    assert 10 <= count <= 14
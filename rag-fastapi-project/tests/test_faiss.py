@@ -0,0 +1,218 @@
+
+from benchmark_load import StubEmbeddings
+from chroma_utils import VectorStoreManager
+from db_utils import get_chunk_manifest
+from threading import Event
+import chroma_utils
+import numpy as np
+import os
+import time
+import pytest
+
+pytest.importorskip("faiss")
+import faiss_utils
+from faiss_utils import FaissCollection, FaissVectorStore
+
+def random_vectors(count, dim=16, seed=0):
+    return np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+
+def exact_nearest(vectors, query, k):
+    distances = ((vectors - query) ** 2).sum(axis=1)
+    order = np.argsort(distances)[:k]
+    return list(order), distances[order]
+
+def fill(collection, vectors, start=0):
+    ids = [f"chunk-{start + i}" for i in range(len(vectors))]
+    collection.upsert(
+        ids=ids,
+        embeddings=vectors,
+        metadatas=[{"doc_id": f"doc-{(start + i) % 4}", "position": start + i} for i in range(len(vectors))],
+        documents=[f"text {start + i}" for i in range(len(vectors))],
+    )
+    return ids
+
+def index_state(collection):
+    return collection._state()[2:]
+
+def test_upsert_replaces_existing_ids(tmp_path):
+    collection = FaissCollection("docs", root=str(tmp_path))
+    vectors = random_vectors(3)
+    collection.upsert(ids=["a", "b", "c"], embeddings=vectors, metadatas=[{"n": 1}, {"n": 2}, {"n": 3}], documents=["A", "B", "C"])
+    assert collection.count() == 3
+    stored = collection.get(ids=["c", "a"], include=["documents", "metadatas", "embeddings"])
+    assert stored["ids"] == ["a", "c"]
+    assert stored["documents"] == ["A", "C"]
+    assert stored["metadatas"] == [{"n": 1}, {"n": 3}]
+    np.testing.assert_array_equal(stored["embeddings"], vectors[[0, 2]])
+
+    # "a" gets a new vector and text; within a batch the last entry for an id wins.
+    replacement = random_vectors(3, seed=1)
+    collection.upsert(ids=["a", "d", "d"], embeddings=replacement, metadatas=[{"n": 4}, {"n": 5}, {"n": 6}], documents=["A2", "D1", "D2"])
+    assert collection.count() == 4
+    assert collection.get(ids=["a", "d"])["documents"] == ["A2", "D2"]
+    result = collection.query(query_embeddings=[replacement[0]], n_results=4)
+    assert result["ids"][0][0] == "a"
+    assert result["distances"][0][0] == pytest.approx(0, abs=1e-4)
+    assert sorted(result["ids"][0]) == ["a", "b", "c", "d"]
+    # The old vector of "a" is gone from search.
+    result = collection.query(query_embeddings=[vectors[0]], n_results=4)
+    assert result["distances"][0][result["ids"][0].index("a")] > 1e-3
+
+    with pytest.raises(ValueError):
+        collection.upsert(ids=["e"], embeddings=random_vectors(1, dim=8))
+
+def test_delete_by_id_and_by_filter(tmp_path):
+    collection = FaissCollection("docs", root=str(tmp_path))
+    ids = fill(collection, random_vectors(12))
+    collection.delete(ids=ids[:2])
+    assert collection.count() == 10
+    collection.delete(where={"doc_id": "doc-2"})
+    assert collection.count() == 7
+    assert all(metadata["doc_id"] != "doc-2" for metadata in collection.get()["metadatas"])
+    # With both, only the listed chunks that match the filter go.
+    collection.delete(ids=ids[3:8], where={"doc_id": "doc-3"})
+    assert sorted(collection.get()["ids"]) == sorted(ids[i] for i in (4, 5, 8, 9, 11))
+
+    # The answer cache's invalidation filter: `$ne` also matches entries without the key.
+    collection.upsert(
+        ids=["cited", "other", "unsourced"], embeddings=random_vectors(3, seed=2),
+        metadatas=[{"doc:x": True, "sourced": True}, {"doc:y": True, "sourced": True}, {}],
+    )
+    collection.delete(where={"$or": [{"doc:x": True}, {"sourced": {"$ne": True}}]})
+    assert collection.get(ids=["cited", "other", "unsourced"])["ids"] == ["other"]
+
+def test_query_with_metadata_filters(tmp_path, monkeypatch):
+    collection = FaissCollection("docs", root=str(tmp_path))
+    vectors = random_vectors(200)
+    fill(collection, vectors)
+    query = random_vectors(1, seed=3)[0]
+
+    matching = [i for i in range(200) if i % 4 == 1]
+    expected, _ = exact_nearest(vectors[matching], query, 5)
+    result = collection.query(query_embeddings=[query], n_results=5, where={"doc_id": "doc-1"})
+    assert result["ids"][0] == [f"chunk-{matching[i]}" for i in expected]
+
+    where = {"$and": [{"doc_id": {"$in": ["doc-0", "doc-3"]}}, {"position": {"$gte": 100}}]}
+    result = collection.query(query_embeddings=[query], n_results=50, where=where)
+    positions = [metadata["position"] for metadata in result["metadatas"][0]]
+    assert len(positions) == 50
+    assert all(position >= 100 and position % 4 in (0, 3) for position in positions)
+    assert collection.get(where={"position": {"$lt": 3}})["ids"] == ["chunk-0", "chunk-1", "chunk-2"]
+    store = FaissVectorStore(collection, StubEmbeddings())
+    assert [document.id for document in store.similarity_search_by_vector(list(query), k=3, filter={"position": 7})] == ["chunk-7"]
+
+    # Broad filters keep the approximate candidates that match.
+    monkeypatch.setattr(faiss_utils, "FAISS_FILTER_SCAN_ROWS", 0)
+    result = collection.query(query_embeddings=[query], n_results=5, where={"doc_id": {"$ne": "doc-1"}})
+    assert result["ids"][0]
+    assert all(metadata["doc_id"] != "doc-1" for metadata in result["metadatas"][0])
+
+def test_compact_trains_an_index_and_rescores_exact_vectors(tmp_path, monkeypatch):
+    monkeypatch.setattr(faiss_utils, "FAISS_INDEX", "IVF8,PQ4x4")
+    collection = FaissCollection("docs", root=str(tmp_path))
+    collection.auto_compact = False
+    vectors = random_vectors(1000)
+    fill(collection, vectors)
+    assert index_state(collection) == (None, 0)
+
+    collection.compact()
+    assert index_state(collection) == ("index-1000.faiss", 1000)
+    assert os.path.exists(os.path.join(collection.path, "index-1000.faiss"))
+    for row in (0, 123, 999):
+        result = collection.query(query_embeddings=[vectors[row]], n_results=3)
+        # PQ codes only shortlist candidates; distances come from the memory-mapped float32 vectors.
+        assert result["ids"][0][0] == f"chunk-{row}"
+        assert result["distances"][0][0] == pytest.approx(0, abs=1e-4)
+        expected = ((vectors[[int(chunk_id.split("-")[1]) for chunk_id in result["ids"][0]]] - vectors[row]) ** 2).sum(axis=1)
+        np.testing.assert_allclose(result["distances"][0], expected, rtol=1e-4, atol=1e-4)
+
+    # Rows added since are scanned exactly until the next compaction folds them in.
+    extra = random_vectors(10, seed=4)
+    fill(collection, extra, start=1000)
+    assert collection.query(query_embeddings=[extra[5]], n_results=1)["ids"][0] == ["chunk-1005"]
+    collection.compact()
+    assert index_state(collection) == ("index-1010.faiss", 1010)
+    assert not os.path.exists(os.path.join(collection.path, "index-1000.faiss"))
+    assert collection.query(query_embeddings=[extra[5]], n_results=1)["ids"][0] == ["chunk-1005"]
+
+def test_training_waits_for_enough_vectors(tmp_path, monkeypatch):
+    monkeypatch.setattr(faiss_utils, "FAISS_INDEX", "IVF64,Flat")
+    monkeypatch.setattr(faiss_utils, "FAISS_DELTA_ROWS", 20)
+    collection = FaissCollection("docs", root=str(tmp_path))
+    collection.auto_compact = False
+    vectors = random_vectors(30)
+    fill(collection, vectors)
+    collection.compact()
+    # Too few vectors for 64 clusters: no index, and no retry until FAISS_DELTA_ROWS more arrive.
+    assert index_state(collection) == (None, 0)
+    assert not collection.needs_compaction()
+    assert collection.query(query_embeddings=[vectors[7]], n_results=1)["ids"][0] == ["chunk-7"]
+
+def test_upsert_leaves_compaction_to_a_background_thread(tmp_path, monkeypatch):
+    monkeypatch.setattr(faiss_utils, "FAISS_INDEX", "IVF4,Flat")
+    monkeypatch.setattr(faiss_utils, "FAISS_DELTA_ROWS", 100)
+    collection = FaissCollection("docs", root=str(tmp_path))
+    started, release = Event(), Event()
+    compact = collection.compact
+
+    def slow_compact():
+        started.set()
+        release.wait(10)
+        compact()
+
+    monkeypatch.setattr(collection, "compact", slow_compact)
+    fill(collection, random_vectors(60))
+    assert not started.is_set()
+    fill(collection, random_vectors(60, seed=1), start=60)
+    assert started.wait(10)
+    # The writer is not held up, and a running compaction is not started twice.
+    fill(collection, random_vectors(60, seed=2), start=120)
+    thread = collection._compactor
+    assert collection.compact_in_background() is thread
+    assert index_state(collection) == (None, 0)
+    release.set()
+    thread.join(10)
+    assert index_state(collection) == ("index-180.faiss", 180)
+
+def test_from_texts_creates_a_searchable_collection(tmp_path):
+    store = FaissVectorStore.from_texts(
+        ["pump seal replacement", "invoice payment terms"], StubEmbeddings(),
+        metadatas=[{"topic": "maintenance"}, {"topic": "billing"}], ids=["seal", "invoice"],
+        collection_name="notes", collection_metadata={"hnsw:space": "cosine"}, persist_directory=str(tmp_path),
+    )
+    assert store._collection.space == "cosine"
+    assert [document.id for document in store.similarity_search("payment terms", k=1)] == ["invoice"]
+    assert [document.id for document in store.similarity_search("payment terms", k=2, filter={"topic": "maintenance"})] == ["seal"]
+    store.delete(filter={"topic": "billing"})
+    assert store._collection.count() == 1
+
+def test_app_indexes_and_retrieves_through_faiss(client, tmp_path, monkeypatch):
+    from langchain_utils import get_retriever
+    manager = VectorStoreManager(str(tmp_path / "chroma_db"))
+    monkeypatch.setattr(chroma_utils, "vector_store_manager", manager)
+    monkeypatch.setattr(chroma_utils, "VECTOR_BACKEND", "faiss")
+
+    text = "The faissbackend gearbox needs oil every 300 hours.\n\nThe faissbackend conveyor belt is checked weekly."
+    response = client.post("/upload-doc", files={"file": ("gearbox.txt", text.encode(), "text/plain")})
+    assert response.status_code == 202
+    deadline = time.monotonic() + 30
+    while (job := client.get(f"/jobs/{response.json()['job_id']}").json())["status"] in ("queued", "running"):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    assert job["status"] == "completed"
+
+    store = chroma_utils.get_vector_store()
+    assert isinstance(store, FaissVectorStore)
+    assert faiss_utils.collection_exists(chroma_utils.DEFAULT_COLLECTION)
+    manifest = get_chunk_manifest(job["doc_id"])
+    assert store._collection.count() == len(manifest) > 0
+    documents = get_retriever().invoke("faissbackend gearbox oil")
+    assert documents[0].metadata["doc_id"] == job["doc_id"]
+    # The answer cache keeps its Chroma collection, and a store stays on the backend it was opened with.
+    from cache_utils import answer_cache
+    assert not isinstance(answer_cache.store, FaissVectorStore)
+    with pytest.raises(ValueError):
+        chroma_utils.get_vector_store(vector_backend="chroma")
+
+    assert client.post("/delete-doc", json={"doc_id": job["doc_id"]}).json() == {"status": "success"}
+    assert store._collection.count() == 0
@@ -0,0 +1,88 @@
+
+from chroma_utils import get_vector_store
+from db_utils import get_chunk_manifest
+from ingestion_utils import index_document, remove_chunks
+from langchain_core.documents import Document
+from lexical_utils import lexical_index
+import time
+
+CLAUSE = " ".join(f"term{i}" for i in range(200))
+
+def test_near_duplicate_keeps_its_own_text_and_source(client):
+    assert index_document("dedup-original", [Document(page_content=CLAUSE + " renewal", metadata={"source": "a.pdf"})])[0] == 1
+
+    # Same clause but a different last word: no embedding call, but its own entry.
+    added, _, _, deduplicated = index_document(
+        "dedup-variant", [Document(page_content=CLAUSE + " termination", metadata={"source": "b.pdf"})]
+    )
+    assert (added, deduplicated) == (0, 1)
+    (row,) = get_chunk_manifest("dedup-variant")
+    assert row["canonical_chunk_id"] is None
+    variant_id = row["chunk_id"]
+    collection = get_vector_store()._collection
+    stored = collection.get(ids=[variant_id], include=["documents", "metadatas"])
+    assert stored["documents"] == [CLAUSE + " termination"]
+    assert stored["metadatas"][0]["source"] == "b.pdf"
+    assert [document.metadata["doc_id"] for document, _ in lexical_index.search("termination")] == ["dedup-variant"]
+
+    # An identical chunk simply references the existing entry.
+    count = collection.count()
+    assert index_document("dedup-copy", [Document(page_content=CLAUSE + " renewal", metadata={"source": "c.pdf"})])[3] == 1
+    (row,) = get_chunk_manifest("dedup-copy")
+    assert row["canonical_chunk_id"] is not None
+    assert collection.count() == count
+
+    # Removing the original leaves the variant's entry alone.
+    remove_chunks(get_chunk_manifest("dedup-original"))
+    assert collection.get(ids=[variant_id])["documents"] == [CLAUSE + " termination"]
+
+def paragraph(name):
+    # About 1000 characters, so every paragraph becomes a chunk of its own.
+    return " ".join(f"{name}{i}" for i in range(120)) + "."
+
+def upload(client, path, text, doc_id=None):
+    with open(path, "w") as f:
+        f.write("\n\n".join(paragraph(name) for name in text.split()))
+    with open(path, "rb") as f:
+        files = {"file": ("manual.txt", f, "text/plain")}
+        response = client.put(f"/update-doc/{doc_id}", files=files) if doc_id else client.post("/upload-doc", files=files)
+    assert response.status_code == 202
+    deadline = time.monotonic() + 30
+    while (job := client.get(f"/jobs/{response.json()['job_id']}").json())["status"] in ("queued", "running"):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    assert job["status"] == "completed"
+    return job
+
+def positions(doc_id):
+    """Chunk index of each paragraph, by its name, in the manifest, the vector store and the lexical index."""
+    manifest = {row["chunk_id"]: row["chunk_index"] for row in get_chunk_manifest(doc_id)}
+    stored = get_vector_store()._collection.get(ids=list(manifest), include=["documents", "metadatas"])
+    names = {cid: text.split()[0].rstrip("0") for cid, text in zip(stored["ids"], stored["documents"])}
+    lexical = {}
+    for name in names.values():
+        for document, _ in lexical_index.search(f"{name}7"):
+            if document.metadata["doc_id"] == doc_id:
+                lexical[name] = document.metadata["chunk_index"]
+    vectors = {names[cid]: metadata["chunk_index"] for cid, metadata in zip(stored["ids"], stored["metadatas"])}
+    assert vectors == lexical
+    assert vectors == {names[cid]: index for cid, index in manifest.items()}
+    return vectors
+
+def test_update_doc_renumbers_kept_chunks(client, tmp_path):
+    path = str(tmp_path / "manual.txt")
+    doc_id = upload(client, path, "alpha beta")["doc_id"]
+    assert positions(doc_id) == {"alpha": 0, "beta": 1}
+
+    # Insert at the front: the kept chunks move down.
+    job = upload(client, path, "intro alpha beta", doc_id)
+    assert (job["chunk_count"], job["deduplicated_chunks"]) == (3, 0)
+    assert positions(doc_id) == {"intro": 0, "alpha": 1, "beta": 2}
+
+    # Removal: the chunks after the removed one move up.
+    upload(client, path, "intro beta", doc_id)
+    assert positions(doc_id) == {"intro": 0, "beta": 1}
+
+    # A pure reorder embeds nothing but swaps the positions.
+    upload(client, path, "beta intro", doc_id)
+    assert positions(doc_id) == {"beta": 0, "intro": 1}
@@ -0,0 +1,87 @@
+
+from db_utils import claim_job, get_job, insert_job
+import ingestion_utils
+import asyncio
+import time
+import uuid
+
+def write_upload(tmp_path, text="The calibration interval of sensor S-7 is ninety days."):
+    path = tmp_path / f"{uuid.uuid4().hex}.txt"
+    path.write_text(text)
+    return str(path)
+
+def new_job(tmp_path, **kwargs):
+    job = {"job_id": uuid.uuid4().hex, "doc_id": uuid.uuid4().hex, "filename": "notes.txt"}
+    job["file_path"] = kwargs.get("file_path") or write_upload(tmp_path)
+    insert_job(job["job_id"], job["doc_id"], job["filename"], job["file_path"])
+    return job
+
+def test_upload_job_runs_to_completion(client, tmp_path):
+    with open(write_upload(tmp_path), "rb") as f:
+        queued = client.post("/upload-doc", files={"file": ("sensors.txt", f, "text/plain")})
+    assert queued.status_code == 202
+    assert queued.json()["status"] == "queued"
+
+    deadline = time.monotonic() + 30
+    while (job := client.get(f"/jobs/{queued.json()['job_id']}").json())["status"] in ("queued", "running"):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    assert job["status"] == "completed"
+    assert job["chunk_count"] == 1
+    assert client.get("/jobs/missing").status_code == 404
+
+def test_job_is_running_under_its_worker_while_indexed(client, tmp_path, monkeypatch):
+    job = new_job(tmp_path)
+    seen = []
+    index_document = ingestion_utils.index_document
+
+    def spy(doc_id, chunks):
+        row = get_job(job["job_id"])
+        seen.append((row["status"], row["owner"]))
+        return index_document(doc_id, chunks)
+
+    monkeypatch.setattr(ingestion_utils, "index_document", spy)
+    asyncio.run(ingestion_utils.run_job(job))
+    assert seen == [("running", ingestion_utils.WORKER_ID)]
+    assert get_job(job["job_id"])["status"] == "completed"
+
+def test_failed_job_records_its_error(client, tmp_path):
+    job = new_job(tmp_path, file_path=str(tmp_path / "gone.txt"))
+    asyncio.run(ingestion_utils.run_job(job))
+    row = get_job(job["job_id"])
+    assert row["status"] == "failed"
+    assert "gone.txt" in row["error"]
+
+def test_job_is_claimed_once(client, tmp_path):
+    job = new_job(tmp_path)
+    now = time.time()
+    assert claim_job(job["job_id"], "worker-a", now + 60, now)
+    assert not claim_job(job["job_id"], "worker-b", now + 60, now)
+    # Another worker running the job right now keeps it.
+    asyncio.run(ingestion_utils.run_job(job))
+    assert get_job(job["job_id"])["owner"] == "worker-a"
+    assert get_job(job["job_id"])["status"] == "running"
+
+def test_job_of_a_dead_worker_is_recovered(client, tmp_path):
+    job = new_job(tmp_path)
+    now = time.time()
+    assert claim_job(job["job_id"], "dead-worker", now - 1, now)
+
+    async def recover():
+        ingestion_utils.queued_job_ids.clear()
+        queue, ingestion_utils.job_queue = ingestion_utils.job_queue, asyncio.Queue()
+        try:
+            recovery = asyncio.create_task(ingestion_utils.recover_jobs())
+            while True:
+                recovered = await ingestion_utils.job_queue.get()
+                if recovered["job_id"] == job["job_id"]:
+                    break
+            recovery.cancel()
+            await ingestion_utils.run_job(recovered)
+        finally:
+            ingestion_utils.job_queue = queue
+            ingestion_utils.queued_job_ids.clear()
+
+    asyncio.run(recover())
+    row = get_job(job["job_id"])
+    assert (row["status"], row["owner"]) == ("completed", ingestion_utils.WORKER_ID)
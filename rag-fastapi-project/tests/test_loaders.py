@@ -0,0 +1,130 @@
+
+from chroma_utils import iter_docx_paragraphs, iter_split_document, iter_text_paragraphs, iter_windows
+import asyncio
+import chroma_utils
+import logging
+import sys
+import zipfile
+import docx2txt
+import pytest
+import main
+
+W = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+
+def test_docx_text_matches_docx2txt(tmp_path):
+    path = str(tmp_path / "contract.docx")
+    body = (
+        "<w:p><w:r><w:t>Payment schedule</w:t></w:r></w:p>"
+        "<w:p><w:r><w:t>Invoices are due</w:t><w:tab/><w:t xml:space=\"preserve\"> monthly.</w:t></w:r></w:p>"
+        "<w:p><w:r><w:t>Late payment</w:t><w:br/><w:t>incurs a fee.</w:t></w:r></w:p>"
+        "<w:p/>"
+        "<w:tbl><w:tr><w:tc><w:p><w:r><w:t>Clause</w:t></w:r></w:p></w:tc>"
+        "<w:tc><w:p><w:r><w:t>4.2</w:t></w:r></w:p></w:tc></w:tr></w:tbl>"
+        "<w:p><w:r><w:t>   </w:t></w:r></w:p>"
+    )
+    with zipfile.ZipFile(path, "w") as docx:
+        docx.writestr("word/document.xml", f"<w:document {W}><w:body>{body}</w:body></w:document>")
+        docx.writestr("word/header1.xml", f"<w:hdr {W}><w:p><w:r><w:t>Supplier agreement</w:t></w:r></w:p></w:hdr>")
+        docx.writestr("word/footer1.xml", f"<w:ftr {W}><w:p><w:r><w:t>Page</w:t></w:r></w:p><w:p/></w:ftr>")
+
+    assert "".join(iter_docx_paragraphs(path)) == docx2txt.process(path)
+
+def test_text_is_split_in_windows(tmp_path):
+    path = str(tmp_path / "notes.txt")
+    paragraphs = [f"Paragraph {i} about the shipment tolerance and calibration." for i in range(200)]
+    with open(path, "w") as f:
+        f.write("\n\n".join(paragraphs) + "\n")
+
+    windows = list(iter_windows(iter_text_paragraphs(path), window_chars=1000))
+    assert len(windows) > 5
+    assert all(len(window) < 1100 for window in windows)
+    with open(path) as f:
+        assert "".join(windows) == f.read()
+    chunks = list(iter_split_document(path))
+    assert all(chunk.metadata["source"] == path for chunk in chunks)
+    assert "Paragraph 199" in chunks[-1].page_content
+
+def test_failed_upload_keeps_its_original_error(tmp_path, monkeypatch):
+    def refuse(path, mode):
+        raise PermissionError(path)
+
+    # open() fails, so there is no partial file to remove.
+    monkeypatch.setattr(main, "open", refuse, raising=False)
+    with pytest.raises(PermissionError):
+        asyncio.run(main.save_upload(None, str(tmp_path / "upload.txt")))
+
+def write_pdf(path, pages):
+    """A minimal PDF with one line of Helvetica text per page."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    data = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(data))
+        data += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(data)
+    data += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    data += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    data += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+PAGES = ["Pump P-3 inspection checklist", "Replace the seal every 500 hours", "Bearings are greased monthly"]
+
+def page_texts(documents):
+    return [(document.metadata["page"], " ".join(document.page_content.split())) for document in documents]
+
+def test_pymupdf_extracts_pages_like_pypdf(tmp_path):
+    pytest.importorskip("fitz")
+    path = write_pdf(str(tmp_path / "manual.pdf"), PAGES)
+    assert chroma_utils.resolve_pdf_engine("auto") == "pymupdf"
+    assert chroma_utils.pdf_page_count(path, "pymupdf") == chroma_utils.pdf_page_count(path, "pypdf") == 3
+
+    pages = chroma_utils.load_pdf_pages(path, 1, 3, "pymupdf")
+    assert page_texts(pages) == [(1, PAGES[1]), (2, PAGES[2])]
+    assert all(page.metadata["source"] == path for page in pages)
+    assert page_texts(pages) == page_texts(chroma_utils.load_pdf_pages(path, 1, 3, "pypdf"))
+
+def test_pdf_chunks_keep_their_page(tmp_path, monkeypatch):
+    pytest.importorskip("fitz")
+    path = write_pdf(str(tmp_path / "manual.pdf"), PAGES)
+    monkeypatch.setattr(chroma_utils, "PDF_PAGES_PER_TASK", 2)
+    chunks = list(iter_split_document(path))
+    assert page_texts(chunks) == list(enumerate(PAGES))
+    assert all(chunk.metadata["source"] == path for chunk in chunks)
+
+def test_pypdf_is_used_when_pymupdf_is_missing(tmp_path, monkeypatch):
+    path = write_pdf(str(tmp_path / "manual.pdf"), PAGES)
+    # A None entry makes the import raise ImportError.
+    monkeypatch.setitem(sys.modules, "pymupdf", None)
+    monkeypatch.setitem(sys.modules, "fitz", None)
+    assert chroma_utils.resolve_pdf_engine("auto") == "pypdf"
+    chunks = list(iter_split_document(path))
+    assert page_texts(chunks) == list(enumerate(PAGES))
+    with pytest.raises(ValueError):
+        chroma_utils.resolve_pdf_engine("pdfminer")
+
+def test_pypdf_takes_over_when_pymupdf_fails_on_a_file(tmp_path, monkeypatch, caplog):
+    pytest.importorskip("fitz")
+    path = write_pdf(str(tmp_path / "manual.pdf"), PAGES)
+
+    def broken_open(*args, **kwargs):
+        raise RuntimeError("cannot open broken document")
+
+    monkeypatch.setattr(chroma_utils.import_pymupdf(), "open", broken_open)
+    with caplog.at_level(logging.WARNING, logger="chroma_utils"):
+        assert chroma_utils.pdf_page_count(path, "pymupdf") == 3
+        pages = chroma_utils.load_pdf_pages(path, 0, 3, "pymupdf")
+    assert page_texts(pages) == list(enumerate(PAGES))
+    assert "PyMuPDF could not open" in caplog.text
+    assert "PyMuPDF failed on pages 0-2" in caplog.text
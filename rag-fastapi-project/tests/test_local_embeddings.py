@@ -0,0 +1,41 @@
+
+from embedding_utils import LOCAL_EMBEDDING_RUNTIME, LocalEmbeddings, create_embeddings
+import sys
+import types
+import pytest
+
+def fake_sentence_transformers(monkeypatch, version):
+    loaded = []
+
+    class SentenceTransformer:
+        def __init__(self, model_name, device=None, **kwargs):
+            loaded.append((model_name, kwargs))
+
+    module = types.ModuleType("sentence_transformers")
+    module.__version__ = version
+    module.SentenceTransformer = SentenceTransformer
+    monkeypatch.setitem(sys.modules, "sentence_transformers", module)
+    return loaded
+
+@pytest.mark.parametrize("runtime, version, kwargs", [
+    ("torch", "3.0.1", {}),
+    ("onnx", "3.2.0", {"backend": "onnx"}),
+    ("onnx", "3.4.1", {"backend": "onnx"}),
+])
+def test_configured_runtime_is_used(monkeypatch, runtime, version, kwargs):
+    loaded = fake_sentence_transformers(monkeypatch, version)
+    LocalEmbeddings("mini", runtime=runtime).load()
+    assert loaded == [("mini", kwargs)]
+
+def test_onnx_runtime_needs_a_recent_sentence_transformers(monkeypatch):
+    fake_sentence_transformers(monkeypatch, "3.0.1")
+    with pytest.raises(RuntimeError, match="needs sentence-transformers 3.2 or newer, found 3.0.1"):
+        LocalEmbeddings("mini", runtime="onnx").load()
+
+def test_unknown_runtime_is_rejected(monkeypatch):
+    fake_sentence_transformers(monkeypatch, "3.4.1")
+    with pytest.raises(ValueError):
+        LocalEmbeddings("mini", runtime="tensorrt").load()
+
+def test_local_backend_uses_the_configured_runtime():
+    assert create_embeddings("local").runtime == LOCAL_EMBEDDING_RUNTIME
@@ -0,0 +1,28 @@
+
+from prometheus_client import REGISTRY
+import uuid
+
+CHAT_STAGES = ("history_load", "retrieval", "context_packing", "generation")
+
+def stage_count(stage):
+    return REGISTRY.get_sample_value("rag_stage_duration_seconds_count", {"pipeline": "chat", "stage": stage}) or 0
+
+def token_count(kind):
+    return REGISTRY.get_sample_value("rag_llm_tokens_count", {"stage": "generation", "type": kind}) or 0
+
+def test_chat_records_stage_histograms(client):
+    before = {stage: stage_count(stage) for stage in CHAT_STAGES}
+    tokens_before = {kind: token_count(kind) for kind in ("input", "output")}
+    # A question nobody asked before, so the answer cache cannot skip retrieval and generation.
+    question = f"What does clause {uuid.uuid4().hex[:8]} of the service agreement cover?"
+    assert client.post("/chat", json={"query": question, "session_id": "metrics"}).status_code == 200
+    assert {stage: stage_count(stage) - before[stage] for stage in CHAT_STAGES} == {stage: 1 for stage in CHAT_STAGES}
+    assert {kind: token_count(kind) - tokens_before[kind] for kind in ("input", "output")} == {"input": 1, "output": 1}
+
+    exposed = client.get("/metrics")
+    assert exposed.status_code == 200
+    for stage in CHAT_STAGES:
+        assert f'rag_stage_duration_seconds_count{{pipeline="chat",stage="{stage}"}}' in exposed.text
+    assert 'rag_llm_tokens_count{stage="generation",type="output"}' in exposed.text
+    assert "rag_answer_cache_misses" in exposed.text
+    assert "rag_chat_log_writer_enqueued" in exposed.text
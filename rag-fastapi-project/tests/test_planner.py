@@ -0,0 +1,30 @@
+
+from langchain_core.messages import AIMessage, HumanMessage
+from planner_utils import plan_rewrite, skip_rewrite
+import logging
+import pytest
+
+HISTORY = [HumanMessage("Which sensor needs calibration?"), AIMessage("Sensor S-7 needs calibration every 90 days.")]
+
+@pytest.mark.parametrize("question, history, rewrite, reason", [
+    ("What does it cost?", [], False, "no_history"),
+    ("Which firmware build fixes the overheating bug?", HISTORY, False, "standalone"),
+    ("How is the pressure valve on pump P-3 replaced?", HISTORY, False, "standalone"),
+    ("Why?", HISTORY, True, "short_question"),
+    ("and the price?", HISTORY, True, "short_question"),
+    ("What does it cost to replace?", HISTORY, True, "reference:it"),
+    ("How often should those be checked again?", HISTORY, True, "reference:those"),
+    ("And what about the pressure valve on pump P-3?", HISTORY, True, "follow_up:and"),
+    ("What about the warranty terms for pumps?", HISTORY, True, "follow_up:what about"),
+])
+def test_plan_rewrite(question, history, rewrite, reason):
+    assert plan_rewrite(question, history) == (rewrite, reason)
+
+def test_skip_rewrite_logs_decisions_at_debug(caplog):
+    with caplog.at_level(logging.INFO, logger="planner_utils"):
+        assert skip_rewrite({"input": "Which firmware build fixes the overheating bug?", "chat_history": HISTORY}, {})
+        assert not skip_rewrite({"input": "Why?", "chat_history": HISTORY}, {"configurable": {"session_id": "s"}})
+    assert caplog.records == []
+    with caplog.at_level(logging.DEBUG, logger="planner_utils"):
+        skip_rewrite({"input": "Why?", "chat_history": HISTORY}, {})
+    assert "reason=short_question" in caplog.text
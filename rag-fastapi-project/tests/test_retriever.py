@@ -0,0 +1,20 @@
+
+from lexical_utils import lexical_index
+import asyncio
+
+def test_lexical_search_runs_off_the_event_loop(client, monkeypatch):
+    threads = []
+    search = lexical_index.search
+
+    def spy(query, k):
+        try:
+            asyncio.get_running_loop()
+            threads.append("loop")
+        except RuntimeError:
+            threads.append("worker")
+        return search(query, k)
+
+    monkeypatch.setattr(lexical_index, "search", spy)
+    response = client.post("/chat", json={"query": "Where is firmware build FW-1138 described?", "session_id": "retriever"})
+    assert response.status_code == 200
+    assert threads == ["worker"]
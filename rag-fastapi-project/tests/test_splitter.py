@@ -0,0 +1,59 @@
+
+from splitter_utils import StructuredTextSplitter, split_long
+import splitter_utils
+
+def paragraph(name, words=30):
+    return " ".join(f"{name}{i}" for i in range(words)) + "."
+
+def test_chunks_follow_headings_and_paragraphs():
+    text = "\n\n".join([
+        "# Intro", paragraph("a"), paragraph("b"),
+        "# Usage", paragraph("c", 20), "- item one\n- item two",
+    ])
+    sections = StructuredTextSplitter(chunk_size=50).split_sections(text)
+    assert [section for _, section in sections] == ["Intro", "Intro", "Usage"]
+    chunks = [chunk for chunk, _ in sections]
+    assert chunks[0] == "# Intro\n\n" + paragraph("a")
+    assert chunks[1] == paragraph("b")
+    # A heading starts a new chunk and stays with the text under it.
+    assert chunks[2] == "# Usage\n\n" + paragraph("c", 20) + "\n\n- item one\n- item two"
+
+def test_overlap_repeats_sentences_only_inside_split_paragraphs():
+    paragraphs = [paragraph(name) for name in "abc"]
+    assert StructuredTextSplitter(chunk_size=50, chunk_overlap="auto").split_text("\n\n".join(paragraphs)) == paragraphs
+
+    text = " ".join(f"Sentence {i} is here." for i in range(60))
+    chunks = StructuredTextSplitter(chunk_size=50, chunk_overlap="auto").split_text(text)
+    assert len(chunks) > 3
+    for left, right in zip(chunks, chunks[1:]):
+        # Each continuation starts with the last sentence of the chunk before it.
+        assert left.endswith(right.split(". ")[0] + ".")
+
+    assert " ".join(StructuredTextSplitter(chunk_size=50, chunk_overlap=0).split_text(text)) == text
+
+def test_chunks_never_exceed_the_size_counted_by_the_tokenizer(monkeypatch):
+    # A tokenizer counting a token per character, four times the estimate the first cut is sized by.
+    monkeypatch.setattr(splitter_utils, "get_token_counter", lambda name: len)
+    splitter = StructuredTextSplitter(chunk_size=40, chunk_overlap=0, tokenizer="chars")
+    text = "# Specs\n\n" + paragraph("w", 200) + "\n\n" + "x" * 500
+    chunks = splitter.split_text(text)
+    assert max(len(chunk) for chunk in chunks) <= 40
+    # Nothing is lost either, including the heading in front of the oversized paragraph.
+    assert chunks[0] == "# Specs"
+    assert "".join(chunks).replace(" ", "").replace("\n", "") == text.replace(" ", "").replace("\n", "")
+
+def test_long_unbroken_text_is_cut_without_losing_characters():
+    text = "".join(chr(ord("a") + i % 26) for i in range(200_000))
+    pieces = list(split_long(text, 1000))
+    assert all(len(piece) == 1000 for _, piece in pieces)
+    assert "".join(piece for _, piece in pieces) == text
+
+    words = " ".join(f"word{i}" for i in range(100_000))
+    pieces = list(split_long(words, 1000))
+    assert all(len(piece) <= 1000 for _, piece in pieces)
+    assert "".join(separator + piece for separator, piece in pieces) == words
+
+    splitter = StructuredTextSplitter(chunk_size=100, chunk_overlap=0)
+    chunks = splitter.split_text(text)
+    assert "".join(chunks) == text
+    assert max(splitter.count_tokens(chunk) for chunk in chunks) <= 100
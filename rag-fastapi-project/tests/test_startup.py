@@ -0,0 +1,11 @@
+
+from benchmark_startup import IMPORT_BUDGET, measure_own_import
+
+# Allowance for timing noise on a busy machine, on top of the budget.
+TOLERANCE = 0.15
+
+def test_import_stays_within_budget():
+    imports, dependencies = measure_own_import(runs=3)
+    assert imports - dependencies <= IMPORT_BUDGET + TOLERANCE, (
+        f"import main took {imports:.3f}s, {imports - dependencies:.3f}s more than its dependencies"
+    )
@@ -0,0 +1,36 @@
+
+from chroma_utils import VectorStoreManager
+import chromadb
+import pytest
+
+def test_collection_created_without_metadata_opens(tmp_path):
+    path = str(tmp_path / "chroma_db")
+    legacy = chromadb.PersistentClient(path=path).create_collection("legacy-docs")
+    assert legacy.metadata is None
+    legacy.add(ids=["chunk-1"], embeddings=[[1.0] + [0.0] * 383], documents=["Part XJ-42 is the blue widget."])
+
+    manager = VectorStoreManager(path)
+    store = manager.get("legacy-docs")
+    # Collections from before embedding backends were recorded were embedded with OpenAI.
+    assert store.embeddings.model_name == "stub-embedding"
+    assert manager.get("legacy-docs", embedding_backend="openai") is store
+    with pytest.raises(ValueError):
+        manager.get("legacy-docs", embedding_backend="local")
+
+    manager.warm_up(["legacy-docs"])
+    assert manager.ready
+    assert [document.id for document in store.similarity_search("blue widget", k=1)] == ["chunk-1"]
+
+def test_ef_search_applied_to_existing_collection(tmp_path, monkeypatch):
+    import chroma_utils
+    path = str(tmp_path / "chroma_db")
+    chromadb.PersistentClient(path=path).create_collection("tuned-docs", metadata={"hnsw:search_ef": 10})
+
+    monkeypatch.setattr(chroma_utils, "HNSW_EF_SEARCH", 64)
+    collection = VectorStoreManager(path).get("tuned-docs")._collection
+    assert collection.configuration["hnsw"]["ef_search"] == 64
+
+    # Left unset, the collection keeps whatever it has.
+    monkeypatch.setattr(chroma_utils, "HNSW_EF_SEARCH", None)
+    collection = VectorStoreManager(path).get("tuned-docs")._collection
+    assert collection.configuration["hnsw"]["ef_search"] == 64
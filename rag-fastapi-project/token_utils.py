@@ -0,0 +1,12 @@
+
+def count_tokens(text):
+    # Rough estimate (~4 characters per token) that avoids loading a tokenizer on the hot path.
+    return len(text) // 4 + 1
+
+def get_token_counter(name="estimate"):
+    """Return a token counting function: the estimate above, or a tiktoken encoding by name."""
+    if name == "estimate":
+        return count_tokens
+    import tiktoken
+    encoding = tiktoken.get_encoding(name)
+    return lambda text: len(encoding.encode(text, disallowed_special=()))